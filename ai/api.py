@@ -1,6 +1,7 @@
 import anchorpoint as ap
 import os
 
+from ai.constants import OPENAI_API_BASE_URL
 from common.settings import tagger_settings
 
 
@@ -14,4 +15,4 @@ def init_openai_key() -> str:
     return open_api_key
 
 
-OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
+OPENAI_API_URL = f"{OPENAI_API_BASE_URL}/chat/completions"
@@ -0,0 +1,124 @@
+import io
+import json
+import time
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional
+
+from ai.client import OpenAIClient
+from common.logging import log
+
+batch_endpoint = "/v1/chat/completions"
+completion_window = "24h"
+
+# limits of a single batch input file
+max_batch_requests = 50_000
+max_batch_file_size = 190 * 1024 * 1024
+
+finished_statuses = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchRequest(NamedTuple):
+    custom_id: str
+    body: dict[str, Any]
+
+
+def encode_batch_request(request: BatchRequest) -> bytes:
+    line = {"custom_id": request.custom_id, "method": "POST", "url": batch_endpoint, "body": request.body}
+    return json.dumps(line).encode("utf-8") + b"\n"
+
+
+def split_batch_files(lines: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Join encoded request lines into JSONL files that stay within the request count and size limits of a batch
+    """
+    buffer = io.BytesIO()
+    count = 0
+    for line in lines:
+        if count and (count == max_batch_requests or buffer.tell() + len(line) > max_batch_file_size):
+            yield buffer.getvalue()
+            buffer = io.BytesIO()
+            count = 0
+        buffer.write(line)
+        count += 1
+    if count:
+        yield buffer.getvalue()
+
+
+def submit_batch(client: OpenAIClient, batch_file: bytes, metadata: Optional[dict[str, str]] = None) -> str:
+    """
+    Upload a JSONL batch file and start a batch of chat completions
+    :return str: The batch id
+    """
+    uploaded = client.upload_file("batch.jsonl", batch_file, "batch")
+    response = client.post(client.url("batches"), {
+        "input_file_id": uploaded["id"],
+        "endpoint": batch_endpoint,
+        "completion_window": completion_window,
+        "metadata": metadata or {},
+    })
+    batch = response.json()
+    request_count = batch_file.count(b"\n")
+    log(f"Submitted batch {batch['id']} ({request_count} requests, {len(batch_file) / 1024:.0f} KB)")
+    return batch["id"]
+
+
+def get_batch(client: OpenAIClient, batch_id: str) -> dict[str, Any]:
+    return client.get(f"batches/{batch_id}").json()
+
+
+def wait_for_batch(
+        client: OpenAIClient, batch_id: str, poll_interval: float = 30,
+        is_canceled: Callable[[], bool] = lambda: False,
+        on_status: Optional[Callable[[dict[str, Any]], None]] = None) -> Optional[dict[str, Any]]:
+    """
+    Poll a batch until it is finished
+    :param client: Client to poll with
+    :param batch_id: Id returned by `submit_batch`
+    :param poll_interval: Seconds between two polls
+    :param is_canceled: Checked every second, waiting stops once it returns True. The batch itself keeps running
+    :param on_status: Called with the batch object after every poll
+    :return Optional[dict[str, Any]]: The finished batch object, None if waiting was canceled
+    """
+    while True:
+        batch = get_batch(client, batch_id)
+        if on_status is not None:
+            on_status(batch)
+        if batch["status"] in finished_statuses:
+            return batch
+
+        deadline = time.monotonic() + poll_interval
+        while time.monotonic() < deadline:
+            if is_canceled():
+                return None
+            time.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+
+
+def download_batch_results(client: OpenAIClient, batch: dict[str, Any]) -> dict[str, dict[str, Any]]:
+    """
+    Results of a finished batch, requests that failed map to an object with an "error" key.
+    Expired and cancelled batches may still have results for a part of their requests.
+    :return dict[str, dict[str, Any]]: Response body or error of every request that has one, by custom id
+    """
+    results = {}
+    for file_key in ("output_file_id", "error_file_id"):
+        file_id = batch.get(file_key)
+        if not file_id:
+            continue
+        for line in client.get(f"files/{file_id}/content").iter_lines():
+            if not line:
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") == 200:
+                results[result["custom_id"]] = response["body"]
+            else:
+                error = result.get("error") or response.get("body", {}).get("error") or "Unknown error"
+                results[result["custom_id"]] = {"error": error}
+    return results
+
+
+def get_request_counts(batch: dict[str, Any]) -> tuple[int, int]:
+    """
+    :return tuple[int, int]: Finished (completed or failed) and total number of requests of a batch
+    """
+    counts = batch.get("request_counts") or {}
+    return counts.get("completed", 0) + counts.get("failed", 0), counts.get("total", 0)
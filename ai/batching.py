@@ -0,0 +1,110 @@
+import threading
+import time
+import typing
+
+T = typing.TypeVar("T")
+R = typing.TypeVar("R")
+
+# batch size of estimates and the first request, later requests adapt to the responses
+images_per_request = 10
+max_images_per_request = 20
+# output tokens a single request may use, limits the batch size together with the tokens per image
+request_output_token_budget = 4096
+# requests slower than this stop growing the batch size
+target_request_latency = 30.0
+
+
+class AdaptiveBatchSizer:
+    """
+    Chooses how many items go into the next request, additive increase, multiplicative decrease:
+    the size grows by one after a complete and fast response and is halved after a short or failed one.
+    It never exceeds what the output token budget allows for the observed output tokens per item.
+    Thread-safe, results are usually recorded from worker threads.
+    """
+
+    def __init__(
+            self, initial_size: int, max_size: int, token_budget: int, tokens_per_item: float,
+            target_latency: float = 30.0, min_size: int = 1):
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size)
+        self.token_budget = token_budget
+        self.tokens_per_item = tokens_per_item
+        self.target_latency = target_latency
+        self.error_rate = 0.0
+        self._size = min(max(initial_size, min_size), self.max_size)
+        self._lock = threading.Lock()
+
+    def next_size(self) -> int:
+        with self._lock:
+            budget_size = int(self.token_budget // max(1.0, self.tokens_per_item))
+            return max(self.min_size, min(self._size, budget_size))
+
+    def record_output_tokens(self, item_count: int, output_tokens: int):
+        """
+        Refine the output tokens per item from the usage of a response
+        """
+        if item_count <= 0 or output_tokens <= 0:
+            return
+        with self._lock:
+            self.tokens_per_item = 0.8 * self.tokens_per_item + 0.2 * output_tokens / item_count
+
+    def record(self, size: int, latency: float, complete: bool):
+        """
+        :param size: Number of items that were requested
+        :param latency: Seconds the request took
+        :param complete: Whether a result came back for every item
+        """
+        with self._lock:
+            self.error_rate = 0.8 * self.error_rate + 0.2 * (0.0 if complete else 1.0)
+            if not complete:
+                self._size = max(self.min_size, min(self._size, size) // 2)
+            elif latency > self.target_latency:
+                self._size = max(self.min_size, self._size - 1)
+            elif size >= self._size and self.error_rate < 0.1:
+                # only results at the current size prove it works, older in-flight ones don't
+                self._size = min(self.max_size, self._size + 1)
+
+
+def request_with_bisection(
+        items: list[T], request: typing.Callable[[list[T]], typing.Optional[list[R]]],
+        sizer: typing.Optional[AdaptiveBatchSizer] = None) -> list[typing.Optional[R]]:
+    """
+    Request results for a list of items, a response with fewer results than items is discarded,
+    as it's unknown which items are missing, and both halves are requested again.
+    A failed request or a response without any result fails all items without splitting them,
+    retrying smaller requests would only multiply the failures.
+    :param items: Items to request
+    :param request: Function returning one result per item, in order, None if the request failed
+    :param sizer: Informed about the outcome of the full request, the smaller retries don't change the size
+    :return list[Optional[R]]: One result per item, None for items that got no result
+    """
+    start = time.perf_counter()
+    response = request(items)
+    complete = response is not None and len(response) >= len(items)
+    if sizer is not None:
+        sizer.record(len(items), time.perf_counter() - start, complete)
+
+    if complete:
+        return list(response[:len(items)])
+    if not response or len(items) == 1:
+        return [None] * len(items)
+
+    middle = len(items) // 2
+    return request_with_bisection(items[:middle], request) + request_with_bisection(items[middle:], request)
+
+
+def iter_adaptive_batches(items: typing.Iterable[T], sizer: AdaptiveBatchSizer) -> typing.Iterator[list[T]]:
+    """
+    Group items into batches, the size of every batch is asked from the sizer when the batch is taken
+    """
+    iterator = iter(items)
+    while True:
+        batch = []
+        size = sizer.next_size()
+        for item in iterator:
+            batch.append(item)
+            if len(batch) >= size:
+                break
+        if not batch:
+            return
+        yield batch
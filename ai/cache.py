@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from common.logging import log
+from common.paths import get_data_directory
+
+
+def fingerprint(*parts: Any) -> str:
+    """
+    Stable hash of everything that influences a response, e.g. prompt, schema and image size
+    """
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of parsed OpenAI responses keyed by file content hash, request fingerprint and model
+    """
+
+    def __init__(self, path: str, max_age_days: int, max_size_mb: int):
+        self.path = path
+        self.max_age = max_age_days * 24 * 60 * 60
+        self.max_size = max_size_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(file_hash: str, request_fingerprint: str, model: str) -> str:
+        return fingerprint(file_hash, request_fingerprint, model)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            now = time.time()
+            if now - created > self.max_age:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                return None
+            self._connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+        return json.loads(value)
+
+    def put(self, key: str, value: Any):
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now))
+            self._connection.commit()
+
+    def evict(self):
+        with self._lock:
+            expired = self._connection.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,)).rowcount
+
+            # drop least recently used entries until the cache fits into its size cap
+            total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            evicted = 0
+            if total_size > self.max_size:
+                rows = self._connection.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+                keys = []
+                for key, size in rows:
+                    if total_size <= self.max_size:
+                        break
+                    keys.append((key,))
+                    total_size -= size
+                self._connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+                evicted = len(keys)
+            self._connection.commit()
+
+        if expired or evicted:
+            log(f"Response cache: removed {expired} expired and {evicted} least recently used entries")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def open_response_cache(max_age_days: int, max_size_mb: int) -> ResponseCache:
+    cache = ResponseCache(os.path.join(get_data_directory(), "responses.db"), max_age_days, max_size_mb)
+    cache.evict()
+    return cache
@@ -0,0 +1,133 @@
+import gzip
+import json
+import os
+import threading
+import time
+from typing import Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ai.constants import OPENAI_API_BASE_URL
+from ai.retry import RateLimiter, RetryPolicy
+from common.logging import log
+from common.metrics import run_metrics, span
+from common.settings import tagger_settings
+
+connect_timeout = 10
+
+
+class OpenAIClient:
+    """
+    Thread-safe OpenAI client reusing keep-alive connections between requests.
+    Failed requests are retried with backoff and the send rate follows the rate limits reported by the API.
+    """
+
+    def __init__(
+            self, api_key: str, timeout: float, gzip_requests: bool = False, pool_size: int = 10,
+            max_retries: int = 5, base_url: str = OPENAI_API_BASE_URL):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, timeout)
+        self.gzip_requests = gzip_requests
+        self.retry_policy = RetryPolicy(max_retries)
+        self.rate_limiter = RateLimiter()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}"
+        })
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def post(self, url: str, payload: dict[str, Any], estimated_tokens: int = 0) -> requests.Response:
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.gzip_requests:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+
+        run_metrics.add("uploaded_bytes", len(body))
+        return self.request("POST", url, estimated_tokens, data=body, headers=headers)
+
+    def request(self, method: str, url: str, estimated_tokens: int = 0, **kwargs) -> requests.Response:
+        """
+        Send a request, waiting for the rate limits and retrying failures
+        :param method: HTTP method
+        :param url: Absolute URL, see `url` for paths relative to the API
+        :param estimated_tokens: Tokens the request is expected to use, for the rate limiter
+        :param kwargs: Passed on to requests, e.g. data, files or headers
+        :return requests.Response: The successful response
+        """
+        attempt = 0
+        while True:
+            self.rate_limiter.wait(estimated_tokens)
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                self.rate_limiter.update(response.headers)
+                response.raise_for_status()
+                return response
+            except requests.exceptions.RequestException as e:
+                if not self.retry_policy.should_retry(attempt, e):
+                    raise
+
+                delay = self.retry_policy.delay(attempt, e)
+                attempt += 1
+                run_metrics.add("request_retries")
+                log(f"Request failed: {e}, retrying in {delay:.2f}s [{attempt}/{self.retry_policy.max_retries}]")
+                if e.response is not None and e.response.status_code == 429:
+                    # hold back all workers, not only the one that hit the limit
+                    self.rate_limiter.block(delay)
+                else:
+                    time.sleep(delay)
+
+    def chat_completion(self, payload: dict[str, Any], estimated_tokens: int = 0) -> dict[str, Any]:
+        with span("request"):
+            result = self.post(self.url("chat/completions"), payload, estimated_tokens).json()
+        record_usage(result.get("usage") or {})
+        return result
+
+    def get(self, path: str) -> requests.Response:
+        return self.request("GET", self.url(path))
+
+    def upload_file(self, file_name: str, data: bytes, purpose: str) -> dict[str, Any]:
+        run_metrics.add("uploaded_bytes", len(data))
+        # multipart bodies can't be replayed from a stream, so the file is passed as bytes
+        return self.request(
+            "POST", self.url("files"), data={"purpose": purpose},
+            files={"file": (file_name, data, "application/jsonl")}).json()
+
+    def close(self):
+        self.session.close()
+
+
+def record_usage(usage: dict[str, Any]):
+    run_metrics.add("requests")
+    run_metrics.add("prompt_tokens", usage.get("prompt_tokens", 0))
+    run_metrics.add("completion_tokens", usage.get("completion_tokens", 0))
+    run_metrics.add("cached_tokens", (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0))
+
+
+_client: Optional[OpenAIClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> OpenAIClient:
+    # imported here, the key setup shows its errors in the Anchorpoint UI, which the headless tagger doesn't have
+    from ai.api import init_openai_key
+
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAIClient(
+                init_openai_key(),
+                tagger_settings.request_timeout,
+                tagger_settings.request_gzip,
+                max(10, tagger_settings.file_max_concurrent_requests),
+                tagger_settings.request_max_retries,
+                # same variable as the OpenAI SDK, e.g. for a proxy or a local mock server
+                os.environ.get("OPENAI_BASE_URL") or OPENAI_API_BASE_URL)
+        return _client
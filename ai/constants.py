@@ -1,4 +1,12 @@
+OPENAI_API_BASE_URL = "https://api.openai.com/v1"
 input_token_price = 0.00000015
 # $0.00765 for 1 million pixels
 input_pixel_price = 0.00765 / 1000000
 output_token_price = 0.00000016
+# cached prompt tokens are billed at half the input price
+cached_input_price_factor = 0.5
+openai_model = "gpt-4o-mini"
+# Batch API requests are billed at half the price
+batch_price_factor = 0.5
+# longest side of the images sent for tagging
+preview_max_dimension = 128
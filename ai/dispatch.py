@@ -0,0 +1,78 @@
+import concurrent.futures
+import typing
+
+T = typing.TypeVar("T")
+R = typing.TypeVar("R")
+
+
+def dispatch_batches(
+        batches: typing.Iterable[T],
+        request: typing.Callable[[T], R],
+        on_result: typing.Callable[[T, R], None],
+        max_workers: int,
+        is_canceled: typing.Callable[[], bool] = lambda: False,
+        poll_interval: float = 0.25,
+        on_error: typing.Optional[typing.Callable[[T, Exception], None]] = None) -> bool:
+    """
+    Send batches with at most `max_workers` requests in flight.
+    `request` runs on worker threads, `on_result` runs on the calling thread as soon as a batch completes,
+    so results can be written and counted without extra locking.
+    Each batch is taken from `batches` exactly once, by the calling thread.
+    :param batches: Batches (or single items) to send, consumed lazily
+    :param request: Function sending a single batch
+    :param on_result: Function applying the result of a single batch
+    :param max_workers: Maximum number of batches in flight
+    :param is_canceled: Polled between completions, no new batches are sent once it returns True.
+        Batches already in flight are waited for and applied, their requests were paid for.
+    :param poll_interval: Seconds to wait for a completion before polling `is_canceled` again
+    :param on_error: Called on the calling thread when `request` raises, by default the error is re-raised
+    :return bool: False if the dispatch was canceled
+    """
+    max_workers = max(1, max_workers)
+    pending = iter(batches)
+    in_flight: dict[concurrent.futures.Future, T] = {}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    def fill():
+        while len(in_flight) < max_workers:
+            batch = next(pending, None)
+            if batch is None:
+                return
+            in_flight[executor.submit(request, batch)] = batch
+
+    def complete(futures: typing.Iterable[concurrent.futures.Future]):
+        for future in futures:
+            batch = in_flight.pop(future)
+            error = future.exception()
+            if error is None:
+                on_result(batch, future.result())
+            elif on_error is not None and isinstance(error, Exception):
+                on_error(batch, error)
+            else:
+                raise error
+
+    canceled = False
+    try:
+        fill()
+        while in_flight:
+            canceled = is_canceled()
+            if canceled:
+                break
+
+            done, _ = concurrent.futures.wait(
+                in_flight, timeout=poll_interval, return_when=concurrent.futures.FIRST_COMPLETED)
+            complete(done)
+
+            canceled = is_canceled()
+            if canceled:
+                break
+            fill()
+
+        if canceled:
+            # requests that are already running are waited for, their results are applied like any other
+            executor.shutdown(wait=True, cancel_futures=True)
+            complete([future for future in in_flight if not future.cancelled()])
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return not canceled
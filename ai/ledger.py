@@ -0,0 +1,260 @@
+import os
+import sqlite3
+import threading
+import time
+import typing
+import uuid
+from typing import Any, Optional
+
+from ai.constants import cached_input_price_factor, input_pixel_price, input_token_price, output_token_price
+from common.logging import log
+from common.metrics import run_metrics
+from common.paths import get_state_directory
+
+# reservations of crashed runs stop blocking the budget after this many seconds
+reservation_timeout = 60 * 60
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def estimate_cost(input_tokens: int, pixel_count: int = 0, output_tokens: int = 0) -> float:
+    return input_tokens * input_token_price + pixel_count * input_pixel_price + output_tokens * output_token_price
+
+
+def usage_cost(usage: dict[str, Any], price_factor: float = 1.0) -> float:
+    """
+    Actual cost of a response from its usage block, image tokens are part of the prompt tokens
+    """
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+    completion_tokens = usage.get("completion_tokens", 0)
+    cost = (
+            (prompt_tokens - cached_tokens) * input_token_price
+            + cached_tokens * input_token_price * cached_input_price_factor
+            + completion_tokens * output_token_price)
+    return cost * price_factor
+
+
+class UsageLedger:
+    """
+    Token usage and cost of every response, shared by all runs on this machine.
+    Runs reserve the estimated cost of a request before sending it, so concurrent runs,
+    also in other processes, can't overrun the budget together.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # autocommit, transactions are started explicitly where other processes must be locked out
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            "run_id TEXT NOT NULL, model TEXT NOT NULL, prompt_tokens INTEGER NOT NULL, "
+            "completion_tokens INTEGER NOT NULL, cached_tokens INTEGER NOT NULL, cost REAL NOT NULL, "
+            "recorded REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS usage_recorded ON usage (recorded)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS usage_run ON usage (run_id)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "run_id TEXT PRIMARY KEY, action TEXT NOT NULL, estimated_cost REAL NOT NULL, started REAL NOT NULL)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS reservations ("
+            "id INTEGER PRIMARY KEY, run_id TEXT NOT NULL, cost REAL NOT NULL, expires REAL NOT NULL)")
+
+    def start_run(self, action: str, estimated_cost: float) -> str:
+        run_id = uuid.uuid4().hex
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO runs (run_id, action, estimated_cost, started) VALUES (?, ?, ?, ?)",
+                (run_id, action, estimated_cost, time.time()))
+        return run_id
+
+    def _committed_cost(self, since: float, now: float) -> float:
+        spent = self._connection.execute(
+            "SELECT COALESCE(SUM(cost), 0) FROM usage WHERE recorded >= ?", (since,)).fetchone()[0]
+        reserved = self._connection.execute(
+            "SELECT COALESCE(SUM(cost), 0) FROM reservations WHERE expires > ?", (now,)).fetchone()[0]
+        return spent + reserved
+
+    def reserve(
+            self, run_id: str, cost: float, limit: float, since: float,
+            timeout: float = reservation_timeout) -> Optional[int]:
+        """
+        Reserve the cost of a request if the spending since `since`, open reservations included, stays within `limit`
+        :return Optional[int]: Id of the reservation, None if the request would exceed the limit
+        """
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock right away, the check and the insert are atomic across processes
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute("DELETE FROM reservations WHERE expires <= ?", (now,))
+                if self._committed_cost(since, now) + cost > limit:
+                    self._connection.execute("COMMIT")
+                    return None
+                reservation_id = self._connection.execute(
+                    "INSERT INTO reservations (run_id, cost, expires) VALUES (?, ?, ?)",
+                    (run_id, cost, now + timeout)).lastrowid
+                self._connection.execute("COMMIT")
+                return reservation_id
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def release(self, reservation_id: Optional[int]):
+        if reservation_id is None:
+            return
+        with self._lock:
+            self._connection.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,))
+
+    def record(
+            self, run_id: str, model: str, usage: dict[str, Any], price_factor: float = 1.0,
+            reservation_id: Optional[int] = None) -> float:
+        """
+        Store the usage of a response and drop the reservation it was sent with
+        :return float: Actual cost of the response
+        """
+        cost = usage_cost(usage, price_factor)
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "INSERT INTO usage (run_id, model, prompt_tokens, completion_tokens, cached_tokens, cost, recorded) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (run_id, model, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0),
+                     (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0), cost, time.time()))
+                if reservation_id is not None:
+                    self._connection.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,))
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return cost
+
+    def spent_since(self, since: float) -> float:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COALESCE(SUM(cost), 0) FROM usage WHERE recorded >= ?", (since,)).fetchone()[0]
+
+    def run_cost(self, run_id: str) -> tuple[float, float]:
+        """
+        :return tuple[float, float]: Estimated and actual cost of a run
+        """
+        with self._lock:
+            estimated = self._connection.execute(
+                "SELECT estimated_cost FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            actual = self._connection.execute(
+                "SELECT COALESCE(SUM(cost), 0) FROM usage WHERE run_id = ?", (run_id,)).fetchone()[0]
+        return (estimated[0] if estimated else 0.0), actual
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class RunBudget:
+    """
+    Usage accounting of a single run against the shared ledger, with an optional spending limit over a period.
+    Estimates are scaled by how far the actual cost of the run's earlier responses was off,
+    so the reservations of later requests are realistic.
+    """
+
+    def __init__(
+            self, ledger: UsageLedger, action: str, estimated_cost: float, limit: float = 0.0,
+            period_days: int = 30, price_factor: float = 1.0):
+        """
+        :param ledger: Shared ledger
+        :param action: Name of the action, stored with the run
+        :param estimated_cost: Cost shown before the run was started
+        :param limit: Maximum cost of all runs within the period, 0 for no limit
+        :param period_days: Length of the rolling period the limit applies to
+        :param price_factor: Discount of the requests, e.g. for the Batch API
+        """
+        self.ledger = ledger
+        self.limit = limit
+        self.period = period_days * 24 * 60 * 60
+        self.price_factor = price_factor
+        self.run_id = ledger.start_run(action, estimated_cost)
+        self.exhausted = False
+        self._lock = threading.Lock()
+        self._estimated_total = 0.0
+        self._actual_total = 0.0
+
+    def _calibrated(self, estimated_cost: float) -> float:
+        with self._lock:
+            if self._estimated_total <= 0:
+                return estimated_cost
+            return estimated_cost * max(1.0, self._actual_total / self._estimated_total)
+
+    def reserve(self, estimated_cost: float, timeout: float = reservation_timeout) -> Optional[int]:
+        """
+        :raise BudgetExceeded: If the request would exceed the limit, no further requests should be sent then
+        """
+        if self.limit <= 0:
+            return None
+        cost = self._calibrated(estimated_cost) * self.price_factor
+        reservation_id = self.ledger.reserve(self.run_id, cost, self.limit, time.time() - self.period, timeout)
+        if reservation_id is None:
+            self.exhausted = True
+            raise BudgetExceeded(f"A request of ${cost:.4f} would exceed the budget of ${self.limit:g}")
+        return reservation_id
+
+    def release(self, reservation_id: Optional[int]):
+        self.ledger.release(reservation_id)
+
+    def record(
+            self, usage: dict[str, Any], model: str, estimated_cost: float = 0.0,
+            reservation_id: Optional[int] = None) -> float:
+        cost = self.ledger.record(self.run_id, model, usage, self.price_factor, reservation_id)
+        run_metrics.add("cost_usd", cost)
+        if estimated_cost > 0:
+            run_metrics.add("estimated_cost_usd", estimated_cost * self.price_factor)
+            with self._lock:
+                self._estimated_total += estimated_cost * self.price_factor
+                self._actual_total += cost
+        return cost
+
+    def call(self, send: typing.Callable[[], dict[str, Any]], estimated_cost: float, model: str) -> dict[str, Any]:
+        """
+        Send a request within the budget and record its usage
+        :param send: Sends the request and returns the parsed response
+        :param estimated_cost: Expected cost of the request
+        :param model: Model of the request
+        :raise BudgetExceeded: If the request would exceed the limit, it is not sent then
+        """
+        reservation_id = self.reserve(estimated_cost)
+        try:
+            result = send()
+        except BaseException:
+            self.release(reservation_id)
+            raise
+        self.record(result.get("usage") or {}, model, estimated_cost, reservation_id)
+        return result
+
+    def spent_in_period(self) -> float:
+        return self.ledger.spent_since(time.time() - self.period)
+
+    def report(self) -> str:
+        estimated, actual = self.ledger.run_cost(self.run_id)
+        # runs without an estimate up front report the sum of their request estimates
+        estimated = estimated or self._estimated_total
+        text = f"Estimated cost ${estimated:.4f}, actual cost ${actual:.4f}"
+        if self.limit > 0:
+            text += f", ${self.spent_in_period():.4f} of the ${self.limit:g} budget used"
+        return text
+
+
+_usage_ledger: Optional[UsageLedger] = None
+_usage_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger() -> UsageLedger:
+    global _usage_ledger
+    with _usage_ledger_lock:
+        if _usage_ledger is None:
+            _usage_ledger = UsageLedger(os.path.join(get_state_directory(), "usage.db"))
+            log(f"Usage ledger: {_usage_ledger.path}")
+        return _usage_ledger
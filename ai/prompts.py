@@ -0,0 +1,189 @@
+import base64
+import json
+import typing
+from typing import Any
+
+from ai.constants import openai_model
+from common.metrics import span
+from common.settings import TaggerSettings
+
+if typing.TYPE_CHECKING:
+    from image.resize import PreprocessedImage
+
+# output tokens expected per tagged image or folder, for estimates
+output_token_count = 200
+
+folder_system_prompt = "You are a folder tagging AI."
+
+
+def _tag_list_schema() -> dict[str, Any]:
+    return {
+        "type": "array",
+        "items": {
+            "type": "string",
+            "additionalProperties": False,
+        }
+    }
+
+
+def _build_response_format(categories: list[str], wrap_in_array: bool) -> dict[str, Any]:
+    items = {
+        "type": "object",
+        "additionalProperties": False,
+        "required": list(categories),
+        "properties": {category: _tag_list_schema() for category in categories}
+    }
+    root_key = "tags" if wrap_in_array else "items"
+    return {"type": "json_schema", "json_schema":
+        {
+            "name": "TaggingSchema",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": [root_key],
+                "properties": {
+                    root_key: {"type": "array", "items": items} if wrap_in_array else items
+                },
+                "name": "TaggingSchema"
+            }
+        }}
+
+
+def get_file_categories(settings: TaggerSettings) -> dict[str, str]:
+    """
+    :return dict[str, str]: Enabled response categories of file tagging and the attribute each one is written to
+    """
+    categories = {}
+    if settings.file_label_ai_types:
+        categories["types"] = "AI-Types"
+    if settings.file_label_ai_genres:
+        categories["genres"] = "AI-Genres"
+    if settings.file_label_ai_objects:
+        categories["objects"] = "AI-Objects"
+    return categories
+
+
+def get_folder_categories(settings: TaggerSettings) -> dict[str, str]:
+    """
+    :return dict[str, str]: Enabled response categories of folder tagging and the attribute each one is written to
+    """
+    categories = {}
+    if settings.folder_use_ai_engines:
+        categories["engines"] = "AI-Engines"
+    if settings.folder_use_ai_types:
+        categories["types"] = "AI-Types"
+    if settings.folder_use_ai_genres:
+        categories["genres"] = "AI-Genres"
+    return categories
+
+
+def build_file_prompt(settings: TaggerSettings) -> str:
+    prompt = "You are a file tagging AI. When asked, write tags for each file in the order they were presented: "
+
+    if settings.file_label_ai_types:
+        prompt += "content types (Texture, Sprite, Model, VFX, SFX, etc.),"
+
+    if settings.file_label_ai_genres:
+        prompt += "detailed genres,"
+
+    if settings.file_label_ai_objects:
+        prompt += (
+            f"objects and other keywords in the image (min {settings.file_label_ai_objects_min}, "
+            f"max {settings.file_label_ai_objects_max}), ")
+
+    prompt += "fill all tags for each image."
+    return prompt
+
+
+def build_file_response_format(settings: TaggerSettings) -> dict[str, Any]:
+    return _build_response_format(list(get_file_categories(settings)), True)
+
+
+def build_folder_prompt(settings: TaggerSettings) -> str:
+    prompt = "Write tags for the folder:"
+
+    if settings.folder_use_ai_engines:
+        prompt += "required game engines (e.g. UE if it has *.uasset or Unity if it has *.unitypackage) or 'All' if assets have common types, "
+
+    if settings.folder_use_ai_types:
+        prompt += "content types (Texture, Sprite, Model, VFX, SFX, etc.), "
+
+    if settings.folder_use_ai_genres:
+        prompt += "detailed genres, "
+
+    prompt += "fill all tags"
+    return prompt
+
+
+def build_folder_response_format(settings: TaggerSettings) -> dict[str, Any]:
+    return _build_response_format(list(get_folder_categories(settings)), False)
+
+
+def build_folder_request_prompt(prompt: str, folder_name: str, folder_summary: str) -> str:
+    return f"{prompt}\nFolder name: {folder_name}\nFolder structure:\n{folder_summary}"
+
+
+def build_uploads_payload(
+        in_prompt: str, file_names: list[str], uploads: list["PreprocessedImage"], response_format: dict[str, Any],
+        model: str = openai_model) -> tuple[dict[str, Any], int]:
+    """
+    :param in_prompt: System prompt
+    :param file_names: Names of the tagged files, in the order of the uploads
+    :param uploads: Preprocessed previews of the files
+    :param response_format: Schema of the response
+    :param model: Model to request
+    :return tuple[dict[str, Any], int]: Chat completion payload tagging the images and its estimated token count
+    """
+    content = [{
+        "type": "text",
+        "text": "Please tag these images: " + ", ".join(file_names)
+    }]
+    for upload in uploads:
+        upload_base64 = base64.b64encode(upload.data).decode("utf-8")
+        content.append({
+            "type": "image_url",
+            "image_url": {"url": f"data:{upload.mime_type};base64,{upload_base64}"}
+        })
+
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": in_prompt},
+            {"role": "user", "content": content}
+        ],
+        "response_format": response_format
+    }
+
+    estimated_tokens = len(in_prompt) // 4 + output_token_count * len(uploads)
+    return payload, estimated_tokens
+
+
+def build_folder_payload(
+        in_prompt: str, response_format: dict[str, Any], model: str = openai_model) -> tuple[dict[str, Any], int]:
+    """
+    :return tuple[dict[str, Any], int]: Chat completion payload tagging a folder and its estimated token count
+    """
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": folder_system_prompt},
+            {"role": "user", "content": in_prompt}
+        ],
+        "response_format": response_format
+    }
+    return payload, len(in_prompt) // 4 + output_token_count
+
+
+def parse_response_content(result: dict[str, Any]) -> dict[str, Any]:
+    with span("parse"):
+        result_content = result["choices"][0]["message"]["content"].strip()
+        return json.loads(result_content)
+
+
+def parse_tags_response(result: dict[str, Any]) -> list[Any]:
+    return parse_response_content(result).get("tags", [])
+
+
+def parse_folder_response(result: dict[str, Any]) -> dict[str, Any]:
+    return parse_response_content(result)["items"]
@@ -0,0 +1,161 @@
+import email.utils
+import random
+import re
+import threading
+import time
+from typing import Mapping, Optional
+
+import requests
+
+from common.logging import log
+
+retryable_status_codes = {408, 409, 429, 500, 502, 503, 504}
+
+_duration_pattern = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_duration_units = {"ms": 0.001, "s": 1, "m": 60, "h": 60 * 60}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse durations like "1s", "6m0s" or "20ms" used by the x-ratelimit-reset-* headers
+    :return Optional[float]: Duration in seconds or None if the value can not be parsed
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    matches = _duration_pattern.findall(value)
+    if not matches:
+        return None
+    return sum(float(amount) * _duration_units[unit] for amount, unit in matches)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    # Retry-After may also be an HTTP date, anything else falls back to the computed backoff
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_date is None:
+        return None
+    return max(0.0, retry_date.timestamp() - time.time())
+
+
+def _parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """
+    Keeps the request rate below the requests and tokens per minute limits reported by the x-ratelimit-* headers
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+        self._last_request = 0.0
+        self._min_interval = 0.0
+        self._requests_remaining: Optional[int] = None
+        self._requests_reset_at = 0.0
+        self._tokens_remaining: Optional[int] = None
+        self._tokens_reset_at = 0.0
+
+    def wait(self, tokens: int = 0):
+        """
+        Block until a request using about `tokens` tokens can be sent, then reserve its share of the limits
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = max(self._blocked_until, self._last_request + self._min_interval) - now
+                if self._requests_remaining is not None and self._requests_remaining <= 0:
+                    delay = max(delay, self._requests_reset_at - now)
+                if self._tokens_remaining is not None and self._tokens_remaining < tokens:
+                    delay = max(delay, self._tokens_reset_at - now)
+
+                if delay <= 0:
+                    self._last_request = now
+                    if self._requests_remaining is not None:
+                        self._requests_remaining -= 1
+                    if self._tokens_remaining is not None:
+                        self._tokens_remaining -= tokens
+                    return
+
+            log(f"Rate limit: waiting {delay:.2f}s")
+            time.sleep(delay)
+
+    def block(self, seconds: float):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def update(self, headers: Mapping[str, str]):
+        now = time.monotonic()
+        limit_requests = _parse_int(headers.get("x-ratelimit-limit-requests"))
+        requests_remaining = _parse_int(headers.get("x-ratelimit-remaining-requests"))
+        requests_reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+        tokens_remaining = _parse_int(headers.get("x-ratelimit-remaining-tokens"))
+        tokens_reset = parse_duration(headers.get("x-ratelimit-reset-tokens"))
+
+        with self._lock:
+            if limit_requests:
+                # spread the requests evenly over the minute instead of bursting into the limit
+                self._min_interval = 60 / limit_requests
+            if requests_remaining is not None:
+                self._requests_remaining = requests_remaining
+                self._requests_reset_at = now + (requests_reset or 0)
+            if tokens_remaining is not None:
+                self._tokens_remaining = tokens_remaining
+                self._tokens_reset_at = now + (tokens_reset or 0)
+
+
+class RetryPolicy:
+    def __init__(self, max_retries: int, base_delay: float = 1, max_delay: float = 60):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        # exponential backoff with full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def should_retry(self, attempt: int, error: requests.exceptions.RequestException) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+            if error.response.status_code not in retryable_status_codes:
+                return False
+            # a 429 for an exhausted quota will not resolve by waiting
+            return "insufficient_quota" not in error.response.text
+        return False
+
+    def delay(self, attempt: int, error: requests.exceptions.RequestException) -> float:
+        response = error.response if isinstance(error, requests.exceptions.HTTPError) else None
+        if response is not None:
+            retry_after = parse_retry_after(response.headers)
+            if retry_after is not None:
+                return min(self.max_delay, retry_after)
+        return self.backoff(attempt)
@@ -0,0 +1,89 @@
+import json
+from typing import Any, Optional
+
+import requests
+
+from ai.batching import AdaptiveBatchSizer
+from ai.client import OpenAIClient
+from ai.ledger import BudgetExceeded, RunBudget
+from ai.prompts import parse_folder_response, parse_tags_response
+from common.logging import log_err
+
+# raised by answers that don't follow the response format, e.g. a refusal without content
+malformed_response_errors = (json.JSONDecodeError, KeyError, IndexError, AttributeError, TypeError)
+
+
+def parse_image_tags(result: dict[str, Any]) -> Optional[list[Any]]:
+    """
+    :return Optional[list[Any]]: Tags of every image in the chat completion, None if the answer is malformed
+    """
+    try:
+        tags = parse_tags_response(result)
+    except malformed_response_errors as e:
+        log_err(f"Failed to parse the response: {e!r}")
+        return None
+    if not isinstance(tags, list) or not all(isinstance(item, dict) for item in tags):
+        log_err(f"Unexpected tags in the response: {tags!r}")
+        return None
+    return tags
+
+
+def parse_folder_tags(result: dict[str, Any]) -> dict[str, Any]:
+    """
+    :return dict[str, Any]: Tags of the folder per category, {"error": ...} if the answer is malformed
+    """
+    try:
+        tags = parse_folder_response(result)
+    except malformed_response_errors as e:
+        return {"error": f"Invalid response from OpenAI: {e!r}"}
+    if not isinstance(tags, dict):
+        return {"error": f"Invalid response from OpenAI: {tags!r}"}
+    return tags
+
+
+def request_image_tags(
+        client: OpenAIClient, run_budget: RunBudget, payload: dict[str, Any], estimated_tokens: int,
+        estimated_cost: float, model: str, image_count: int,
+        sizer: Optional[AdaptiveBatchSizer] = None) -> Optional[list[Any]]:
+    """
+    Request the tags of images within the budget
+    :param client: Client sending the request
+    :param run_budget: Budget the request is reserved in and its usage recorded to
+    :param payload: Chat completion payload tagging the images
+    :param estimated_tokens: Tokens of the request, for the rate limiter
+    :param estimated_cost: Cost reserved for the request
+    :param model: Model of the request
+    :param image_count: Number of images in the payload
+    :param sizer: Informed about the output tokens per image
+    :return Optional[list[Any]]: Tags of every image, None if the request failed, was not sent
+        or the answer is malformed
+    """
+    if run_budget.exhausted:
+        return None
+    try:
+        result = run_budget.call(lambda: client.chat_completion(payload, estimated_tokens), estimated_cost, model)
+    except requests.exceptions.RequestException as e:
+        log_err(f"Request error: {e}")
+        return None
+    except BudgetExceeded as e:
+        log_err(str(e))
+        return None
+    if sizer is not None:
+        sizer.record_output_tokens(image_count, (result.get("usage") or {}).get("completion_tokens", 0))
+    return parse_image_tags(result)
+
+
+def request_folder_tags(
+        client: OpenAIClient, run_budget: RunBudget, payload: dict[str, Any], estimated_tokens: int,
+        estimated_cost: float, model: str) -> dict[str, Any]:
+    """
+    Request the tags of a folder within the budget
+    :return dict[str, Any]: Tags of the folder per category, {"error": ...} if the request failed
+        or the answer is malformed
+    :raise BudgetExceeded: If the request would exceed the budget, it is not sent then
+    """
+    try:
+        result = run_budget.call(lambda: client.chat_completion(payload, estimated_tokens), estimated_cost, model)
+    except requests.exceptions.RequestException as e:
+        return {"error": str(e)}
+    return parse_folder_tags(result)
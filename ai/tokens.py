@@ -1,7 +1,75 @@
-import tiktoken
+import functools
+import typing
+from typing import Iterable, Optional
 
+from ai.constants import openai_model
 
-def count_tokens(in_prompt, model="gpt-4o-mini"):
-    encoding = tiktoken.encoding_for_model(model)
-    tokens = encoding.encode(in_prompt)
-    return len(tokens)
+if typing.TYPE_CHECKING:
+    import tiktoken
+
+# prompts longer than this are estimated instead of fully encoded when no mode is requested
+approximate_threshold = 200_000
+approximate_sample_count = 32
+approximate_sample_size = 2048
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str = openai_model) -> "tiktoken.Encoding":
+    # imported on first use, loading the tokenizer takes longer than everything else an action does before its dialog
+    import tiktoken
+
+    return tiktoken.encoding_for_model(model)
+
+
+def estimate_tokens(in_prompt: str, model: str = openai_model) -> int:
+    """
+    Estimate the token count by encoding evenly spaced samples and extrapolating their tokens per character.
+    The error is bounded by how much the token density varies along the text, which is small for
+    uniform inputs like folder listings. The estimate never exceeds the UTF-8 byte count,
+    a hard upper bound for byte-level BPE.
+    :param in_prompt: Text to estimate
+    :param model: Model whose tokenizer is used
+    :return int: Estimated number of tokens
+    """
+    length = len(in_prompt)
+    if length <= approximate_sample_count * approximate_sample_size:
+        return len(get_encoding(model).encode_ordinary(in_prompt))
+
+    stride = length // approximate_sample_count
+    samples = [in_prompt[i * stride:i * stride + approximate_sample_size] for i in range(approximate_sample_count)]
+    sample_tokens = sum(len(tokens) for tokens in get_encoding(model).encode_ordinary_batch(samples))
+    estimate = round(sample_tokens * length / (approximate_sample_count * approximate_sample_size))
+    return min(estimate, len(in_prompt.encode("utf-8")))
+
+
+def count_tokens(in_prompt, model=openai_model, approximate: Optional[bool] = None) -> int:
+    """
+    :param in_prompt: Text to count
+    :param model: Model whose tokenizer is used
+    :param approximate: Force exact or approximate counting, by default only very long prompts are estimated
+    :return int: Number of tokens
+    """
+    if approximate is None:
+        approximate = len(in_prompt) > approximate_threshold
+    if approximate:
+        return estimate_tokens(in_prompt, model)
+    return len(get_encoding(model).encode_ordinary(in_prompt))
+
+
+def count_tokens_batch(prompts: Iterable[str], model=openai_model, approximate: Optional[bool] = None) -> list[int]:
+    """
+    Count tokens of many prompts at once, short prompts are encoded in parallel by tiktoken
+    """
+    prompts = list(prompts)
+    counts = [0] * len(prompts)
+    exact = []
+    for i, in_prompt in enumerate(prompts):
+        if approximate or (approximate is None and len(in_prompt) > approximate_threshold):
+            counts[i] = estimate_tokens(in_prompt, model)
+        else:
+            exact.append(i)
+
+    encoded = get_encoding(model).encode_ordinary_batch([prompts[i] for i in exact])
+    for i, tokens in zip(exact, encoded):
+        counts[i] = len(tokens)
+    return counts
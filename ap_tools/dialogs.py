@@ -7,13 +7,18 @@ import apsync as aps
 
 class CreateTagFilesDialogData:
     def __init__(
-            self, input_paths: list[str], total_tokens: int, combined_output_tokens: int, pixel_count: int,
-            total_price: float):
-        self.input_paths = input_paths
+            self, file_count: int, total_tokens: int, combined_output_tokens: int, pixel_count: int,
+            total_price: float, cached_count: int = 0, batch_mode: bool = False, duplicate_count: int = 0,
+            already_tagged_count: int = 0):
+        self.file_count = file_count
         self.total_tokens = total_tokens
         self.combined_output_tokens = combined_output_tokens
         self.pixel_count = pixel_count
         self.total_price = total_price
+        self.cached_count = cached_count
+        self.batch_mode = batch_mode
+        self.duplicate_count = duplicate_count
+        self.already_tagged_count = already_tagged_count
 
 
 def create_tag_files_dialog(data: CreateTagFilesDialogData,
@@ -27,13 +32,22 @@ def create_tag_files_dialog(data: CreateTagFilesDialogData,
         costs = "<$0.0001"
     else :
         costs = f"~${costs}"
-    proceed_dialog.add_text(f"Processing files: {len(data.input_paths)}"
+    proceed_dialog.add_text(f"Processing files: {data.file_count}"
                             f"\nInput token count: {data.total_tokens}"
                             f"\nOutput token count: ~{data.combined_output_tokens}"
                             f"\nPixel count: {data.pixel_count}"
                             f"\nCosts: {costs}")
+    if data.cached_count > 0:
+        proceed_dialog.add_info(f"Files with cached tags: {data.cached_count} (no upload required)")
+    if data.duplicate_count > 0:
+        proceed_dialog.add_info(f"Near-duplicates: {data.duplicate_count} (tags are copied, no upload required)")
+    if data.already_tagged_count > 0:
+        proceed_dialog.add_info(f"Already tagged files: {data.already_tagged_count} (skipped, see Skip Tagged Files "
+                                f"in the settings)")
+    if data.batch_mode:
+        proceed_dialog.add_info("Batch mode: tags arrive within 24 hours, the action can be closed and run again<br>"
+                                "on the same selection to apply them")
     proceed_dialog.add_empty()
-    proceed_dialog.add_checkbox(True, None, var="skip_existing_tags",text="Skip existing tags")
     (
         proceed_dialog
         .add_button("Continue", callback=callback)
@@ -43,10 +57,12 @@ def create_tag_files_dialog(data: CreateTagFilesDialogData,
 
 
 class CreateTagFoldersDialogData:
-    def __init__(self, folders: list[tuple[str, str, int, float]], output_token_count: int, output_token_price: float):
+    def __init__(self, folders: list[tuple[str, str, int, float]], output_token_count: int, output_token_price: float,
+                 unchanged_count: int = 0):
         self.folders = folders
         self.output_token_count = output_token_count
         self.output_token_price = output_token_price
+        self.unchanged_count = unchanged_count
 
 
 def create_tag_folders_dialog(data: CreateTagFoldersDialogData,
@@ -67,6 +83,8 @@ def create_tag_folders_dialog(data: CreateTagFoldersDialogData,
     proceed_dialog.add_text(f"Input token count: {combined_tokens}"
                             f"\nOutput token count: ~{combined_output_tokens}"
                             f"\nCosts: {costs}")
+    if data.unchanged_count > 0:
+        proceed_dialog.add_info(f"Unchanged folders: {data.unchanged_count} (skipped)")
     (
         proceed_dialog
         .add_button("Continue", callback=callback)
@@ -0,0 +1,58 @@
+"""
+Round trip of the Batch API mode against the local mock server: building the JSONL batch file,
+uploading and submitting it, polling until it is finished and reading back the results.
+
+Usage: python -m benchmarks.bench_batch [--requests 1000] [--images 10] [--batch-latency 2]
+"""
+import argparse
+import time
+
+from ai.batch import BatchRequest, download_batch_results, encode_batch_request, split_batch_files, submit_batch, \
+    wait_for_batch
+from ai.client import OpenAIClient
+from benchmarks.mock_openai import MockOpenAIServer
+
+
+def create_request(index: int, image_count: int) -> BatchRequest:
+    content = [{"type": "text", "text": "Please tag these images"}]
+    content.extend({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{'A' * 4000}"}}
+                   for _ in range(image_count))
+    return BatchRequest(f"files-{index}", {
+        "model": "gpt-4o-mini",
+        "messages": [{"role": "user", "content": content}],
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--batch-latency", type=float, default=2.0)
+    args = parser.parse_args()
+
+    with MockOpenAIServer(batch_latency=args.batch_latency) as server:
+        client = OpenAIClient("sk-mock", 60, base_url=server.base_url)
+
+        start = time.perf_counter()
+        batch_files = list(split_batch_files(
+            encode_batch_request(create_request(i, args.images)) for i in range(args.requests)))
+        built = time.perf_counter()
+        batch_ids = [submit_batch(client, batch_file) for batch_file in batch_files]
+        submitted = time.perf_counter()
+        results = {}
+        for batch_id in batch_ids:
+            batch = wait_for_batch(client, batch_id, poll_interval=0.5)
+            results.update(download_batch_results(client, batch))
+        finished = time.perf_counter()
+
+        tagged = sum(len(result["choices"][0]["message"]["content"]) > 0 for result in results.values())
+        size = sum(len(batch_file) for batch_file in batch_files) / 1024 / 1024
+        print(f"{args.requests} requests in {len(batch_files)} batch files ({size:.1f} MB)")
+        print(f"build {built - start:.2f}s, submit {submitted - built:.2f}s, "
+              f"wait and download {finished - submitted:.2f}s")
+        print(f"{tagged} of {args.requests} requests answered, {server.request_count} HTTP requests in total")
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
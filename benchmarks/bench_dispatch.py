@@ -0,0 +1,68 @@
+"""
+Wall-clock comparison of sequential and concurrent batch dispatch against a local mock chat completions server.
+
+Usage: python -m benchmarks.bench_dispatch [--files 500] [--latency 0.2] [--workers 1 4 8]
+"""
+import argparse
+import json
+import time
+import urllib.request
+
+from ai.dispatch import dispatch_batches
+from benchmarks.mock_openai import MockOpenAIServer
+
+
+def post_batch(url: str, batch: list[str]) -> list[dict]:
+    payload = {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": "You are a file tagging AI."},
+            {"role": "user", "content": [{"type": "image_url", "image_url": {"url": name}} for name in batch]},
+        ]
+    }
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        result = json.loads(response.read())
+    return json.loads(result["choices"][0]["message"]["content"])["tags"]
+
+
+def run(url: str, batches: list[list[str]], workers: int) -> float:
+    tagged = 0
+
+    def on_result(batch, response):
+        nonlocal tagged
+        tagged += len(response)
+
+    start = time.perf_counter()
+    dispatch_batches(batches, lambda batch: post_batch(url, batch), on_result, workers)
+    elapsed = time.perf_counter() - start
+
+    expected = sum(len(batch) for batch in batches)
+    if tagged != expected:
+        raise RuntimeError(f"Tagged {tagged} of {expected} files")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--images-per-request", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock server latency per request in seconds")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    files = [f"texture_{i}.png" for i in range(args.files)]
+    batches = [files[i:i + args.images_per_request] for i in range(0, len(files), args.images_per_request)]
+
+    with MockOpenAIServer(latency=args.latency) as server:
+        baseline = None
+        print(f"{len(files)} files, {len(batches)} batches, {args.latency}s latency")
+        for workers in args.workers:
+            elapsed = run(server.url, batches, workers)
+            baseline = baseline or elapsed
+            print(f"workers={workers:<3} {elapsed:8.3f}s  speedup x{baseline / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+End-to-end run of both actions without Anchorpoint or an OpenAI key: a synthetic asset tree is generated,
+`tag_file_ai` and `tag_folder_ai` tag it against the fake Anchorpoint runtime and the local mock API,
+and the time of every stage and request is reported.
+
+Usage: python -m benchmarks.bench_end_to_end [--files 500] [--packs 20] [--latency 0.2] [--error-rate 0.02]
+       [--rate-limit-rate 0.02] [--concurrency 4] [--streaming] [--warm-thumbnails] [--budget 0.01]
+       [--requests-per-minute 10000] [--tokens-per-minute 30000000] [--gzip] [--mode files folders]
+       [--skip-existing off|types|any|all] [--tagged-share 0.9] [--attribute-latency 0.0005]
+"""
+import argparse
+import importlib
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.fake_anchorpoint import FakeRuntime, install, isolated_data
+from benchmarks.mock_openai import MockOpenAIServer
+
+asset_kinds = [
+    # folder, extension, share of the files
+    ("Textures", "png", 0.6),
+    ("Sprites", "jpg", 0.1),
+    ("Models", "fbx", 0.2),
+    ("Audio", "wav", 0.05),
+    ("Meta", "meta", 0.05),
+]
+
+
+def make_asset_tree(root: str, file_count: int, pack_count: int, seed: int = 0) -> tuple[list[str], list[str]]:
+    """
+    Asset packs with texture, sprite, model, audio and meta files, images are random noise of varying size.
+    File names are unique across packs, the stem names the preview Anchorpoint generates.
+    :return tuple[list[str], list[str]]: All files and the pack folders
+    """
+    rng = np.random.default_rng(seed)
+    packs = [os.path.join(root, f"Pack_{i:03d}") for i in range(pack_count)]
+    files = []
+    for i in range(file_count):
+        folder, extension, _ = random.Random(seed + i).choices(asset_kinds, [kind[2] for kind in asset_kinds])[0]
+        directory = os.path.join(packs[i % pack_count], folder)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{folder.lower()}_{i:05d}.{extension}")
+        if extension in ("png", "jpg"):
+            size = int(rng.integers(64, 512))
+            pixels = rng.integers(0, 256, size=(size, size, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(path)
+        else:
+            with open(path, "wb") as f:
+                f.write(rng.bytes(int(rng.integers(256, 4096))))
+        files.append(path)
+    return files, packs
+
+
+class RequestTimer:
+    """
+    Wraps the chat completions of a client and records their latency, retries and rate limit waits included
+    """
+
+    def __init__(self, client):
+        self.latencies: list[float] = []
+        self._lock = threading.Lock()
+        self._chat_completion = client.chat_completion
+        client.chat_completion = self.chat_completion
+
+    def chat_completion(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._chat_completion(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.latencies.append(time.perf_counter() - start)
+
+
+def percentile(values: list[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def print_report(title: str, runtime: FakeRuntime, timer: RequestTimer, item_count: int, elapsed: float):
+    print(f"\n{title}: {item_count} items in {elapsed:.2f}s ({item_count / elapsed:.1f}/s)")
+    print(f"  {'stage':<28}{'spans':>7}{'total s':>10}{'mean ms':>10}{'max ms':>10}{'items/s':>10}")
+    for stage, timing in runtime.stages.items():
+        print(f"  {stage:<28}{timing.count:>7}{timing.total:>10.2f}{timing.total / timing.count * 1000:>10.1f}"
+              f"{timing.longest * 1000:>10.1f}{item_count / max(timing.total, 1e-9):>10.1f}")
+    if timer.latencies:
+        print(f"  requests: {len(timer.latencies)}, latency p50 {percentile(timer.latencies, 0.5) * 1000:.0f}ms, "
+              f"p95 {percentile(timer.latencies, 0.95) * 1000:.0f}ms, "
+              f"mean {statistics.mean(timer.latencies) * 1000:.0f}ms, max {max(timer.latencies) * 1000:.0f}ms")
+    for kind, message_title, text in runtime.messages:
+        print(f"  {kind}: {message_title} {text}")
+
+
+def tag_existing(runtime: FakeRuntime, files: list[str], share: float, seed: int = 0):
+    """
+    Tag a share of the files like an earlier run did, models often leave the genres of a file empty
+    """
+    rng = random.Random(seed)
+    for path in files:
+        if rng.random() >= share:
+            continue
+        runtime.attribute_values[(path, "AI-Types")] = ["Texture"]
+        runtime.attribute_values[(path, "AI-Objects")] = ["Rock"]
+        if rng.random() < 0.5:
+            runtime.attribute_values[(path, "AI-Genres")] = ["Fantasy"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--packs", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per chat completion")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="Share of requests failing with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.02, help="Share of requests rejected with a 429")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--preview-parallelism", type=int, default=8)
+    parser.add_argument("--thumbnail-latency", type=float, default=0.002, help="Seconds per generated thumbnail")
+    parser.add_argument("--streaming", action="store_true", help="Use the streaming mode of the file action")
+    parser.add_argument("--warm-thumbnails", action="store_true", help="Anchorpoint already has the thumbnails")
+    parser.add_argument("--mode", nargs="+", choices=["files", "folders"], default=["files", "folders"])
+    parser.add_argument("--budget", type=float, default=0.0, help="Budget limit in USD, 0 for no limit")
+    parser.add_argument("--requests-per-minute", type=int, default=10000, help="Rate limit of the mock API")
+    parser.add_argument("--tokens-per-minute", type=int, default=30000000, help="Rate limit of the mock API")
+    parser.add_argument("--gzip", action="store_true", help="Compress the request bodies")
+    parser.add_argument(
+        "--skip-existing", choices=["off", "types", "any", "all"], default="off",
+        help="Skip files that already carry tags, with the given mode")
+    parser.add_argument(
+        "--tagged-share", type=float, default=0.0,
+        help="Share of the files tagged before the run, half of them without genres")
+    parser.add_argument(
+        "--attribute-latency", type=float, default=0.0005, help="Seconds per attribute read of the fake runtime")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # the data of the run is kept apart from the workspace, so scanning the packs doesn't see it
+    with tempfile.TemporaryDirectory(prefix="ai_tagger_bench_") as root, \
+            tempfile.TemporaryDirectory(prefix="ai_tagger_bench_data_") as data_directory, \
+            isolated_data(data_directory), MockOpenAIServer(
+                args.latency, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                seed=args.seed, requests_per_minute=args.requests_per_minute,
+                tokens_per_minute=args.tokens_per_minute) as server:
+        start = time.perf_counter()
+        files, packs = make_asset_tree(root, args.files, args.packs, args.seed)
+        print(f"Generated {len(files)} files in {len(packs)} packs in {time.perf_counter() - start:.2f}s")
+
+        runtime = FakeRuntime(root, {
+            "openai_api_key": "sk-mock",
+            "file_max_concurrent_requests": args.concurrency,
+            "folder_max_concurrent_requests": args.concurrency,
+            "preview_parallelism": args.preview_parallelism,
+            "file_streaming_mode": args.streaming,
+            # every run measures the full pipeline
+            "cache_enabled": False,
+            "file_skip_existing": args.skip_existing != "off",
+            "file_skip_existing_mode": args.skip_existing if args.skip_existing != "off" else "types",
+            "folder_skip_unchanged": False,
+            "request_max_retries": 8,
+            "budget_limit": args.budget,
+            "request_gzip": args.gzip,
+        }, args.thumbnail_latency, attribute_latency=args.attribute_latency)
+        tag_existing(runtime, files, args.tagged_share, args.seed)
+        if args.warm_thumbnails:
+            runtime.warm_thumbnails(files)
+        install(runtime)
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+
+        start = time.perf_counter()
+        ai_client = importlib.import_module("ai.client")
+        timer = RequestTimer(ai_client.get_client())
+        tag_file_ai = importlib.import_module("tag_file_ai")
+        tag_folder_ai = importlib.import_module("tag_folder_ai")
+        print(f"Imported the actions in {time.perf_counter() - start:.2f}s")
+
+        if "files" in args.mode:
+            runtime.select(files=files, path=root)
+            start = time.perf_counter()
+            tag_file_ai.main()
+            elapsed = time.perf_counter() - start
+            print_report("Tag files", runtime, timer, len(files), elapsed)
+
+        if "folders" in args.mode:
+            runtime.stages.clear()
+            runtime.messages.clear()
+            timer.latencies.clear()
+            runtime.select(folders=packs, path=root)
+            start = time.perf_counter()
+            tag_folder_ai.main()
+            elapsed = time.perf_counter() - start
+            print_report("Tag folders", runtime, timer, len(packs), elapsed)
+
+        tagged_targets = {target for target, _ in runtime.attribute_values}
+        print(f"\nTagged {len(tagged_targets)} files and folders, "
+              f"{server.request_count} HTTP requests: {dict(sorted(server.status_counts.items()))}, "
+              f"{runtime.attribute_reads} attribute reads")
+
+
+if __name__ == "__main__":
+    main()
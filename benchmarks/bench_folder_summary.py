@@ -0,0 +1,81 @@
+"""
+Prompt size and build time of the raw folder dump sent before versus the token-budgeted folder summary,
+on synthetic game project trees.
+
+Usage: python -m benchmarks.bench_folder_summary [--files 100000] [--budget 2000]
+"""
+import argparse
+import random
+import time
+
+from ai.tokens import count_tokens
+from folders.summary import build_folder_summary
+from folders.tree import tree_from_structure
+
+
+def synthetic_folder_structure(file_count: int, seed: int = 0) -> dict[str, list[str]]:
+    rng = random.Random(seed)
+    categories = {
+        "Textures": ["png", "tga", "psd"],
+        "Models": ["fbx", "obj", "blend"],
+        "Materials": ["mat"],
+        "Audio": ["wav", "ogg"],
+        "Prefabs": ["prefab"],
+        "Scripts": ["cs"],
+        "VFX": ["vfx", "png"],
+    }
+    words = ["rock", "tree", "wall", "floor", "sword", "barrel", "crate", "door", "lamp", "chair", "grass", "cliff"]
+    folders: dict[str, list[str]] = {"": ["README.md", "project.meta"]}
+    category_names = list(categories)
+    for i in range(file_count):
+        category = rng.choice(category_names)
+        path = f"Assets/{category}/Set_{rng.randint(0, 40)}"
+        if rng.random() < 0.5:
+            path += f"/Variant_{rng.randint(0, 8)}"
+        name = f"{rng.choice(words)}_{rng.choice(words)}_{i:05d}.{rng.choice(categories[category])}"
+        folders.setdefault(path, []).append(name)
+
+    # the parents of every generated directory exist as well, even if they hold no files
+    for path in list(folders):
+        while path:
+            path = path.rpartition("/")[0]
+            folders.setdefault(path, [])
+    return folders
+
+
+def raw_dump(folder_structure: dict[str, list[str]]) -> str:
+    # what the folder prompt used to contain
+    return str({f"root/{path}" if path else "root": files for path, files in folder_structure.items()})
+
+
+def measure(label: str, function, repeat: int = 3):
+    result = None
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    elapsed = (time.perf_counter() - start) / repeat
+    tokens = count_tokens(result)
+    print(f"{label:<28} {elapsed * 1000:9.1f} ms {len(result) / 1024:10.1f} KB {tokens:10d} tokens")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=100_000)
+    parser.add_argument("--budget", type=int, nargs="+", default=[500, 2000, 8000])
+    parser.add_argument("--depth", type=int, default=4)
+    args = parser.parse_args()
+
+    folder_structure = synthetic_folder_structure(args.files)
+    print(f"{args.files} files in {len(folder_structure)} folders\n")
+    measure("raw dump", lambda: raw_dump(folder_structure), 1)
+    summary = ""
+    for budget in args.budget:
+        # indexing is included, the index replaces the os.walk the raw dump needed
+        summary = measure(f"summary, budget {budget}", lambda: build_folder_summary(
+            tree_from_structure(folder_structure), budget, args.depth))
+    print(f"\n{summary[:1500]}")
+
+
+if __name__ == "__main__":
+    main()
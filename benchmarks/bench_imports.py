@@ -0,0 +1,109 @@
+"""
+Cold start of every action: each run is a fresh interpreter with the fake Anchorpoint runtime, measuring
+how long importing the action takes, which heavy modules the import pulls in, when the first progress,
+dialog or message appears and when the cost estimate is shown. Dialogs are never confirmed, no request is sent.
+
+Usage: python -m benchmarks.bench_imports [--runs 5] [--files 20] [--action tag_file_ai tag_folder_ai package_settings]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+actions = ["tag_file_ai", "tag_folder_ai", "package_settings"]
+# third-party modules that dominate the import time when loaded eagerly
+heavy_modules = ["requests", "tiktoken", "PIL.Image", "numpy"]
+
+
+def measure(action: str, workspace_path: str, files: list[str]) -> dict:
+    """
+    Runs in the child interpreter, the times are relative to the start of the measurement
+    """
+    from benchmarks.fake_anchorpoint import FakeRuntime, install
+
+    runtime = FakeRuntime(workspace_path, {"openai_api_key": "sk-mock"}, confirm_dialogs=False)
+    runtime.select(files=files, folders=[] if files else [workspace_path], path=workspace_path)
+    install(runtime)
+    # the fake runtime is part of the app, it is not counted
+    start = time.perf_counter()
+    module = __import__(action)
+    imported = time.perf_counter()
+    loaded_on_import = [name for name in heavy_modules if name in sys.modules]
+    module.main()
+    finished = time.perf_counter()
+
+    def first(prefix: str = "") -> float:
+        times = [event_time for event_time, description in runtime.events if description.startswith(prefix)]
+        return (min(times) - start) * 1000 if times else float("nan")
+
+    return {
+        "import_ms": (imported - start) * 1000,
+        "first_feedback_ms": first(),
+        "dialog_ms": first("dialog"),
+        "total_ms": (finished - start) * 1000,
+        "loaded_on_import": loaded_on_import,
+        "loaded_at_end": [name for name in heavy_modules if name in sys.modules],
+    }
+
+
+def make_workspace(root: str, file_count: int) -> list[str]:
+    from PIL import Image
+
+    files = []
+    os.makedirs(os.path.join(root, "Textures"), exist_ok=True)
+    for i in range(file_count):
+        path = os.path.join(root, "Textures", f"texture_{i:03d}.png")
+        Image.new("RGB", (256, 256), (i * 7 % 256, i * 13 % 256, i * 29 % 256)).save(path)
+        files.append(path)
+    return files
+
+
+def run_child(action: str, workspace_path: str, files: list[str], data_directory: str) -> dict:
+    from benchmarks.fake_anchorpoint import get_isolated_environment
+
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, "-m", "benchmarks.bench_imports", "--child", action, workspace_path, *files]
+    python_path = os.pathsep.join(filter(None, [repository, os.environ.get("PYTHONPATH")]))
+    # previews, manifests and the ledger of the run stay out of the user's data
+    environment = dict(os.environ, PYTHONPATH=python_path, **get_isolated_environment(data_directory))
+    output = subprocess.run(
+        command, cwd=repository, env=environment, capture_output=True, text=True, check=True).stdout
+    # the actions log to stdout, the result is the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        print(json.dumps(measure(sys.argv[2], sys.argv[3], sys.argv[4:])))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--files", type=int, default=20, help="Images selected for the file action")
+    parser.add_argument("--action", nargs="+", choices=actions, default=actions)
+    args = parser.parse_args()
+
+    print(f"{'action':<18}{'import ms':>11}{'feedback ms':>13}{'dialog ms':>11}{'total ms':>10}  loaded on import")
+    for action in args.action:
+        results = []
+        for _ in range(args.runs):
+            # a new workspace per run, so no manifest or preview of an earlier run is reused
+            with tempfile.TemporaryDirectory(prefix="ai_tagger_imports_") as root, \
+                    tempfile.TemporaryDirectory(prefix="ai_tagger_imports_data_") as data_directory:
+                files = make_workspace(root, args.files) if action == "tag_file_ai" else []
+                results.append(run_child(action, root, files, data_directory))
+
+        def median(key: str) -> float:
+            return statistics.median(result[key] for result in results)
+
+        print(f"{action:<18}{median('import_ms'):>11.1f}{median('first_feedback_ms'):>13.1f}"
+              f"{median('dialog_ms'):>11.1f}{median('total_ms'):>10.1f}  "
+              f"{', '.join(results[-1]['loaded_on_import']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
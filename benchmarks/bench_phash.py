@@ -0,0 +1,42 @@
+"""
+Near-duplicate grouping time on synthetic perceptual hashes: half of the hashes are random,
+the other half are copies with a few flipped bits.
+
+Usage: python -m benchmarks.bench_phash [--images 100000] [--threshold 0 4 8] [--flips 2]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from image.phash import group_near_duplicates
+
+
+def synthetic_hashes(count: int, flips: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    originals = rng.integers(0, np.iinfo(np.uint64).max, size=count // 2, dtype=np.uint64, endpoint=True)
+    copies = originals.copy()
+    for _ in range(flips):
+        copies ^= np.left_shift(np.uint64(1), rng.integers(0, 64, size=len(copies)).astype(np.uint64))
+    return np.concatenate([originals, copies])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=100_000)
+    parser.add_argument("--threshold", type=int, nargs="+", default=[0, 4, 8])
+    parser.add_argument("--flips", type=int, default=2)
+    args = parser.parse_args()
+
+    hashes = synthetic_hashes(args.images, args.flips)
+    print(f"{len(hashes)} hashes, {args.images // 2} near-duplicate pairs with up to {args.flips} flipped bits")
+    for threshold in args.threshold:
+        start = time.perf_counter()
+        representatives = group_near_duplicates(hashes, threshold)
+        elapsed = time.perf_counter() - start
+        uploads = int((representatives == np.arange(len(hashes))).sum())
+        print(f"threshold {threshold:2d}: {elapsed:7.2f}s, {uploads} uploads ({len(hashes) - uploads} tags copied)")
+
+
+if __name__ == "__main__":
+    main()
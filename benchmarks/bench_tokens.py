@@ -0,0 +1,68 @@
+"""
+Per-call overhead of token counting: loading the encoding on every call versus the cached encoding,
+batch counting and the approximate mode for multi-megabyte folder dumps.
+
+Usage: python -m benchmarks.bench_tokens [--calls 200]
+"""
+import argparse
+import random
+import time
+
+import tiktoken
+
+from ai.tokens import count_tokens, count_tokens_batch, get_encoding
+
+
+def count_tokens_uncached(in_prompt, model="gpt-4o-mini"):
+    # the original implementation, resolving the encoding on every call
+    encoding = tiktoken.encoding_for_model(model)
+    return len(encoding.encode(in_prompt))
+
+
+def synthetic_folder_dump(file_count: int) -> str:
+    rng = random.Random(0)
+    extensions = ["png", "fbx", "mat", "prefab", "wav", "tga", "uasset", "meta"]
+    folders = {}
+    for i in range(file_count):
+        folder = f"root/Assets/Category_{rng.randint(0, 50)}/Sub_{rng.randint(0, 20)}"
+        folders.setdefault(folder, []).append(f"asset_{i}_{rng.randint(0, 9999)}.{rng.choice(extensions)}")
+    return str(folders)
+
+
+def measure(label: str, function, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label:<40} {elapsed * 1000:10.3f} ms/call")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--dump-files", type=int, default=100_000)
+    args = parser.parse_args()
+
+    short_prompt = "You are a file tagging AI. Please tag these images: " + ", ".join(
+        f"texture_{i}_pt.png" for i in range(10))
+    get_encoding()
+
+    uncached = measure("short prompt, encoding per call", lambda: count_tokens_uncached(short_prompt), args.calls)
+    cached = measure("short prompt, cached encoding", lambda: count_tokens(short_prompt), args.calls)
+    prompts = [short_prompt] * args.calls
+    batch = measure("short prompts, batch", lambda: count_tokens_batch(prompts), 1) / args.calls
+    print(f"per-call overhead saved: x{uncached / cached:.1f} cached, x{uncached / batch:.1f} batch")
+
+    dump = synthetic_folder_dump(args.dump_files)
+    print(f"\nfolder dump of {args.dump_files} files: {len(dump) / 1024 / 1024:.1f} MB")
+    exact_count = count_tokens(dump, approximate=False)
+    approximate_count = count_tokens(dump, approximate=True)
+    exact = measure("folder dump, exact", lambda: count_tokens(dump, approximate=False), 1)
+    approximate = measure("folder dump, approximate", lambda: count_tokens(dump, approximate=True), 5)
+    error = abs(approximate_count - exact_count) / exact_count * 100
+    print(f"exact {exact_count}, approximate {approximate_count} ({error:.2f}% error, x{exact / approximate:.0f} faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Scan time of nested folder selections: one os.walk per selected folder, as folder tagging used to do,
+versus the shared single-pass tree index.
+
+Usage: python -m benchmarks.bench_tree_index [--files 20000] [--selections 8]
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from folders.tree import build_tree_index
+
+
+def create_tree(root: str, file_count: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    directories = set()
+    for i in range(file_count):
+        directory = os.path.join(
+            root, "Assets", f"Category_{rng.randint(0, 9)}", f"Set_{rng.randint(0, 30)}", f"Variant_{rng.randint(0, 4)}")
+        if directory not in directories:
+            os.makedirs(directory, exist_ok=True)
+            directories.add(directory)
+        open(os.path.join(directory, f"asset_{i}.png"), "w").close()
+    return sorted(directories)
+
+
+def walk_each(paths: list[str]) -> int:
+    file_count = 0
+    for path in paths:
+        folder_structure = {}
+        for root, dirs, files in os.walk(path):
+            folder_structure[root] = files
+            file_count += len(files)
+    return file_count
+
+
+def index_once(paths: list[str]) -> int:
+    index = build_tree_index(paths)
+    return sum(index.get(path).file_count for path in paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20_000)
+    parser.add_argument("--selections", type=int, default=8)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="ai_tagger_tree_")
+    try:
+        create_tree(root, args.files)
+        # the root, the asset folder and a few categories, all nested in each other
+        assets = os.path.join(root, "Assets")
+        selection = [root, assets] + [os.path.join(assets, f"Category_{i}") for i in range(args.selections - 2)]
+        print(f"{args.files} files, {len(selection)} nested selections")
+
+        for label, function in (("os.walk per selection", walk_each), ("shared tree index", index_once)):
+            start = time.perf_counter()
+            counted = function(selection)
+            print(f"{label:<24} {(time.perf_counter() - start) * 1000:9.1f} ms, {counted} files counted")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
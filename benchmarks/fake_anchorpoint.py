@@ -0,0 +1,353 @@
+"""
+In-process stand-ins for the `anchorpoint` and `apsync` modules, so the actions can run without the desktop app.
+`install` puts them into sys.modules, it has to be called before any module of this package is imported.
+
+Dialogs are confirmed right away, `run_async` runs on the calling thread and every `ap.Progress`
+is recorded as a timed stage. Thumbnails are rendered with PIL after `thumbnail_latency` seconds.
+Progress, dialogs and messages are also recorded as timestamped events, e.g. to measure when an action first responds.
+`isolated_data` keeps the caches and the usage ledger of a benchmark out of the ones of the user.
+"""
+import collections
+import contextlib
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+import typing
+from typing import Any, Optional
+
+
+class StageTiming:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.longest = max(self.longest, seconds)
+
+
+class FakeRuntime:
+    """
+    State shared by the fake modules: settings, attributes, selection and the recorded stages and messages
+    """
+
+    def __init__(
+            self, workspace_path: str, settings: Optional[dict[str, Any]] = None, thumbnail_latency: float = 0.0,
+            thumbnail_size: int = 256, confirm_dialogs: bool = True, attribute_latency: float = 0.0):
+        self.workspace_path = workspace_path
+        self.workspace_id = "fake-workspace"
+        self.settings: dict[str, Any] = dict(settings or {})
+        self.thumbnail_latency = thumbnail_latency
+        self.thumbnail_size = thumbnail_size
+        # seconds every get_attribute_value takes, like a call into the Anchorpoint database
+        self.attribute_latency = attribute_latency
+        self.attribute_reads = 0
+        self.confirm_dialogs = confirm_dialogs
+        # thumbnails Anchorpoint already has, as returned by get_thumbnail
+        self.thumbnail_directory = os.path.join(workspace_path, ".thumbnails")
+        self.selected_files: list[str] = []
+        self.selected_folders: list[str] = []
+        self.path = workspace_path
+        self.stages: dict[str, StageTiming] = collections.defaultdict(StageTiming)
+        self.messages: list[tuple[str, str, str]] = []
+        # perf_counter time and description of every progress, dialog and message shown
+        self.events: list[tuple[float, str]] = []
+        self.attribute_values: dict[tuple[str, str], list[str]] = {}
+        self.attributes: dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.anchorpoint = self._create_anchorpoint_module()
+        self.apsync = self._create_apsync_module()
+
+    def select(self, files: typing.Iterable[str] = (), folders: typing.Iterable[str] = (), path: str = ""):
+        self.selected_files = list(files)
+        self.selected_folders = list(folders)
+        self.path = path or self.workspace_path
+
+    def add_event(self, description: str):
+        with self._lock:
+            self.events.append((time.perf_counter(), description))
+
+    def add_stage(self, title: str, seconds: float):
+        with self._lock:
+            self.stages[title].add(seconds)
+
+    def render_thumbnail(self, source: str, target: str):
+        from PIL import Image
+
+        time.sleep(self.thumbnail_latency)
+        try:
+            with Image.open(source) as image:
+                image.thumbnail((self.thumbnail_size, self.thumbnail_size))
+                image.save(target, "PNG")
+                return
+        except OSError:
+            pass
+        # files without an image get a flat color derived from their content, like an untextured model would
+        with open(source, "rb") as f:
+            digest = hashlib.sha1(f.read()).digest()
+        Image.new("RGB", (self.thumbnail_size, self.thumbnail_size), tuple(digest[:3])).save(target, "PNG")
+
+    def warm_thumbnails(self, paths: typing.Iterable[str]):
+        """
+        Render thumbnails up front, as if Anchorpoint had already shown the files
+        """
+        os.makedirs(self.thumbnail_directory, exist_ok=True)
+        for path in paths:
+            self.render_thumbnail(path, self._thumbnail_path(path))
+
+    def _thumbnail_path(self, path: str) -> str:
+        return os.path.join(self.thumbnail_directory, hashlib.sha1(path.encode("utf-8")).hexdigest() + ".png")
+
+    def _create_anchorpoint_module(self) -> types.ModuleType:
+        runtime = self
+        module = types.ModuleType("anchorpoint")
+
+        class Progress:
+            def __init__(self, title: str, text: str = "", infinite: bool = True, show_loading_screen: bool = False,
+                         cancelable: bool = False):
+                self.title = title
+                self.text = text
+                self.canceled = False
+                self.value = 0.0
+                self._start = time.perf_counter()
+                self._finished = False
+                runtime.add_event(f"progress: {title}")
+
+            def set_text(self, text: str):
+                self.text = text
+
+            def report_progress(self, value: float):
+                self.value = value
+
+            def finish(self):
+                if not self._finished:
+                    self._finished = True
+                    runtime.add_stage(self.title, time.perf_counter() - self._start)
+
+        class Dialog:
+            def __init__(self):
+                self.title = ""
+                self.icon = ""
+                self._values: dict[str, Any] = {}
+                self._buttons: list[typing.Callable] = []
+                self.closed = False
+
+            def _add(self, *args, **kwargs) -> "Dialog":
+                if "var" in kwargs:
+                    self._values[kwargs["var"]] = args[0] if args else kwargs.get("default")
+                return self
+
+            add_text = add_info = add_checkbox = add_input = add_dropdown = add_switch = _add
+            add_separator = add_empty = start_section = end_section = _add
+
+            def add_button(self, text: str, callback: Optional[typing.Callable] = None, **kwargs) -> "Dialog":
+                if callback is not None:
+                    self._buttons.append(callback)
+                return self
+
+            def get_value(self, var: str) -> Any:
+                return self._values.get(var)
+
+            def show(self):
+                runtime.add_event(f"dialog: {self.title}")
+                # the first button continues, the cost estimate is always accepted
+                if runtime.confirm_dialogs and self._buttons:
+                    self._buttons[0](self)
+
+            def close(self):
+                self.closed = True
+
+        class UI:
+            def _message(self, kind: str, title: str, text: str = "", *args, **kwargs):
+                runtime.messages.append((kind, title, text))
+                runtime.add_event(f"{kind}: {title}")
+
+            def show_error(self, title: str, text: str = "", *args, **kwargs):
+                self._message("error", title, text)
+
+            def show_info(self, title: str, text: str = "", *args, **kwargs):
+                self._message("info", title, text)
+
+            def show_success(self, title: str, text: str = "", *args, **kwargs):
+                self._message("success", title, text)
+
+            def navigate_to_folder(self, path: str):
+                pass
+
+            def navigate_to_file(self, path: str):
+                pass
+
+        class Context:
+            @property
+            def selected_files(self) -> list[str]:
+                return list(runtime.selected_files)
+
+            @property
+            def selected_folders(self) -> list[str]:
+                return list(runtime.selected_folders)
+
+            @property
+            def path(self) -> str:
+                return runtime.path
+
+            workspace_id = runtime.workspace_id
+            icon = ""
+
+            def run_async(self, func: typing.Callable, *args):
+                func(*args)
+
+        class BrowseType:
+            File = 0
+            Folder = 1
+
+        module.Progress = Progress
+        module.Dialog = Dialog
+        module.UI = UI
+        module.Context = Context
+        module.BrowseType = BrowseType
+        module.get_context = lambda: Context()
+        module.get_api = lambda: runtime.apsync.Api()
+        return module
+
+    def _create_apsync_module(self) -> types.ModuleType:
+        runtime = self
+        module = types.ModuleType("apsync")
+
+        class Settings:
+            def __init__(self, name: str = ""):
+                pass
+
+            def get(self, key: str, default: Any = "") -> Any:
+                return runtime.settings.get(key, default)
+
+            def set(self, key: str, value: Any):
+                runtime.settings[key] = value
+
+            def store(self):
+                pass
+
+        class AttributeTag:
+            def __init__(self, name: str, color: str = "grey"):
+                self.name = name
+                self.color = color
+
+        class AttributeTagList(list):
+            pass
+
+        class AttributeType:
+            multiple_choice_tag = "multiple_choice_tag"
+            single_choice_tag = "single_choice_tag"
+
+        class Attribute:
+            def __init__(self, name: str, attribute_type: str):
+                self.name = name
+                self.type = attribute_type
+                self.tags = AttributeTagList()
+
+        class Attributes:
+            def get_attribute(self, name: str) -> Optional[Attribute]:
+                return runtime.attributes.get(name)
+
+            def create_attribute(self, name: str, attribute_type: str) -> Attribute:
+                attribute = Attribute(name, attribute_type)
+                runtime.attributes[name] = attribute
+                return attribute
+
+            def set_attribute_tags(self, attribute: Attribute, tags: AttributeTagList):
+                # like apsync, a plain list is not accepted
+                if not isinstance(tags, AttributeTagList):
+                    raise TypeError(f"set_attribute_tags expects an AttributeTagList, got {type(tags).__name__}")
+                attribute.tags = AttributeTagList(tags)
+
+            def set_attribute_value(self, target: str, attribute: Any, value: Any):
+                name = attribute if isinstance(attribute, str) else attribute.name
+                tag_names = [tag.name if isinstance(tag, AttributeTag) else str(tag) for tag in value]
+                with runtime._lock:
+                    runtime.attribute_values[(target, name)] = tag_names
+
+            def get_attribute_value(self, target: str, attribute: Any) -> Any:
+                name = attribute if isinstance(attribute, str) else attribute.name
+                if runtime.attribute_latency:
+                    time.sleep(runtime.attribute_latency)
+                with runtime._lock:
+                    runtime.attribute_reads += 1
+                    return runtime.attribute_values.get((target, name))
+
+        class Api:
+            def __init__(self):
+                self.attributes = Attributes()
+
+        def get_thumbnail(path: str, detail: bool = False) -> Optional[str]:
+            thumbnail = runtime._thumbnail_path(path)
+            return thumbnail if os.path.exists(thumbnail) else None
+
+        def generate_thumbnails(
+                paths: list[str], output_folder: str, with_detail: bool = False, with_preview: bool = True,
+                workspace_id: str = "") -> bool:
+            os.makedirs(output_folder, exist_ok=True)
+            for path in paths:
+                # named like Anchorpoint's previews, the file name up to the first dot with a _pt suffix
+                file_name = os.path.basename(path).split(".")[0]
+                runtime.render_thumbnail(path, os.path.join(output_folder, f"{file_name}_pt.png"))
+            return True
+
+        module.Settings = Settings
+        module.AttributeTag = AttributeTag
+        module.AttributeTagList = AttributeTagList
+        module.AttributeType = AttributeType
+        module.Attribute = Attribute
+        module.Api = Api
+        module.get_thumbnail = get_thumbnail
+        module.generate_thumbnails = generate_thumbnails
+        module.apsync = module
+        return module
+
+
+def install(runtime: FakeRuntime):
+    """
+    Make `import anchorpoint` and `import apsync` return the fakes of the runtime
+    """
+    for name in ("anchorpoint", "apsync"):
+        if name in sys.modules and sys.modules[name] is not getattr(runtime, name):
+            raise RuntimeError(f"{name} is already imported, install the fake runtime first")
+    sys.modules["anchorpoint"] = runtime.anchorpoint
+    sys.modules["apsync"] = runtime.apsync
+
+
+def get_isolated_environment(directory: str) -> dict[str, str]:
+    """
+    Environment pointing the temporary and the state directory of the tagger into `directory`
+    """
+    temp_directory = os.path.join(directory, "temp")
+    os.makedirs(temp_directory, exist_ok=True)
+    return {
+        "TMPDIR": temp_directory, "TEMP": temp_directory, "TMP": temp_directory,
+        "AI_TAGGER_STATE_DIR": os.path.join(directory, "state")}
+
+
+@contextlib.contextmanager
+def isolated_data(directory: str) -> typing.Iterator[None]:
+    """
+    Keep previews, caches, manifests, metrics and the usage ledger of the mock runs in `directory`,
+    mock usage must not count against the budget of the user. Has to wrap the import of the actions.
+    """
+    environment = get_isolated_environment(directory)
+    previous_environment = {name: os.environ.get(name) for name in environment}
+    previous_tempdir = tempfile.tempdir
+    os.environ.update(environment)
+    tempfile.tempdir = environment["TMPDIR"]
+    try:
+        yield
+    finally:
+        tempfile.tempdir = previous_tempdir
+        for name, value in previous_environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
@@ -0,0 +1,289 @@
+"""
+Local stand-in for the OpenAI API, used by the benchmarks.
+Chat completions are answered after `latency` seconds with one tag object per `image_url` in the request,
+or with the tags of a folder for requests without images.
+Files and batches are supported as well: a batch finishes `batch_latency` seconds after it was created,
+its output file holds the chat completion of every request line.
+Failures can be injected: a share of the chat completions is answered with a 500 or a 429,
+both with a short retry-after-ms header so the client retries quickly.
+Chat completions also count against requests and tokens per minute limits, reported in x-ratelimit-* headers
+like the API does, requests beyond them are rejected with a 429 until the minute is over.
+Request bodies sent with Content-Encoding: gzip are decompressed.
+"""
+import collections
+import gzip
+import itertools
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+
+def count_images(payload: dict[str, Any]) -> int:
+    images = 0
+    for message in payload.get("messages", []):
+        if isinstance(message.get("content"), list):
+            images += sum(1 for part in message["content"] if part.get("type") == "image_url")
+    return images
+
+
+def count_prompt_tokens(payload: dict[str, Any]) -> int:
+    # roughly like the API: 85 tokens per low detail image plus the text, four characters per token
+    return 85 * count_images(payload) + sum(
+        len(part["text"]) if isinstance(part, dict) else len(part)
+        for message in payload.get("messages", [])
+        for part in (message["content"] if isinstance(message.get("content"), list) else [message.get("content", "")])
+        if not isinstance(part, dict) or part.get("type") == "text") // 4
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Durations like "6m0s", "1.5s" or "20ms", as in the x-ratelimit-reset-* headers
+    """
+    if seconds < 1:
+        return f"{int(seconds * 1000)}ms"
+    if seconds < 60:
+        return f"{round(seconds, 3):g}s"
+    return f"{int(seconds // 60)}m{round(seconds % 60, 3):g}s"
+
+
+def answer_chat_completion(payload: dict[str, Any]) -> dict[str, Any]:
+    images = count_images(payload)
+
+    if images == 0:
+        # folder requests have no images and expect the tags of a single item
+        content = {"items": {"engines": ["All"], "types": ["Texture"], "genres": []}}
+    else:
+        content = {"tags": [{"types": ["Texture"], "genres": [], "objects": []} for _ in range(images)]}
+    text = json.dumps(content)
+    prompt_tokens = count_prompt_tokens(payload)
+    usage = {
+        "prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 4,
+        "total_tokens": prompt_tokens + len(text) // 4, "prompt_tokens_details": {"cached_tokens": 0}}
+    return {"choices": [{"message": {"role": "assistant", "content": text}}], "usage": usage}
+
+
+def parse_multipart(content_type: str, body: bytes) -> dict[str, bytes]:
+    message = BytesParser(policy=default_policy).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body)
+    return {
+        part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+        for part in message.iter_parts()}
+
+
+class MockOpenAIServer:
+    def __init__(
+            self, latency: float = 0.1, port: int = 0, batch_latency: float = 1.0, error_rate: float = 0.0,
+            rate_limit_rate: float = 0.0, retry_after: float = 0.05, seed: int = 0,
+            requests_per_minute: int = 10000, tokens_per_minute: int = 30000000):
+        """
+        :param latency: Seconds before a chat completion is answered
+        :param port: Port to listen on, 0 picks a free one
+        :param batch_latency: Seconds until a submitted batch is completed
+        :param error_rate: Share of chat completions failing with a 500
+        :param rate_limit_rate: Share of chat completions rejected with a 429
+        :param retry_after: Seconds the failed responses ask the client to wait
+        :param seed: Seed of the failure injection
+        :param requests_per_minute: Chat completions accepted per minute
+        :param tokens_per_minute: Prompt tokens accepted per minute
+        """
+        self.latency = latency
+        self.batch_latency = batch_latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._window_start = time.monotonic()
+        self._window_requests = 0
+        self._window_tokens = 0
+        self.request_count = 0
+        self.status_counts: collections.Counter[int] = collections.Counter()
+        self._random = random.Random(seed)
+        self.files: dict[str, bytes] = {}
+        self.batches: dict[str, dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._create_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/chat/completions"
+
+    def start(self) -> "MockOpenAIServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _count_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def _count_status(self, status: int):
+        with self._lock:
+            self.status_counts[status] += 1
+
+    def _injected_status(self) -> int:
+        with self._lock:
+            value = self._random.random()
+        if value < self.rate_limit_rate:
+            return 429
+        if value < self.rate_limit_rate + self.error_rate:
+            return 500
+        return 200
+
+    def _take_rate_limit(self, tokens: int) -> tuple[bool, dict[str, str]]:
+        """
+        Count a chat completion against the limits of the current minute
+        :return tuple[bool, dict[str, str]]: Whether it is within the limits and the x-ratelimit-* headers
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 60:
+                self._window_start = now
+                self._window_requests = 0
+                self._window_tokens = 0
+            allowed = (
+                    self._window_requests < self.requests_per_minute
+                    and self._window_tokens + tokens <= self.tokens_per_minute)
+            if allowed:
+                self._window_requests += 1
+                self._window_tokens += tokens
+            reset = format_duration(self._window_start + 60 - now)
+            headers = {
+                "x-ratelimit-limit-requests": str(self.requests_per_minute),
+                "x-ratelimit-limit-tokens": str(self.tokens_per_minute),
+                "x-ratelimit-remaining-requests": str(max(0, self.requests_per_minute - self._window_requests)),
+                "x-ratelimit-remaining-tokens": str(max(0, self.tokens_per_minute - self._window_tokens)),
+                "x-ratelimit-reset-requests": reset,
+                "x-ratelimit-reset-tokens": reset,
+            }
+        return allowed, headers
+
+    def _add_file(self, data: bytes, purpose: str) -> dict[str, Any]:
+        with self._lock:
+            file_id = f"file-{next(self._ids)}"
+            self.files[file_id] = data
+        return {"id": file_id, "object": "file", "bytes": len(data), "purpose": purpose}
+
+    def _create_batch(self, request: dict[str, Any]) -> dict[str, Any]:
+        with self._lock:
+            batch_id = f"batch_{next(self._ids)}"
+            lines = self.files[request["input_file_id"]].splitlines()
+            batch = {
+                "id": batch_id, "object": "batch", "endpoint": request["endpoint"],
+                "input_file_id": request["input_file_id"], "status": "in_progress",
+                "created_at": time.time(), "output_file_id": None, "error_file_id": None,
+                "metadata": request.get("metadata") or {},
+                "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+            }
+            self.batches[batch_id] = batch
+        return batch
+
+    def _get_batch(self, batch_id: str) -> dict[str, Any]:
+        with self._lock:
+            batch = self.batches[batch_id]
+            if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.batch_latency:
+                output = []
+                for line in self.files[batch["input_file_id"]].splitlines():
+                    request = json.loads(line)
+                    output.append(json.dumps({
+                        "id": f"batch_req_{next(self._ids)}", "custom_id": request["custom_id"],
+                        "response": {"status_code": 200, "body": answer_chat_completion(request["body"])},
+                        "error": None}))
+                output_id = f"file-{next(self._ids)}"
+                self.files[output_id] = "\n".join(output).encode("utf-8")
+                batch.update(status="completed", output_file_id=output_id)
+                batch["request_counts"]["completed"] = len(output)
+            return dict(batch)
+
+    def _create_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_body(
+                    self, data: bytes, content_type: str = "application/json", status: int = 200,
+                    headers: Optional[dict[str, str]] = None):
+                server._count_status(status)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_json(self, value: Any, status: int = 200, headers: Optional[dict[str, str]] = None):
+                self.send_body(json.dumps(value).encode("utf-8"), status=status, headers=headers)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                server._count_request()
+                if self.path.endswith("/files"):
+                    fields = parse_multipart(self.headers["Content-Type"], body)
+                    self.send_json(server._add_file(fields["file"], fields["purpose"].decode("utf-8")))
+                elif self.path.endswith("/batches"):
+                    self.send_json(server._create_batch(json.loads(body)))
+                else:
+                    status = server._injected_status()
+                    if status == 429:
+                        # rate limits are rejected right away, like the API does
+                        self.send_json(
+                            {"error": {"message": "Rate limit reached", "type": "requests"}}, status,
+                            {"retry-after-ms": str(int(server.retry_after * 1000))})
+                        return
+                    payload = json.loads(body or b"{}")
+                    allowed, headers = server._take_rate_limit(count_prompt_tokens(payload))
+                    if not allowed:
+                        self.send_json(
+                            {"error": {"message": "Rate limit reached", "type": "requests"}}, 429, headers)
+                        return
+                    time.sleep(server.latency)
+                    if status == 500:
+                        self.send_json(
+                            {"error": {"message": "The server had an error", "type": "server_error"}}, status,
+                            {**headers, "retry-after-ms": str(int(server.retry_after * 1000))})
+                        return
+                    self.send_json(answer_chat_completion(payload), headers=headers)
+
+            def do_GET(self):
+                server._count_request()
+                parts = self.path.strip("/").split("/")
+                try:
+                    if parts[-2] == "batches":
+                        self.send_json(server._get_batch(parts[-1]))
+                    elif parts[-1] == "content":
+                        self.send_body(server.files[parts[-2]], "application/jsonl")
+                    else:
+                        self.send_json({"error": {"message": "Not found"}}, 404)
+                except (KeyError, IndexError):
+                    self.send_json({"error": {"message": "Not found"}}, 404)
+
+        return Handler
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Iterable, Iterator, NamedTuple, Optional
+
+from common.logging import log
+from common.paths import get_state_directory
+
+
+class Stage:
+    discovered = 0
+    preview_ready = 1
+    requested = 2
+    cached = 3
+    tagged = 4
+    skipped = 5
+    duplicate = 6
+
+
+stage_names = {
+    Stage.discovered: "discovered",
+    Stage.preview_ready: "preview ready",
+    Stage.requested: "requested",
+    Stage.cached: "cached",
+    Stage.tagged: "tagged",
+    Stage.skipped: "skipped",
+    Stage.duplicate: "near-duplicate",
+}
+
+
+class ManifestEntry(NamedTuple):
+    seq: int
+    path: str
+    stage: int
+    file_hash: Optional[str]
+    preview: Optional[str]
+    tags: Optional[Any]
+
+
+class JobManifest:
+    """
+    On-disk record of every file of a tagging run and the stage it has reached.
+    Files are streamed from the manifest page by page, so memory does not grow with the selection size.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT NOT NULL UNIQUE, stage INTEGER NOT NULL, "
+            "file_hash TEXT, preview TEXT, tags TEXT)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS files_stage ON files (stage, seq)")
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(files)")}
+        for column in ("request_id", "duplicate_of"):
+            if column not in columns:
+                # manifests written by an older version
+                self._connection.execute(f"ALTER TABLE files ADD COLUMN {column} TEXT")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS files_request ON files (request_id)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._connection.commit()
+
+    def get_meta(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key: str, value: Any):
+        with self._lock:
+            if value is None:
+                self._connection.execute("DELETE FROM meta WHERE key = ?", (key,))
+            else:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            self._connection.commit()
+
+    def add_files(self, paths: Iterable[str]):
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO files (path, stage) VALUES (?, ?)",
+                ((path, Stage.discovered) for path in paths))
+            self._connection.commit()
+
+    def update(self, path: str, stage: int, file_hash: Optional[str] = None, preview: Optional[str] = None,
+               tags: Optional[Any] = None):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE files SET stage = ?, file_hash = COALESCE(?, file_hash), preview = COALESCE(?, preview), "
+                "tags = COALESCE(?, tags) WHERE path = ?",
+                (stage, file_hash, preview, json.dumps(tags) if tags is not None else None, path))
+            self._connection.commit()
+
+    def update_many(self, paths: Iterable[str], stage: int):
+        with self._lock:
+            self._connection.executemany(
+                "UPDATE files SET stage = ? WHERE path = ?", ((stage, path) for path in paths))
+            self._connection.commit()
+
+    def update_tags(self, tagged_files: Iterable[tuple[str, Any]]):
+        """
+        Mark files as tagged and keep their tags, near-duplicates copy them later
+        """
+        with self._lock:
+            self._connection.executemany(
+                "UPDATE files SET stage = ?, tags = ? WHERE path = ?",
+                ((Stage.tagged, json.dumps(tags), path) for path, tags in tagged_files))
+            self._connection.commit()
+
+    def mark_duplicates(self, duplicates: Iterable[tuple[str, str]]):
+        """
+        :param duplicates: Paths of near-duplicates and the path of the file whose tags they get
+        """
+        with self._lock:
+            self._connection.executemany(
+                "UPDATE files SET stage = ?, duplicate_of = ? WHERE path = ?",
+                ((Stage.duplicate, representative, path) for path, representative in duplicates))
+            self._connection.commit()
+
+    def iter_duplicates(self, page_size: int = 500) -> Iterator[tuple[ManifestEntry, int, Optional[Any]]]:
+        """
+        Near-duplicates with the stage and tags of their representative
+        """
+        last_seq = -1
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT f.seq, f.path, f.stage, f.file_hash, f.preview, f.tags, r.stage, r.tags "
+                    "FROM files f JOIN files r ON r.path = f.duplicate_of "
+                    "WHERE f.stage = ? AND f.seq > ? ORDER BY f.seq LIMIT ?",
+                    (Stage.duplicate, last_seq, page_size)).fetchall()
+            if not rows:
+                return
+            for seq, path, stage, file_hash, preview, tags, representative_stage, representative_tags in rows:
+                entry = ManifestEntry(seq, path, stage, file_hash, preview, json.loads(tags) if tags else None)
+                yield entry, representative_stage, json.loads(representative_tags) if representative_tags else None
+            last_seq = rows[-1][0]
+
+    def assign_request(self, paths: Iterable[str], request_id: str):
+        """
+        Mark files as requested by a request whose response arrives later, e.g. as part of a batch
+        """
+        with self._lock:
+            self._connection.executemany(
+                "UPDATE files SET stage = ?, request_id = ? WHERE path = ?",
+                ((Stage.requested, request_id, path) for path in paths))
+            self._connection.commit()
+
+    def get_request(self, request_id: str) -> list[ManifestEntry]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT seq, path, stage, file_hash, preview, tags FROM files WHERE request_id = ? ORDER BY seq",
+                (request_id,)).fetchall()
+        return [ManifestEntry(seq, path, stage, file_hash, preview, json.loads(tags) if tags else None)
+                for seq, path, stage, file_hash, preview, tags in rows]
+
+    def count(self, *stages: int) -> int:
+        with self._lock:
+            if not stages:
+                return self._connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            placeholders = ", ".join("?" * len(stages))
+            return self._connection.execute(
+                f"SELECT COUNT(*) FROM files WHERE stage IN ({placeholders})", stages).fetchone()[0]
+
+    def iter_files(self, *stages: int, page_size: int = 500) -> Iterator[ManifestEntry]:
+        placeholders = ", ".join("?" * len(stages))
+        last_seq = -1
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT seq, path, stage, file_hash, preview, tags FROM files "
+                    f"WHERE stage IN ({placeholders}) AND seq > ? ORDER BY seq LIMIT ?",
+                    (*stages, last_seq, page_size)).fetchall()
+            if not rows:
+                return
+            for seq, path, stage, file_hash, preview, tags in rows:
+                yield ManifestEntry(seq, path, stage, file_hash, preview, json.loads(tags) if tags else None)
+            last_seq = rows[-1][0]
+
+    def iter_batches(self, batch_size: int, *stages: int) -> Iterator[list[ManifestEntry]]:
+        batch = []
+        for entry in self.iter_files(*stages):
+            batch.append(entry)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def reset_interrupted(self):
+        """
+        Bring files of an interrupted run back to a stage they can continue from.
+        Files of a pending batch stay requested, their results are picked up from the batch.
+        """
+        if not self.get_meta("batch_ids"):
+            self.release_requested()
+        self.release_missing_previews()
+
+    def release_missing_previews(self) -> int:
+        """
+        Previews live in the temp folder, they may have been cleaned up or evicted from the preview cache
+        in the meantime. Their files are generated again.
+        :return int: Number of files whose preview is missing
+        """
+        missing = [entry.path for entry in self.iter_files(Stage.preview_ready)
+                   if not entry.preview or not os.path.exists(entry.preview)]
+        self.update_many(missing, Stage.discovered)
+        return len(missing)
+
+    def release_requested(self):
+        """
+        Files still waiting for a response can be requested again
+        """
+        with self._lock:
+            self._connection.execute(
+                "UPDATE files SET stage = ?, request_id = NULL WHERE stage = ?", (Stage.preview_ready, Stage.requested))
+            self._connection.commit()
+
+    def is_complete(self) -> bool:
+        return self.count(Stage.tagged, Stage.skipped) == self.count()
+
+    def summary(self) -> str:
+        with self._lock:
+            rows = self._connection.execute("SELECT stage, COUNT(*) FROM files GROUP BY stage").fetchall()
+        return ", ".join(f"{stage_names[stage]}: {count}" for stage, count in rows)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def discard(self):
+        self.close()
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+
+def get_job_id(input_paths: Iterable[str], request_fingerprint: str) -> str:
+    hash_func = hashlib.sha256(request_fingerprint.encode("utf-8"))
+    for path in sorted(input_paths):
+        hash_func.update(path.encode("utf-8"))
+        hash_func.update(b"\0")
+    return hash_func.hexdigest()[:16]
+
+
+def open_job_manifest(job_id: str) -> tuple[JobManifest, bool]:
+    """
+    Open the manifest of a job, resuming it if a previous run of the same job did not finish
+    :return tuple[JobManifest, bool]: The manifest and whether an unfinished run was found
+    """
+    path = os.path.join(get_state_directory("jobs"), f"{job_id}.db")
+    resumed = os.path.exists(path)
+    manifest = JobManifest(path)
+    if resumed:
+        manifest.reset_interrupted()
+        log(f"Resuming job {job_id} ({manifest.summary()})")
+    return manifest, resumed
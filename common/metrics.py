@@ -0,0 +1,189 @@
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Iterator, Optional
+
+from common.paths import get_data_directory
+
+# upper bounds of the latency buckets in seconds, from a cached lookup to a slow request
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+# summaries of older runs are deleted
+max_summary_files = 50
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the quantile, the exact maximum for the last one
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "min": round(self.min, 6) if self.count else 0.0,
+            "max": round(self.max, 6),
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+        }
+
+
+class RunMetrics:
+    """
+    Latency histograms per stage and counters (bytes uploaded, tokens used, ...) of a single run.
+    Thread-safe, stages are recorded from the worker threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, action: str = ""):
+        with self._lock:
+            self.action = action
+            self.started_at = datetime.now()
+            self._start = time.perf_counter()
+            self.histograms: dict[str, Histogram] = {}
+            self.counters: dict[str, float] = {}
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def add(self, counter: str, value: float = 1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def summary(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "action": self.action,
+                "started_at": self.started_at.isoformat(timespec="seconds"),
+                "duration": round(time.perf_counter() - self._start, 3),
+                "stages": {stage: histogram.to_dict() for stage, histogram in self.histograms.items()},
+                "counters": dict(self.counters),
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        Prometheus text exposition format, e.g. for the textfile collector of the node exporter
+        """
+        action = self.action.replace("\\", "\\\\").replace('"', '\\"')
+        lines = [
+            "# HELP ai_tagger_stage_seconds Duration of the stages of the last run",
+            "# TYPE ai_tagger_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in self.histograms.items():
+                labels = f'action="{action}",stage="{stage}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if math.isinf(bound) else repr(bound)
+                    lines.append(f'ai_tagger_stage_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"ai_tagger_stage_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"ai_tagger_stage_seconds_count{{{labels}}} {histogram.count}")
+            for counter, value in self.counters.items():
+                name = f"ai_tagger_{counter}_total"
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f'{name}{{action="{action}"}} {value:g}')
+            lines.append("# TYPE ai_tagger_run_duration_seconds gauge")
+            lines.append(f'ai_tagger_run_duration_seconds{{action="{action}"}} {time.perf_counter() - self._start}')
+        return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path: str, content: str):
+    # scrapers must never see a half written file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def write_run_metrics(prometheus_file: str = "") -> str:
+    """
+    Write the summary of the current run as JSON next to the other local data, the oldest summaries are removed
+    :param prometheus_file: Also write the metrics in Prometheus text format to this file, if set
+    :return str: Path of the JSON summary
+    """
+    directory = get_data_directory("metrics")
+    summary = run_metrics.summary()
+    file_name = f"{summary['action'] or 'run'}_{run_metrics.started_at:%Y%m%d-%H%M%S}.json"
+    path = os.path.join(directory, file_name)
+    _write_atomic(path, json.dumps(summary, indent=2))
+
+    summaries = sorted(
+        (os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".json")),
+        key=os.path.getmtime)
+    for old_path in summaries[:-max_summary_files]:
+        os.remove(old_path)
+
+    if prometheus_file:
+        _write_atomic(prometheus_file, run_metrics.to_prometheus())
+    return path
+
+
+run_metrics = RunMetrics()
+
+
+def span(stage: str):
+    return run_metrics.span(stage)
+
+
+def format_summary(summary: Optional[dict[str, Any]] = None) -> str:
+    """
+    Human-readable table of the stages of a run, for the log
+    """
+    summary = summary or run_metrics.summary()
+    lines = [f"Run {summary['action']} took {summary['duration']:.2f}s"]
+    for stage, stats in sorted(summary["stages"].items(), key=lambda item: -item[1]["sum"]):
+        lines.append(
+            f"  {stage:<16} {stats['count']:>7} x  total {stats['sum']:>8.2f}s  "
+            f"p50 {stats['p50'] * 1000:>8.1f}ms  p95 {stats['p95'] * 1000:>8.1f}ms")
+    for counter, value in summary["counters"].items():
+        lines.append(f"  {counter}: {value:g}")
+    return "\n".join(lines)
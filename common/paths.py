@@ -0,0 +1,50 @@
+import os
+import shutil
+import sys
+import tempfile
+
+# state an older version kept in the temporary data directory, moved to the state directory on first use
+legacy_state_names = ["usage.db", "folder_signatures.db", "jobs"]
+
+
+def get_data_directory(*parts: str) -> str:
+    # Caches of the tagger live next to the generated previews, they can be deleted at any time
+    directory = os.path.join(tempfile.gettempdir(), "anchorpoint", "ai_tagger", *parts)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def get_user_data_root() -> str:
+    if sys.platform == "win32":
+        return os.environ.get("LOCALAPPDATA") or os.environ.get("APPDATA") or os.path.expanduser("~\\AppData\\Local")
+    if sys.platform == "darwin":
+        return os.path.expanduser("~/Library/Application Support")
+    return os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+
+
+def get_state_directory(*parts: str) -> str:
+    """
+    Directory of the state that has to outlive temp cleanups and reboots:
+    the usage ledger the budget is enforced with, job manifests and folder signatures.
+    AI_TAGGER_STATE_DIR overrides the per-user data directory of the platform.
+    """
+    root = os.environ.get("AI_TAGGER_STATE_DIR") or os.path.join(get_user_data_root(), "anchorpoint", "ai_tagger")
+    if not os.path.isdir(root):
+        os.makedirs(root, exist_ok=True)
+        move_legacy_state(root)
+    directory = os.path.join(root, *parts)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def move_legacy_state(root: str):
+    legacy_root = os.path.join(tempfile.gettempdir(), "anchorpoint", "ai_tagger")
+    if not os.path.isdir(legacy_root):
+        return
+    for name in os.listdir(legacy_root):
+        # databases come with their -wal and -shm files
+        if name in legacy_state_names or name.split("-")[0] in legacy_state_names:
+            try:
+                shutil.move(os.path.join(legacy_root, name), os.path.join(root, name))
+            except OSError:
+                pass
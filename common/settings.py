@@ -1,8 +1,42 @@
-import apsync as aps
+import threading
+import typing
+from typing import Optional
+
+try:
+    import apsync as aps
+except ImportError:
+    # outside of Anchorpoint, e.g. in the headless tagger
+    aps = None
+
+# when a file counts as already tagged
+skip_existing_modes = {
+    "types": "Types are set",
+    "any": "Any enabled category is set",
+    "all": "All enabled categories are set",
+}
+
+
+class MemorySettings:
+    """
+    Stand-in for aps.Settings when apsync is not available, values only live as long as the process
+    """
+
+    def __init__(self):
+        self._values: dict[str, object] = {}
+
+    def get(self, key: str, default: object = "") -> object:
+        return self._values.get(key, default)
+
+    def set(self, key: str, value: object):
+        self._values[key] = value
+
+    def store(self):
+        pass
+
 
 class TaggerSettings:
     def __init__(self):
-        self.local_settings = aps.Settings("ht_ai_tagger")
+        self.local_settings = aps.Settings("ht_ai_tagger") if aps is not None else MemorySettings()
         self.load()
 
     def get(self, key: str, default: object = "") -> object:
@@ -17,10 +51,35 @@ class TaggerSettings:
     file_label_ai_objects: bool
     file_label_ai_objects_min: int
     file_label_ai_objects_max: int
+    file_skip_existing: bool
+    file_skip_existing_mode: str
+    file_max_concurrent_requests: int
+    file_streaming_mode: bool
+    file_batch_mode: bool
+    preview_parallelism: int
+    file_dedup_enabled: bool
+    file_dedup_threshold: int
+    image_format: str
+    image_quality: int
     folder_use_ai_engines: bool
     folder_use_ai_types: bool
     folder_use_ai_genres: bool
+    folder_token_budget: int
+    folder_summary_depth: int
+    folder_max_concurrent_requests: int
+    folder_skip_unchanged: bool
+    alias_file: str
+    cache_enabled: bool
+    cache_max_age_days: int
+    cache_max_size_mb: int
+    preview_cache_max_size_mb: int
+    request_timeout: int
+    request_gzip: bool
+    request_max_retries: int
+    budget_limit: float
+    budget_period_days: int
     debug_log: bool
+    metrics_prometheus_file: str
 
     def any_file_tags_selected(self):
         return self.file_label_ai_types or self.file_label_ai_genres or self.file_label_ai_objects
@@ -35,10 +94,35 @@ class TaggerSettings:
         self.file_label_ai_objects = bool(self.get("file_label_ai_objects", True))
         self.file_label_ai_objects_min = int(str(self.get("file_label_ai_objects_min", 1)))
         self.file_label_ai_objects_max = int(str(self.get("file_label_ai_objects_max", 5)))
+        self.file_skip_existing = bool(self.get("file_skip_existing", True))
+        self.file_skip_existing_mode = str(self.get("file_skip_existing_mode", "types"))
+        self.file_max_concurrent_requests = int(str(self.get("file_max_concurrent_requests", 4)))
+        self.file_streaming_mode = bool(self.get("file_streaming_mode", False))
+        self.file_batch_mode = bool(self.get("file_batch_mode", False))
+        self.preview_parallelism = int(str(self.get("preview_parallelism", 8)))
+        self.file_dedup_enabled = bool(self.get("file_dedup_enabled", False))
+        self.file_dedup_threshold = int(str(self.get("file_dedup_threshold", 4)))
+        self.image_format = str(self.get("image_format", "JPEG"))
+        self.image_quality = int(str(self.get("image_quality", 85)))
         self.folder_use_ai_engines = bool(self.get("folder_use_ai_engines", True))
         self.folder_use_ai_types = bool(self.get("folder_use_ai_types", True))
         self.folder_use_ai_genres = bool(self.get("folder_use_ai_genres", True))
+        self.folder_token_budget = int(str(self.get("folder_token_budget", 2000)))
+        self.folder_summary_depth = int(str(self.get("folder_summary_depth", 4)))
+        self.folder_max_concurrent_requests = int(str(self.get("folder_max_concurrent_requests", 4)))
+        self.folder_skip_unchanged = bool(self.get("folder_skip_unchanged", True))
+        self.alias_file = str(self.get("alias_file", ""))
+        self.cache_enabled = bool(self.get("cache_enabled", True))
+        self.cache_max_age_days = int(str(self.get("cache_max_age_days", 30)))
+        self.cache_max_size_mb = int(str(self.get("cache_max_size_mb", 64)))
+        self.preview_cache_max_size_mb = int(str(self.get("preview_cache_max_size_mb", 512)))
+        self.request_timeout = int(str(self.get("request_timeout", 120)))
+        self.request_gzip = bool(self.get("request_gzip", False))
+        self.request_max_retries = int(str(self.get("request_max_retries", 5)))
+        self.budget_limit = float(str(self.get("budget_limit", 0.0)))
+        self.budget_period_days = int(str(self.get("budget_period_days", 30)))
         self.debug_log = bool(self.get("debug_log", False))
+        self.metrics_prometheus_file = str(self.get("metrics_prometheus_file", ""))
 
     def store(self):
         self.set("openai_api_key", self.openai_api_key)
@@ -47,10 +131,61 @@ class TaggerSettings:
         self.set("file_label_ai_objects", self.file_label_ai_objects)
         self.set("file_label_ai_objects_min", self.file_label_ai_objects_min)
         self.set("file_label_ai_objects_max", self.file_label_ai_objects_max)
+        self.set("file_skip_existing", self.file_skip_existing)
+        self.set("file_skip_existing_mode", self.file_skip_existing_mode)
+        self.set("file_max_concurrent_requests", self.file_max_concurrent_requests)
+        self.set("file_streaming_mode", self.file_streaming_mode)
+        self.set("file_batch_mode", self.file_batch_mode)
+        self.set("preview_parallelism", self.preview_parallelism)
+        self.set("file_dedup_enabled", self.file_dedup_enabled)
+        self.set("file_dedup_threshold", self.file_dedup_threshold)
+        self.set("image_format", self.image_format)
+        self.set("image_quality", self.image_quality)
         self.set("folder_use_ai_engines", self.folder_use_ai_engines)
         self.set("folder_use_ai_types", self.folder_use_ai_types)
         self.set("folder_use_ai_genres", self.folder_use_ai_genres)
+        self.set("folder_token_budget", self.folder_token_budget)
+        self.set("folder_summary_depth", self.folder_summary_depth)
+        self.set("folder_max_concurrent_requests", self.folder_max_concurrent_requests)
+        self.set("folder_skip_unchanged", self.folder_skip_unchanged)
+        self.set("alias_file", self.alias_file)
+        self.set("cache_enabled", self.cache_enabled)
+        self.set("cache_max_age_days", self.cache_max_age_days)
+        self.set("cache_max_size_mb", self.cache_max_size_mb)
+        self.set("preview_cache_max_size_mb", self.preview_cache_max_size_mb)
+        self.set("request_timeout", self.request_timeout)
+        self.set("request_gzip", self.request_gzip)
+        self.set("request_max_retries", self.request_max_retries)
+        self.set("budget_limit", self.budget_limit)
+        self.set("budget_period_days", self.budget_period_days)
         self.set("debug_log", self.debug_log)
+        self.set("metrics_prometheus_file", self.metrics_prometheus_file)
         self.local_settings.store()
 
-tagger_settings = TaggerSettings()
+
+_tagger_settings: Optional[TaggerSettings] = None
+_tagger_settings_lock = threading.Lock()
+
+
+def get_tagger_settings() -> TaggerSettings:
+    global _tagger_settings
+    with _tagger_settings_lock:
+        if _tagger_settings is None:
+            _tagger_settings = TaggerSettings()
+        return _tagger_settings
+
+
+class _DeferredTaggerSettings:
+    """
+    Reads the stored settings on first access instead of on import, so modules importing
+    `tagger_settings` load quickly
+    """
+
+    def __getattr__(self, name: str) -> typing.Any:
+        return getattr(get_tagger_settings(), name)
+
+    def __setattr__(self, name: str, value: typing.Any):
+        setattr(get_tagger_settings(), name, value)
+
+
+tagger_settings = typing.cast(TaggerSettings, _DeferredTaggerSettings())
@@ -0,0 +1,56 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from common.paths import get_state_directory
+
+
+class SignatureStore:
+    """
+    Tree signatures of tagged folders with the request fingerprint they were tagged with.
+    A folder whose signature and fingerprint are unchanged would get the same tags again and can be skipped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            "folder TEXT PRIMARY KEY, signature TEXT NOT NULL, fingerprint TEXT NOT NULL, tagged REAL NOT NULL)")
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(workspace_id: str, folder: str) -> str:
+        return f"{workspace_id}:{os.path.normcase(os.path.abspath(folder))}"
+
+    def is_unchanged(self, key: str, signature: str, request_fingerprint: str) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT signature, fingerprint FROM signatures WHERE folder = ?", (key,)).fetchone()
+        return row is not None and row[0] == signature and row[1] == request_fingerprint
+
+    def put(self, key: str, signature: str, request_fingerprint: str):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO signatures (folder, signature, fingerprint, tagged) VALUES (?, ?, ?, ?)",
+                (key, signature, request_fingerprint, time.time()))
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_signature_store: Optional[SignatureStore] = None
+_signature_store_lock = threading.Lock()
+
+
+def get_signature_store() -> SignatureStore:
+    global _signature_store
+    with _signature_store_lock:
+        if _signature_store is None:
+            _signature_store = SignatureStore(os.path.join(get_state_directory(), "folder_signatures.db"))
+        return _signature_store
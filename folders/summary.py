@@ -0,0 +1,129 @@
+import re
+from collections import Counter
+from typing import Iterable, Optional
+
+from ai.tokens import count_tokens
+from folders.tree import TreeIndex, TreeNode, get_extension
+
+# digit runs are folded so numbered sequences like "rock_01.png" ... "rock_99.png" become one sample
+_numbers = re.compile(r"\d+")
+
+
+def format_histogram(extensions: Counter, limit: int) -> str:
+    """
+    Most common extensions with their counts, e.g. "png 120, fbx 30, 4 other 7"
+    """
+    common = extensions.most_common(limit)
+    parts = [f"{extension.lstrip('.')} {count}" for extension, count in common]
+    if len(extensions) > limit:
+        others = sum(extensions.values()) - sum(count for _, count in common)
+        parts.append(f"{len(extensions) - limit} other {others}")
+    return ", ".join(parts)
+
+
+def sample_file_names(file_names: Iterable[str], limit: int) -> list[str]:
+    """
+    Representative names of a directory: the most common name patterns, one per extension first,
+    a pattern shared by several files is shown once with its count, e.g. "rock_#.png x99"
+    """
+    if limit <= 0:
+        return []
+    patterns = Counter(_numbers.sub("#", name) for name in file_names)
+    if not patterns:
+        return []
+
+    ordered = patterns.most_common()
+    samples = []
+    seen_extensions = set()
+    for pattern, _ in ordered:
+        extension = get_extension(pattern)
+        if extension not in seen_extensions:
+            seen_extensions.add(extension)
+            samples.append(pattern)
+        if len(samples) == limit:
+            break
+    for pattern, _ in ordered:
+        if len(samples) == limit:
+            break
+        if pattern not in samples:
+            samples.append(pattern)
+
+    return [pattern if patterns[pattern] == 1 else f"{pattern} x{patterns[pattern]}" for pattern in samples]
+
+
+def format_directory(directory: TreeNode, depth: int, histogram_size: int, sample_count: int) -> str:
+    line = f"{'  ' * depth}{directory.name}/ {directory.file_count} files"
+    if directory.folder_count:
+        line += f", {directory.folder_count} folders"
+    if directory.extensions:
+        line += f" ({format_histogram(directory.extensions, histogram_size)})"
+    samples = sample_file_names(directory.file_names, sample_count)
+    if samples:
+        line += f": {', '.join(samples)}"
+    return line
+
+
+def build_folder_summary(
+        root: TreeNode, token_budget: int, max_depth: int = 4,
+        sample_count: int = 3, histogram_size: int = 6) -> str:
+    """
+    Compact description of a folder tree that fits a token budget.
+    The header holds totals and the extension histogram of the whole tree. Directory lines follow in tree order,
+    each with its subtree histogram and a few sample names; they are added breadth-first, biggest directories
+    first, until the budget is used up. A directory that doesn't fit is still counted in its parent's line.
+    :param root: Indexed directory to summarize
+    :param token_budget: Maximum number of tokens of the summary
+    :param max_depth: Deepest directory level listed, the root is level 0
+    :param sample_count: Maximum number of sample file names per directory
+    :param histogram_size: Maximum number of extensions listed per directory
+    :return str: The summary
+    """
+    directories = list(root.walk())
+    max_found_depth = max(depth for _, depth in directories)
+    header = (
+        f"{root.file_count} files in {root.folder_count + 1} folders, {max_found_depth + 1} levels deep\n"
+        f"Extensions: {format_histogram(root.extensions, histogram_size * 3)}")
+    # the "Structure:" line and the omitted folders note
+    remaining = token_budget - count_tokens(header) - 16
+    if remaining <= 0:
+        return header
+
+    # position of every directory in tree order, the selected lines are output in this order
+    order = {id(directory): i for i, (directory, _) in enumerate(directories)}
+    parents = {id(child): directory for directory, _ in directories for child in directory.children.values()}
+    candidates = sorted(
+        ((directory, depth) for directory, depth in directories if depth <= max_depth),
+        key=lambda item: (item[1], -item[0].file_count, order[id(item[0])]))
+
+    selected: dict[int, str] = {}
+    for directory, depth in candidates:
+        if remaining < 8:
+            # not even the shortest line fits anymore
+            break
+        parent = parents.get(id(directory))
+        if parent is not None and id(parent) not in selected:
+            # never list a directory without its parent
+            continue
+        # lines are only formatted while there is budget left, and every line adds a newline token
+        for line in (
+                format_directory(directory, depth, histogram_size, sample_count),
+                format_directory(directory, depth, 3, 0)):
+            line_tokens = count_tokens(line) + 1
+            if line_tokens <= remaining:
+                selected[id(directory)] = line
+                remaining -= line_tokens
+                break
+
+    lines = [header, "Structure:"] + [selected[key] for key in sorted(selected, key=order.get)]
+    omitted = len(directories) - len(selected)
+    if omitted:
+        lines.append(f"({omitted} more folders not listed)")
+    return "\n".join(lines)
+
+
+def summarize_folder(
+        input_path: str, token_budget: int, max_depth: int = 4, sample_count: int = 3,
+        tree_index: Optional[TreeIndex] = None) -> str:
+    tree_index = tree_index or TreeIndex()
+    root = tree_index.get(input_path) or tree_index.add_root(input_path)
+    return build_folder_summary(root, token_budget, max_depth, sample_count)
@@ -0,0 +1,161 @@
+import hashlib
+import os
+from collections import Counter
+from typing import Iterable, Iterator, Mapping, Optional
+
+
+def get_extension(file_name: str) -> str:
+    # cheaper than os.path.splitext, which matters for 100k file trees
+    dot = file_name.rfind(".")
+    return file_name[dot:].lower() if dot > 0 else "(none)"
+
+
+class TreeNode:
+    """
+    A directory with its own file names and aggregates of everything below it
+    """
+    __slots__ = (
+        "name", "path", "file_names", "file_stats", "children", "extensions", "file_count", "folder_count",
+        "signature")
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.file_names: list[str] = []
+        # size and modification time of every file, in the order of `file_names`
+        self.file_stats: list[tuple[int, int]] = []
+        self.children: dict[str, TreeNode] = {}
+        # subtree aggregates, filled by `aggregate`
+        self.extensions: Counter = Counter()
+        self.file_count = 0
+        self.folder_count = 0
+        self.signature = ""
+
+    def walk(self) -> Iterator[tuple["TreeNode", int]]:
+        """
+        This node and all nodes below it with their depth relative to this node, parents before children
+        """
+        stack = [(self, 0)]
+        while stack:
+            node, depth = stack.pop()
+            yield node, depth
+            stack.extend((child, depth + 1) for child in reversed(node.children.values()))
+
+    def aggregate(self):
+        """
+        Recompute the subtree aggregates of this node and all nodes below it.
+        The signature is a Merkle hash over the names, sizes and modification times of the own files
+        and the names and signatures of the subfolders, so it changes with anything below the node.
+        """
+        for node, _ in reversed(list(self.walk())):
+            node.extensions = Counter(get_extension(name) for name in node.file_names)
+            node.file_count = len(node.file_names)
+            node.folder_count = len(node.children)
+            digest = hashlib.sha1()
+            # trees built from file names alone have no stats
+            stats = node.file_stats or [(0, 0)] * len(node.file_names)
+            for name, (size, modified) in sorted(zip(node.file_names, stats)):
+                digest.update(f"f{name}\0{size}\0{modified}\n".encode("utf-8", "surrogateescape"))
+            for name in sorted(node.children):
+                child = node.children[name]
+                node.extensions.update(child.extensions)
+                node.file_count += child.file_count
+                node.folder_count += child.folder_count
+                digest.update(f"d{name}\0{child.signature}\n".encode("utf-8", "surrogateescape"))
+            node.signature = digest.hexdigest()
+
+
+def _normalize_path(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+class TreeIndex:
+    """
+    Directory trees of several roots, each directory is scanned once even if selected roots overlap or are nested
+    """
+
+    def __init__(self):
+        self._nodes: dict[str, TreeNode] = {}
+        self._roots: dict[str, TreeNode] = {}
+
+    def get(self, path: str) -> Optional[TreeNode]:
+        return self._nodes.get(_normalize_path(path))
+
+    def add_root(self, path: str) -> TreeNode:
+        """
+        Index a directory with a single os.scandir pass, parts that were indexed before are reused
+        :param path: Directory to index
+        :return TreeNode: The node of the directory, with its aggregates computed
+        """
+        key = _normalize_path(path)
+        node = self._nodes.get(key)
+        if node is not None:
+            return node
+
+        root = TreeNode(os.path.basename(path.rstrip("\\/")) or path, path)
+        self._nodes[key] = root
+        self._roots[key] = root
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            try:
+                with os.scandir(node.path) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        if not is_dir:
+                            try:
+                                # free on Windows, where scandir already returns the stat data
+                                stat = entry.stat(follow_symlinks=False)
+                                node.file_stats.append((stat.st_size, stat.st_mtime_ns))
+                            except OSError:
+                                node.file_stats.append((0, 0))
+                            node.file_names.append(entry.name)
+                            continue
+
+                        child_key = _normalize_path(entry.path)
+                        child = self._roots.pop(child_key, None)
+                        if child is None:
+                            child = TreeNode(entry.name, entry.path)
+                            self._nodes[child_key] = child
+                            stack.append(child)
+                        # else a previously selected root is nested here, reuse its subtree
+                        node.children[entry.name] = child
+            except OSError:
+                # unreadable directories are kept, just empty
+                continue
+
+        root.aggregate()
+        return root
+
+
+def build_tree_index(paths: Iterable[str]) -> TreeIndex:
+    """
+    Index all paths, outer directories first, so nested selections are looked up instead of scanned again
+    """
+    index = TreeIndex()
+    for path in sorted(paths, key=lambda p: len(_normalize_path(p))):
+        if os.path.isdir(path):
+            index.add_root(path)
+    return index
+
+
+def tree_from_structure(folder_structure: Mapping[str, list[str]], name: str = "root") -> TreeNode:
+    """
+    Build a tree from file names keyed by the relative directory path with "/" separators, the root itself is ""
+    """
+    root = TreeNode(name, "")
+    for path, file_names in folder_structure.items():
+        node = root
+        if path:
+            for part in path.split("/"):
+                child = node.children.get(part)
+                if child is None:
+                    child = TreeNode(part, f"{node.path}/{part}" if node.path else part)
+                    node.children[part] = child
+                node = child
+        node.file_names.extend(file_names)
+    root.aggregate()
+    return root
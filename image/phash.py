@@ -0,0 +1,112 @@
+import numpy as np
+from PIL import Image
+
+hash_bits = 64
+
+# set bits of every byte value, for numpy versions without np.bitwise_count
+_popcount_table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def difference_hash(image_path: str, hash_size: int = 8) -> int:
+    """
+    dHash: compares the brightness of horizontally neighbouring pixels of a tiny grayscale version of the image.
+    Resizes, recompressions and recolors with similar brightness keep most bits, so near-duplicates
+    end up a small Hamming distance apart.
+    :param image_path: Path to the image file
+    :param hash_size: Rows and bit columns, 8 gives a 64-bit hash
+    :return int: The hash
+    """
+    with Image.open(image_path) as image:
+        image.draft("L", (hash_size * 4, hash_size * 4))
+        if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+            # transparent pixels are compared as white, like they are uploaded
+            image = image.convert("RGBA")
+            background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+            image = Image.alpha_composite(background, image)
+        pixels = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _popcount_table[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _near_pairs(hashes: np.ndarray, threshold: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Index pairs of hashes within the threshold. The bits are split into threshold + 1 chunks,
+    two hashes that differ in at most `threshold` bits are equal in at least one chunk (pigeonhole),
+    so only hashes sharing a chunk value are compared
+    """
+    chunk_count = min(threshold + 1, hash_bits)
+    boundaries = np.linspace(0, hash_bits, chunk_count + 1).astype(np.uint64)
+    left = []
+    right = []
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        mask = np.uint64((1 << int(end - start)) - 1)
+        keys = (hashes >> start) & mask
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        sorted_hashes = hashes[order]
+        # equal keys are neighbours after sorting, compare every item with the following ones of its run
+        offset = 1
+        while offset < len(order):
+            same = np.flatnonzero(sorted_keys[:-offset] == sorted_keys[offset:])
+            if len(same) == 0:
+                break
+            # candidates are checked right away, only actual near-duplicates are kept in memory
+            close = same[popcount(sorted_hashes[same] ^ sorted_hashes[same + offset]) <= threshold]
+            left.append(order[close])
+            right.append(order[close + offset])
+            offset += 1
+
+    if not left:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    return np.concatenate(left), np.concatenate(right)
+
+
+def group_near_duplicates(hashes: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Group hashes within `threshold` differing bits of each other.
+    Groups are the connected components of the near-duplicate pairs, a member further than `threshold` from
+    its group's representative (the lowest index) is split off into its own group, so chains of small
+    differences don't merge unrelated images.
+    :param hashes: 64-bit hashes, one per image
+    :param threshold: Maximum Hamming distance of near-duplicates, 0 only groups identical hashes
+    :return np.ndarray: Index of the representative of every image, representatives map to themselves
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    count = len(hashes)
+    labels = np.arange(count)
+    if count < 2 or threshold < 0:
+        return labels
+
+    # identical hashes are grouped up front, large runs of e.g. blank previews would explode the pair search
+    unique_hashes, inverse = np.unique(hashes, return_inverse=True)
+    unique_labels = np.arange(len(unique_hashes))
+    if threshold > 0 and len(unique_hashes) > 1:
+        left, right = _near_pairs(unique_hashes, threshold)
+        # connected components by label propagation with pointer jumping
+        while len(left):
+            smallest = np.minimum(unique_labels[left], unique_labels[right])
+            updated = unique_labels.copy()
+            np.minimum.at(updated, left, smallest)
+            np.minimum.at(updated, right, smallest)
+            updated = updated[updated]
+            if np.array_equal(updated, unique_labels):
+                break
+            unique_labels = updated
+
+    # the representative of a group is its lowest original index
+    component = unique_labels[inverse.reshape(-1)]
+    representative = np.full(len(unique_hashes), count, dtype=np.int64)
+    np.minimum.at(representative, component, np.arange(count))
+    labels = representative[component]
+
+    too_far = popcount(hashes ^ hashes[labels]) > threshold
+    labels[too_far] = np.flatnonzero(too_far)
+    return labels
@@ -0,0 +1,61 @@
+import collections
+import concurrent.futures
+import itertools
+import time
+import typing
+from typing import Iterable, Iterator, Optional
+
+from image.resize import PreprocessedImage, preprocess_image
+
+
+class PreprocessResult(typing.NamedTuple):
+    path: str
+    image: Optional[PreprocessedImage]
+    error: str
+    # spent in the worker, whose own metrics don't reach the calling process
+    seconds: float
+
+
+def _preprocess(path: str, max_dimension: int, image_format: str, quality: int) -> PreprocessResult:
+    # runs in a worker process, errors are returned as text since not every exception can be pickled
+    start = time.perf_counter()
+    try:
+        image = preprocess_image(path, max_dimension, image_format, quality)
+        return PreprocessResult(path, image, "", time.perf_counter() - start)
+    except (OSError, ValueError) as e:
+        return PreprocessResult(path, None, str(e), time.perf_counter() - start)
+
+
+def iter_preprocessed(
+        paths: Iterable[str], max_dimension: int, image_format: str = "JPEG", quality: int = 85,
+        processes: int = 0, window: int = 256) -> Iterator[PreprocessResult]:
+    """
+    Trim, resize and encode images on all CPU cores, decoding is CPU-bound and holds the GIL in parts,
+    so threads don't scale like processes do.
+    Paths are consumed lazily in windows, so a huge input doesn't queue all images at once.
+    :param paths: Paths of the image files
+    :param max_dimension: Maximum dimension for the resized images
+    :param image_format: Output format, one of JPEG, WEBP or PNG
+    :param quality: Output quality for lossy formats
+    :param processes: Number of worker processes, 0 uses all cores, 1 preprocesses on the calling thread
+    :param window: Number of images submitted to the pool ahead of the consumer
+    :return Iterator[PreprocessResult]: One result per path, in order
+    """
+    if processes == 1:
+        for path in paths:
+            yield _preprocess(path, max_dimension, image_format, quality)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes or None) as executor:
+        iterator = iter(paths)
+        pending: collections.deque[concurrent.futures.Future] = collections.deque()
+
+        def fill():
+            for path in itertools.islice(iterator, window - len(pending)):
+                pending.append(executor.submit(_preprocess, path, max_dimension, image_format, quality))
+
+        fill()
+        while pending:
+            yield pending.popleft().result()
+            if len(pending) < window // 2:
+                fill()
@@ -0,0 +1,156 @@
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import typing
+from typing import Optional
+
+from common.logging import log
+from common.paths import get_data_directory
+
+# files in the preview folder without an index entry are left from older versions or interrupted runs,
+# they are deleted once they are older than this
+orphan_max_age = 60 * 60
+# content hashes of files that were not seen for this long are forgotten
+file_hash_max_age = 90 * 24 * 60 * 60
+
+
+class PreviewCache:
+    """
+    Previews sent to OpenAI, indexed by the content hash and name of their file and capped in size,
+    the least recently used previews are deleted first.
+    The index also remembers the content hash of every file by its size and modification time,
+    so files that did not change are not read again.
+    """
+
+    def __init__(self, directory: str, index_path: str, max_size_mb: int):
+        self.directory = directory
+        self.max_size = max_size_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(index_path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS previews ("
+            "file_hash TEXT NOT NULL, name TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL, "
+            "accessed REAL NOT NULL, PRIMARY KEY (file_hash, name))")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS previews_accessed ON previews (accessed)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime INTEGER NOT NULL, file_hash TEXT NOT NULL, "
+            "checked REAL NOT NULL)")
+        self._connection.commit()
+
+    def preview_path(self, file_hash: str, name: str) -> str:
+        # the name is kept, OpenAI sees it next to the image
+        return os.path.join(self.directory, f"{name}_{file_hash[:16]}_pt.png")
+
+    def get(self, file_hash: str, name: str) -> Optional[str]:
+        """
+        :return Optional[str]: Path of the preview, None if there is none or it was changed or removed on disk
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT path, size FROM previews WHERE file_hash = ? AND name = ?", (file_hash, name)).fetchone()
+            if row is None:
+                return None
+            path, size = row
+            try:
+                valid = os.path.getsize(path) == size
+            except OSError:
+                valid = False
+            if valid:
+                self._connection.execute(
+                    "UPDATE previews SET accessed = ? WHERE file_hash = ? AND name = ?", (time.time(), file_hash, name))
+            else:
+                self._connection.execute("DELETE FROM previews WHERE file_hash = ? AND name = ?", (file_hash, name))
+            self._connection.commit()
+        return path if valid else None
+
+    def put(self, file_hash: str, name: str, path: str):
+        size = os.path.getsize(path)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO previews (file_hash, name, path, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                (file_hash, name, path, size, time.time()))
+            self._connection.commit()
+
+    def get_file_hash(self, path: str, calculate: typing.Callable[[str], str]) -> str:
+        """
+        Content hash of a file, only calculated if the file changed since it was last hashed
+        :param path: File to hash
+        :param calculate: Reads the file and returns its hash
+        """
+        stat = os.stat(path)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT file_hash FROM file_hashes WHERE path = ? AND size = ? AND mtime = ?",
+                (path, stat.st_size, stat.st_mtime_ns)).fetchone()
+            if row is not None:
+                self._connection.execute("UPDATE file_hashes SET checked = ? WHERE path = ?", (time.time(), path))
+                self._connection.commit()
+                return row[0]
+
+        file_hash = calculate(path)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO file_hashes (path, size, mtime, file_hash, checked) VALUES (?, ?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, file_hash, time.time()))
+            self._connection.commit()
+        return file_hash
+
+    def evict(self):
+        now = time.time()
+        with self._lock:
+            self._connection.execute("DELETE FROM file_hashes WHERE checked < ?", (now - file_hash_max_age,))
+
+            # drop least recently used previews until the cache fits into its size cap
+            total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM previews").fetchone()[0]
+            evicted = []
+            if total_size > self.max_size:
+                rows = self._connection.execute(
+                    "SELECT file_hash, name, path, size FROM previews ORDER BY accessed").fetchall()
+                for file_hash, name, path, size in rows:
+                    if total_size <= self.max_size:
+                        break
+                    evicted.append((file_hash, name, path))
+                    total_size -= size
+                self._connection.executemany(
+                    "DELETE FROM previews WHERE file_hash = ? AND name = ?",
+                    [(file_hash, name) for file_hash, name, _ in evicted])
+            self._connection.commit()
+            indexed = {os.path.normcase(path) for path, in self._connection.execute("SELECT path FROM previews")}
+
+        for _, _, path in evicted:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        orphan_count = 0
+        for item in os.scandir(self.directory):
+            if os.path.normcase(item.path) in indexed:
+                continue
+            try:
+                if now - item.stat().st_mtime < orphan_max_age:
+                    continue
+                if item.is_dir():
+                    shutil.rmtree(item.path)
+                else:
+                    os.remove(item.path)
+                orphan_count += 1
+            except OSError:
+                pass
+
+        if evicted or orphan_count:
+            log(f"Preview cache: removed {len(evicted)} least recently used and {orphan_count} unknown previews")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def open_preview_cache(max_size_mb: int) -> PreviewCache:
+    cache = PreviewCache(
+        get_data_directory("previews"), os.path.join(get_data_directory(), "previews.db"), max_size_mb)
+    cache.evict()
+    return cache
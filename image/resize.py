@@ -1,25 +1,113 @@
+import io
+from typing import NamedTuple
+
 from PIL import Image
 
+from common.metrics import span
+
+image_mime_types = {
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "PNG": "image/png",
+}
+
+
+class PreprocessedImage(NamedTuple):
+    data: bytes
+    width: int
+    height: int
+    mime_type: str
 
-def resize_image(image_path: str, max_dimension: int) -> list[int]:
+
+def fit_dimensions(width: int, height: int, max_dimension: int) -> list[int]:
     """
-    Resize an image to the specified maximum dimension, preserving aspect ratio.
-    :param image_path: Path to the image file
-    :param max_dimension: Maximum dimension for the resized image
-    :return list[int]: Width and height of the resized image
+    Size of an image scaled down to the maximum dimension, preserving aspect ratio
     """
-    image = Image.open(image_path)
+    if width <= max_dimension and height <= max_dimension:
+        return [width, height]
+    scale = max_dimension / max(width, height)
+    return [max(1, round(width * scale)), max(1, round(height * scale))]
 
+
+def _trim_and_resize(image: Image.Image, max_dimension: int) -> Image.Image:
     # trim transparent pixels
     box = image.getbbox()
-    image = image.crop(box)
-    image.save(image_path)
+    if box:
+        image = image.crop(box)
 
     width, height = image.size
     if width > max_dimension or height > max_dimension:
-        # resize image
         image.thumbnail((max_dimension, max_dimension))
-        image.save(image_path)
+    return image
+
+
+def estimate_dimensions(image_path: str, max_dimension: int, sample_dimension: int = 64) -> list[int]:
+    """
+    Estimate the size an image will have after trimming and resizing.
+    Opaque images are only read up to their header. For images with transparency the trimmed box is
+    approximated on an alpha channel reduced to about `sample_dimension`, so the estimate may be
+    slightly larger than the real size, never smaller.
+    :param image_path: Path to the image file
+    :param max_dimension: Maximum dimension for the resized image
+    :param sample_dimension: Size of the reduced alpha channel used for the trimming approximation
+    :return list[int]: Estimated width and height of the resized image
+    """
+    with Image.open(image_path) as image:
         width, height = image.size
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        if not has_alpha:
+            return fit_dimensions(width, height, max_dimension)
+
+        alpha = image.convert("RGBA").getchannel("A") if image.mode not in ("RGBA", "LA") else image.getchannel("A")
+        factor = 1
+        remaining = max(1, max(width, height) // sample_dimension)
+        while remaining > 1:
+            # binarized before every step, a single visible pixel keeps its averaged block non-zero
+            step = min(remaining, 16)
+            alpha = alpha.point(lambda a: 255 if a else 0).reduce(step)
+            factor *= step
+            remaining //= step
+        box = alpha.getbbox()
+        if not box:
+            return fit_dimensions(width, height, max_dimension)
+
+        left, top, right, bottom = box
+        trimmed_width = min(width, (right - left) * factor)
+        trimmed_height = min(height, (bottom - top) * factor)
+        return fit_dimensions(trimmed_width, trimmed_height, max_dimension)
+
 
-    return [width, height]
+def preprocess_image(
+        image_path: str, max_dimension: int, image_format: str = "JPEG", quality: int = 85) -> PreprocessedImage:
+    """
+    Trim transparent pixels, resize and encode an image in memory
+    :param image_path: Path to the image file
+    :param max_dimension: Maximum dimension for the resized image
+    :param image_format: Output format, one of JPEG, WEBP or PNG
+    :param quality: Output quality for lossy formats
+    :return PreprocessedImage: Encoded image bytes, their size and MIME type
+    """
+    image_format = image_format.upper()
+    if image_format not in image_mime_types:
+        raise ValueError(f"Unsupported image format {image_format}, use one of {', '.join(image_mime_types)}")
+
+    with Image.open(image_path) as image:
+        with span("resize"):
+            image = _trim_and_resize(image, max_dimension)
+
+            if image_format == "JPEG" and image.mode != "RGB":
+                # JPEG has no alpha channel, put transparent pixels on white instead of black
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+
+        with span("encode"):
+            buffer = io.BytesIO()
+            if image_format == "PNG":
+                image.save(buffer, image_format, optimize=True)
+            else:
+                image.save(buffer, image_format, quality=quality)
+
+        width, height = image.size
+        return PreprocessedImage(buffer.getvalue(), width, height, image_mime_types[image_format])
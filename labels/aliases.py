@@ -0,0 +1,114 @@
+import json
+import os
+import re
+import threading
+from typing import Iterable, Optional
+
+from common.logging import log, log_err
+from labels.variants import all_variants
+
+_folded_characters = re.compile(r"[\s\-_]+")
+
+
+def normalize_key(tag: str) -> str:
+    """
+    Lookup key of a tag, folding case, whitespace and hyphens: "Low-Poly", "low poly" and "LowPoly" are equal
+    """
+    return _folded_characters.sub("", tag).casefold()
+
+
+class AliasIndex:
+    """
+    Maps every known spelling of a tag to its canonical name in O(1).
+    Tags without an alias keep the first spelling seen during the run, so "sword" and "Sword" end up as one tag.
+    """
+
+    def __init__(self, variants: dict[str, list[list[str]]]):
+        self._aliases: dict[str, dict[str, str]] = {}
+        for category, groups in variants.items():
+            self.add_aliases(category, groups)
+
+    def add_aliases(self, category: str, groups: Iterable[list[str]]):
+        aliases = self._aliases.setdefault(category, {})
+        for group in groups:
+            if not group:
+                continue
+            canonical = group[0].strip()
+            for alias in group:
+                aliases[normalize_key(alias)] = canonical
+
+    def add_known_tags(self, category: str, tag_names: Iterable[str]):
+        # existing attribute tags win over new spellings, but not over configured aliases
+        aliases = self._aliases.setdefault(category, {})
+        for tag_name in tag_names:
+            aliases.setdefault(normalize_key(tag_name), tag_name)
+
+    def normalize(self, category: str, tag: str) -> str:
+        tag = tag.strip()
+        key = normalize_key(tag)
+        if not key:
+            return ""
+        return self._aliases.setdefault(category, {}).setdefault(key, tag)
+
+    def normalize_tags(self, category: str, tags: Iterable[str]) -> list[str]:
+        """
+        Replace aliases by their canonical name and drop duplicates and empty tags, keeping the order
+        """
+        normalized = []
+        seen = set()
+        for tag in tags:
+            canonical = self.normalize(category, tag)
+            if canonical and canonical not in seen:
+                seen.add(canonical)
+                normalized.append(canonical)
+        return normalized
+
+
+def load_alias_file(path: str) -> dict[str, list[list[str]]]:
+    """
+    Load user aliases from a JSON file mapping attribute names to lists of alias groups,
+    the first name of a group is the canonical one, e.g. {"AI-Types": [["Texture", "Tex", "Map"]]}
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("The alias file must contain an object of attribute names")
+    return {str(category): [list(map(str, group)) for group in groups] for category, groups in data.items()}
+
+
+_alias_index: Optional[AliasIndex] = None
+# alias file and its modification time the index was built from
+_alias_index_key: Optional[tuple[str, Optional[int]]] = None
+_alias_index_lock = threading.Lock()
+
+
+def get_alias_file_mtime(alias_file: str) -> Optional[int]:
+    if not alias_file:
+        return None
+    try:
+        return os.stat(alias_file).st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_alias_index(alias_file: str = "") -> AliasIndex:
+    """
+    Alias index shared by the runs of this process, built again once the alias file is changed in the settings
+    or on disk
+    """
+    global _alias_index, _alias_index_key
+    key = (alias_file, get_alias_file_mtime(alias_file))
+    with _alias_index_lock:
+        if _alias_index is None or _alias_index_key != key:
+            _alias_index = AliasIndex(all_variants)
+            _alias_index_key = key
+            if alias_file and os.path.exists(alias_file):
+                try:
+                    for category, groups in load_alias_file(alias_file).items():
+                        _alias_index.add_aliases(category, groups)
+                    log(f"Loaded aliases from {alias_file}")
+                except (OSError, ValueError) as e:
+                    log_err(f"Failed to load aliases from {alias_file}: {e}")
+            elif alias_file:
+                log_err(f"Alias file not found: {alias_file}")
+        return _alias_index
@@ -1,5 +1,11 @@
+import random
+
 import apsync as aps
 
+from common.metrics import span
+from labels.aliases import AliasIndex
+from labels.sinks import TagSink
+
 attribute_colors = [
         "grey", "blue", "purple", "green",
         "turk", "orange", "yellow", "red"]
@@ -12,11 +18,85 @@ def ensure_attribute(database: aps.Api, attribute_name: str) -> aps.Attribute:
         )
     return attribute
 
-def replace_tag(tag: str, variants: list[list[str]]) -> str:
-    if not variants:
+
+class AttributeWriter:
+    """
+    Collects tag values for many files and writes them in bulk.
+    Keeps a name -> tag index per attribute for the whole run, new tags are added to the attribute
+    with a single set_attribute_tags call per flush.
+    apsync has no bulk setter for values, they are written with one set_attribute_value call per file
+    and attribute, a value that is set again before the flush is written once.
+    """
+
+    def __init__(self, database: aps.Api, attributes: list[aps.Attribute]):
+        self.database = database
+        self._attributes: dict[str, aps.Attribute] = {}
+        self._tags: dict[str, aps.AttributeTagList] = {}
+        self._index: dict[str, dict[str, aps.AttributeTag]] = {}
+        self._changed_attributes: set[str] = set()
+        self._values: dict[tuple[str, str], list[aps.AttributeTag]] = {}
+        for attribute in attributes:
+            if attribute:
+                self.add_attribute(attribute)
+
+    def add_attribute(self, attribute: aps.Attribute):
+        # set_attribute_tags expects the apsync list, new tags are appended to the one of the attribute
+        tags = attribute.tags
+        self._attributes[attribute.name] = attribute
+        self._tags[attribute.name] = tags
+        self._index[attribute.name] = {tag.name: tag for tag in tags}
+
+    def tag_names(self, attribute_name: str) -> list[str]:
+        return list(self._index.get(attribute_name, {}))
+
+    def get_tag(self, attribute_name: str, tag_name: str) -> aps.AttributeTag:
+        index = self._index[attribute_name]
+        tag = index.get(tag_name)
+        if tag is None:
+            tag = aps.AttributeTag(tag_name, random.choice(attribute_colors))
+            index[tag_name] = tag
+            self._tags[attribute_name].append(tag)
+            self._changed_attributes.add(attribute_name)
         return tag
-    for variant in variants:
-        if tag in variant:
-            return variant[0]
 
-    return tag
\ No newline at end of file
+    def set_value(self, target: str, attribute_name: str, tag_names: list[str]):
+        tags = [self.get_tag(attribute_name, tag_name) for tag_name in tag_names]
+        # the latest value of a file and attribute wins
+        self._values[(target, attribute_name)] = tags
+
+    def flush(self):
+        with span("attribute_write"):
+            self._flush()
+
+    def _flush(self):
+        for attribute_name in self._changed_attributes:
+            self.database.attributes.set_attribute_tags(
+                self._attributes[attribute_name], self._tags[attribute_name])
+        self._changed_attributes.clear()
+
+        for (target, attribute_name), tags in self._values.items():
+            tag_list = aps.AttributeTagList()
+            for tag in tags:
+                tag_list.append(tag)
+            self.database.attributes.set_attribute_value(target, self._attributes[attribute_name], tag_list)
+        self._values.clear()
+
+
+class AttributeTagSink(TagSink):
+    """
+    Writes tags to the attributes of the workspace database, in bulk with an AttributeWriter.
+    Tags that already exist on the attributes are known to the alias index, so new spellings map onto them.
+    """
+
+    def __init__(self, database: aps.Api, attributes: list[aps.Attribute], alias_index: AliasIndex):
+        super().__init__(alias_index)
+        self.writer = AttributeWriter(database, attributes)
+        for attribute in attributes:
+            if attribute:
+                alias_index.add_known_tags(attribute.name, self.writer.tag_names(attribute.name))
+
+    def set_tags(self, target: str, attribute_name: str, tag_names: list[str]):
+        self.writer.set_value(target, attribute_name, self.normalize(attribute_name, tag_names))
+
+    def flush(self):
+        self.writer.flush()
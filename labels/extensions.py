@@ -1,3 +1,5 @@
+from common.logging import log
+
 unity_extensions = [
     "meta", "unity", "prefab", "asset", "mat", "controller", "anim", "mask",
     "overrideController", "physicMaterial", "physicsMaterial2D", "renderTexture", "shader",
@@ -19,4 +21,25 @@ audio_extensions = [
 
 text_extensions = [
     "txt", "md", "markdown", "rtf", "doc", "docx", "pdf", "odt"
-]
\ No newline at end of file
+]
+
+
+ignored_extensions = [
+    unity_extensions, unreal_extensions, godot_extensions,
+    temp_extensions, audio_extensions,
+    text_extensions
+]
+
+
+def filter_ignored_extensions(files: list[str], ignored_ext: list[list[str]]) -> list[str]:
+    filtered_files = []
+    for file in files:
+        file_ext = file.split(".")[-1]
+        for ignored_extension in ignored_ext:
+            if file_ext in ignored_extension:
+                log(f"Ignoring file because of extension: {file}")
+                break
+        else:
+            filtered_files.append(file)
+
+    return filtered_files
@@ -0,0 +1,74 @@
+import json
+import sys
+from typing import Any, Optional
+
+from common.metrics import span
+from labels.aliases import AliasIndex
+
+
+class TagSink:
+    """
+    Destination of the tags of a run, e.g. the attributes of the workspace or an output file.
+    Tag names are normalized with the alias index before they are stored.
+    """
+
+    def __init__(self, alias_index: Optional[AliasIndex] = None):
+        self.alias_index = alias_index
+
+    def normalize(self, attribute_name: str, tag_names: list[str]) -> list[str]:
+        if self.alias_index is None:
+            return list(tag_names)
+        return self.alias_index.normalize_tags(attribute_name, tag_names)
+
+    def set_tags(self, target: str, attribute_name: str, tag_names: list[str]):
+        raise NotImplementedError
+
+    def set_category_tags(
+            self, target: str, tags: dict[str, Any], categories: dict[str, str], skip_empty: bool = False):
+        """
+        Store the tags of a response, every category goes to its attribute
+        :param target: Tagged file or folder
+        :param tags: Tag names per category
+        :param categories: Attribute name per category
+        :param skip_empty: Keep the value of attributes whose category has no tags, instead of clearing it
+        """
+        for category, attribute_name in categories.items():
+            tag_names = tags.get(category) or []
+            if tag_names or not skip_empty:
+                self.set_tags(target, attribute_name, tag_names)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class JsonLinesTagSink(TagSink):
+    """
+    Writes one JSON object per tagged file or folder: {"path": ..., "AI-Types": [...], ...}
+    """
+
+    def __init__(self, path: str, alias_index: Optional[AliasIndex] = None):
+        """
+        :param path: Output file, - writes to stdout
+        :param alias_index: Normalizes the tag names
+        """
+        super().__init__(alias_index)
+        self.output = sys.stdout if path == "-" else open(path, "w", encoding="utf-8")
+        self._values: dict[str, dict[str, list[str]]] = {}
+
+    def set_tags(self, target: str, attribute_name: str, tag_names: list[str]):
+        self._values.setdefault(target, {})[attribute_name] = self.normalize(attribute_name, tag_names)
+
+    def flush(self):
+        with span("attribute_write"):
+            for target, values in self._values.items():
+                self.output.write(json.dumps({"path": target, **values}) + "\n")
+            self._values.clear()
+            self.output.flush()
+
+    def close(self):
+        self.flush()
+        if self.output is not sys.stdout:
+            self.output.close()
@@ -29,3 +29,10 @@ genres_variants: list[list[str]] = [
 ]
 
 objects_variants: list[list[str]] = []
+
+all_variants: dict[str, list[list[str]]] = {
+    "AI-Engines": engines_variants,
+    "AI-Types": types_variants,
+    "AI-Genres": genres_variants,
+    "AI-Objects": objects_variants,
+}
@@ -1,8 +1,10 @@
 # This example demonstrates how to create a simple dialog in Anchorpoint
 import anchorpoint as ap
 import os
+import time
 
-from common.settings import tagger_settings
+from ai.ledger import get_usage_ledger
+from common.settings import tagger_settings, skip_existing_modes
 
 
 def apply_callback(dialog: ap.Dialog):
@@ -20,12 +22,46 @@ def apply_callback(dialog: ap.Dialog):
 
     tagger_settings.file_label_ai_objects_min = int(str(dialog.get_value("file_label_ai_objects_min")))
     tagger_settings.file_label_ai_objects_max = int(str(dialog.get_value("file_label_ai_objects_max")))
+    tagger_settings.file_skip_existing = bool(dialog.get_value("file_skip_existing"))
+    skip_existing_mode = str(dialog.get_value("file_skip_existing_mode"))
+    for mode, label in skip_existing_modes.items():
+        if label == skip_existing_mode:
+            tagger_settings.file_skip_existing_mode = mode
+
+    tagger_settings.file_max_concurrent_requests = max(1, int(str(dialog.get_value("file_max_concurrent_requests"))))
+    tagger_settings.file_streaming_mode = bool(dialog.get_value("file_streaming_mode"))
+    tagger_settings.file_batch_mode = bool(dialog.get_value("file_batch_mode"))
+    tagger_settings.preview_parallelism = max(1, int(str(dialog.get_value("preview_parallelism"))))
+    tagger_settings.file_dedup_enabled = bool(dialog.get_value("file_dedup_enabled"))
+    tagger_settings.file_dedup_threshold = min(32, max(0, int(str(dialog.get_value("file_dedup_threshold")))))
+    tagger_settings.image_format = str(dialog.get_value("image_format"))
+    tagger_settings.image_quality = min(100, max(1, int(str(dialog.get_value("image_quality")))))
 
     tagger_settings.folder_use_ai_engines = bool(dialog.get_value("folder_use_ai_engines"))
     tagger_settings.folder_use_ai_types = bool(dialog.get_value("folder_use_ai_types"))
     tagger_settings.folder_use_ai_genres = bool(dialog.get_value("folder_use_ai_genres"))
+    tagger_settings.folder_token_budget = max(100, int(str(dialog.get_value("folder_token_budget"))))
+    tagger_settings.folder_summary_depth = max(0, int(str(dialog.get_value("folder_summary_depth"))))
+    tagger_settings.folder_max_concurrent_requests = max(
+        1, int(str(dialog.get_value("folder_max_concurrent_requests"))))
+    tagger_settings.folder_skip_unchanged = bool(dialog.get_value("folder_skip_unchanged"))
+
+    tagger_settings.alias_file = str(dialog.get_value("alias_file"))
+
+    tagger_settings.cache_enabled = bool(dialog.get_value("cache_enabled"))
+    tagger_settings.cache_max_age_days = max(1, int(str(dialog.get_value("cache_max_age_days"))))
+    tagger_settings.cache_max_size_mb = max(1, int(str(dialog.get_value("cache_max_size_mb"))))
+    tagger_settings.preview_cache_max_size_mb = max(1, int(str(dialog.get_value("preview_cache_max_size_mb"))))
+
+    tagger_settings.request_timeout = max(1, int(str(dialog.get_value("request_timeout"))))
+    tagger_settings.request_gzip = bool(dialog.get_value("request_gzip"))
+    tagger_settings.request_max_retries = max(0, int(str(dialog.get_value("request_max_retries"))))
+
+    tagger_settings.budget_limit = max(0.0, float(str(dialog.get_value("budget_limit")) or 0))
+    tagger_settings.budget_period_days = max(1, int(str(dialog.get_value("budget_period_days"))))
 
     tagger_settings.debug_log = bool(dialog.get_value("debug_log"))
+    tagger_settings.metrics_prometheus_file = str(dialog.get_value("metrics_prometheus_file"))
 
     tagger_settings.store()
     ap.UI().show_success("Settings Updated", "The API key has been stored in your system environment")
@@ -64,6 +100,40 @@ def main():
         .add_input(str(tagger_settings.file_label_ai_objects_max), var="file_label_ai_objects_max", width=50)
     )
     dialog.add_info("What's in the picture. For example, an axe, a car, a character")
+    (
+        dialog.add_checkbox(tagger_settings.file_skip_existing, var="file_skip_existing", text="Skip Tagged Files\t")
+        .add_text("when")
+        .add_dropdown(
+            skip_existing_modes.get(tagger_settings.file_skip_existing_mode, skip_existing_modes["types"]),
+            list(skip_existing_modes.values()), var="file_skip_existing_mode")
+    )
+    dialog.add_info("Already tagged files are left out before any preview is generated")
+    (
+        dialog.add_text("Concurrent requests:")
+        .add_input(str(tagger_settings.file_max_concurrent_requests), var="file_max_concurrent_requests", width=50)
+        .add_text("Preview workers:")
+        .add_input(str(tagger_settings.preview_parallelism), var="preview_parallelism", width=50)
+    )
+    dialog.add_info("How many batches of images are sent to OpenAI and how many previews<br>are generated at the same time")
+    dialog.add_checkbox(tagger_settings.file_streaming_mode, var="file_streaming_mode", text="Streaming Mode")
+    dialog.add_info("Send previews while the next ones are still generated. The cost estimate<br>is shown upfront and assumes full-size previews")
+    dialog.add_checkbox(tagger_settings.file_batch_mode, var="file_batch_mode", text="Batch Mode")
+    dialog.add_info("Submit all images as one OpenAI batch at half the price. Results arrive within<br>"
+                    "24 hours, run the action on the same selection again to apply them")
+    (
+        dialog.add_checkbox(tagger_settings.file_dedup_enabled, var="file_dedup_enabled", text="Group Near-Duplicates")
+        .add_text("Max. difference:")
+        .add_input(str(tagger_settings.file_dedup_threshold), var="file_dedup_threshold", width=50)
+    )
+    dialog.add_info("Upload one image of similar previews (recolors, LODs, exports) and copy its tags<br>"
+                    "to the others. The difference is counted in bits of 64, 0 groups identical previews only")
+    (
+        dialog.add_text("Upload format:")
+        .add_dropdown(tagger_settings.image_format, ["JPEG", "WEBP", "PNG"], var="image_format")
+        .add_text("Quality:")
+        .add_input(str(tagger_settings.image_quality), var="image_quality", width=50)
+    )
+    dialog.add_info("Previews are converted in memory before upload, JPEG and WEBP are the smallest")
     dialog.add_separator()
     dialog.end_section()
 
@@ -75,13 +145,88 @@ def main():
     dialog.add_info("e.g. model, texture, sfx")
     dialog.add_checkbox(tagger_settings.folder_use_ai_genres, var="folder_use_ai_genres", text="Label Genres")
     dialog.add_info("e.g. casual, cyberpunk, steampunk")
+    (
+        dialog.add_text("Token budget:")
+        .add_input(str(tagger_settings.folder_token_budget), var="folder_token_budget", width=70)
+        .add_text("Depth:")
+        .add_input(str(tagger_settings.folder_summary_depth), var="folder_summary_depth", width=50)
+    )
+    dialog.add_info("The folder content is sent as a summary of file types and sample names,<br>"
+                    "limited to this many tokens and subfolder levels")
+    (
+        dialog.add_text("Concurrent requests:")
+        .add_input(
+            str(tagger_settings.folder_max_concurrent_requests), var="folder_max_concurrent_requests", width=50)
+    )
+    dialog.add_info("How many folders are sent to OpenAI at the same time")
+    dialog.add_checkbox(tagger_settings.folder_skip_unchanged, var="folder_skip_unchanged", text="Skip Unchanged Folders")
+    dialog.add_info("Folders are only tagged again when a file inside was added, removed or modified<br>"
+                    "or the settings changed")
+    dialog.add_separator()
+    dialog.end_section()
+
+    dialog.start_section("Tag Aliases", folded=not tagger_settings.alias_file)
+    dialog.add_input(
+        tagger_settings.alias_file, var="alias_file", width=400, browse=ap.BrowseType.File,
+        placeholder="Optional JSON file with additional aliases")
+    dialog.add_info(
+        "Tags are matched ignoring case, spaces and hyphens. Add your own aliases as<br>"
+        "{\"AI-Types\": [[\"Texture\", \"Tex\", \"Map\"]]}, the first name of a group is used")
+    dialog.add_separator()
+    dialog.end_section()
+
+    dialog.start_section("Cache Settings", folded=True)
+    dialog.add_checkbox(tagger_settings.cache_enabled, var="cache_enabled", text="Reuse Previous Results")
+    dialog.add_info("Files that were already tagged with the same settings are not uploaded again")
+    (
+        dialog.add_text("Keep for (days):")
+        .add_input(str(tagger_settings.cache_max_age_days), var="cache_max_age_days", width=50)
+        .add_text("Max size (MB):")
+        .add_input(str(tagger_settings.cache_max_size_mb), var="cache_max_size_mb", width=50)
+    )
+    (
+        dialog.add_text("Previews max size (MB):")
+        .add_input(str(tagger_settings.preview_cache_max_size_mb), var="preview_cache_max_size_mb", width=50)
+    )
+    dialog.add_info("Previews are kept for the next run, the least recently used ones are deleted first")
+    dialog.add_separator()
+    dialog.end_section()
+
+    dialog.start_section("Connection Settings", folded=True)
+    (
+        dialog.add_text("Request timeout (seconds):")
+        .add_input(str(tagger_settings.request_timeout), var="request_timeout", width=50)
+        .add_text("Retries:")
+        .add_input(str(tagger_settings.request_max_retries), var="request_max_retries", width=50)
+    )
+    dialog.add_info("Failed and rate limited requests are retried with an increasing delay")
+    dialog.add_checkbox(tagger_settings.request_gzip, var="request_gzip", text="Compress Requests")
+    dialog.add_info("Send request bodies gzip-compressed to reduce upload size")
+    dialog.add_separator()
+    dialog.end_section()
+
+    dialog.start_section("Budget", folded=not tagger_settings.budget_limit)
+    (
+        dialog.add_text("Limit ($):")
+        .add_input(f"{tagger_settings.budget_limit:g}", var="budget_limit", width=50)
+        .add_text("Period (days):")
+        .add_input(str(tagger_settings.budget_period_days), var="budget_period_days", width=50)
+    )
+    spent = get_usage_ledger().spent_since(time.time() - tagger_settings.budget_period_days * 24 * 60 * 60)
+    dialog.add_info(f"Requests stop once they would exceed the limit, 0 for no limit.<br>"
+                    f"Spent in the last {tagger_settings.budget_period_days} days: ${spent:.4f}")
     dialog.add_separator()
     dialog.end_section()
 
-    debug_folded = not tagger_settings.debug_log
+    debug_folded = not tagger_settings.debug_log and not tagger_settings.metrics_prometheus_file
     dialog.start_section("Debugging", folded=debug_folded)
     dialog.add_checkbox(tagger_settings.debug_log, var="debug_log", text="Enable Extended Logging")
     dialog.add_info("Log additional information to the console (open with CTRL+SHIFT+P)")
+    dialog.add_input(
+        tagger_settings.metrics_prometheus_file, var="metrics_prometheus_file", width=400,
+        browse=ap.BrowseType.File, placeholder="Optional Prometheus metrics file (*.prom)")
+    dialog.add_info("Timings, uploaded bytes and tokens of every run are written as JSON to the temp folder,<br>"
+                    "and in Prometheus text format to this file, e.g. for the node exporter's textfile collector")
     dialog.add_separator()
     dialog.end_section()
 
@@ -1,385 +1,877 @@
-import base64
-import json
+import functools
+import math
+import queue
+import threading
 import shutil
+import tempfile
+import typing
 from datetime import datetime
-from typing import Any, Union, Optional
+from typing import Any, Iterator, Union, Optional
 
 import anchorpoint as ap
 import apsync as aps
 import os
-import tempfile
-import random
 import hashlib
 
-import requests
-
-from ai.api import init_openai_key, OPENAI_API_URL
+from ai.api import init_openai_key
+from ai.batching import AdaptiveBatchSizer, images_per_request, iter_adaptive_batches, max_images_per_request, \
+    request_output_token_budget, request_with_bisection, target_request_latency
+from ai.cache import ResponseCache, fingerprint, open_response_cache
+from ai.dispatch import dispatch_batches
+from ai.ledger import BudgetExceeded, RunBudget, estimate_cost, get_usage_ledger
+from ai.prompts import build_file_prompt, build_file_response_format, build_uploads_payload, get_file_categories, \
+    output_token_count
 from ap_tools.dialogs import CreateTagFilesDialogData, create_tag_files_dialog
 from common.logging import log, log_err
-from image.resize import resize_image
-from labels.attributes import ensure_attribute, replace_tag, attribute_colors
-from labels.extensions import unity_extensions, unreal_extensions, audio_extensions, temp_extensions, godot_extensions, \
-    text_extensions
-from labels.variants import engines_variants, types_variants, genres_variants, objects_variants
-from ai.constants import input_pixel_price, input_token_price, output_token_price
-from ai.tokens import count_tokens
+from common.metrics import format_summary, run_metrics, span, write_run_metrics
+from common.manifest import JobManifest, ManifestEntry, Stage, get_job_id, open_job_manifest
+from common.paths import get_data_directory
+from image.previews import PreviewCache, open_preview_cache
+from labels.aliases import get_alias_index
+from labels.attributes import AttributeTagSink, ensure_attribute
+from labels.sinks import TagSink
+from labels.extensions import filter_ignored_extensions, ignored_extensions
+from ai.constants import input_pixel_price, input_token_price, output_token_price, openai_model, batch_price_factor, \
+    preview_max_dimension
 from common.settings import tagger_settings
 
-prompt = (
-    "You are a file tagging AI. When asked, write tags for each file in the order they were presented: "
-)
+# requests, PIL, numpy and the tokenizer are imported by the functions using them,
+# the action shows its first progress before paying for them
 
-if tagger_settings.file_label_ai_types:
-    prompt += "content types (Texture, Sprite, Model, VFX, SFX, etc.),"
+if typing.TYPE_CHECKING:
+    from ai.batch import BatchRequest
 
-if tagger_settings.file_label_ai_genres:
-    prompt += "detailed genres,"
 
-if tagger_settings.file_label_ai_objects:
-    prompt += f"objects and other keywords in the image (min {tagger_settings.file_label_ai_objects_min}, max {tagger_settings.file_label_ai_objects_max}), "
+@functools.lru_cache(maxsize=None)
+def get_prompt() -> str:
+    return build_file_prompt(tagger_settings)
 
-prompt += "fill all tags for each image."
 
-output_token_count = 200
+@functools.lru_cache(maxsize=None)
+def get_response_format() -> dict[str, Any]:
+    return build_file_response_format(tagger_settings)
 
-images_per_request = 10
-proceed_dialog: ap.Dialog
 
-all_variants = {
-    "AI-Engines": engines_variants,
-    "AI-Types": types_variants,
-    "AI-Genres": genres_variants,
-    "AI-Objects": objects_variants
-}
-
-items = {
-    "type": "object",
-    "additionalProperties": False,
-    "required": [],
-    "properties": {}
-}
-
-if tagger_settings.file_label_ai_types:
-    items["required"].append("types")
-    items["properties"]["types"] = {
-        "type": "array",
-        "items": {
-            "type": "string",
-            "additionalProperties": False,
-        }
-    }
-
-if tagger_settings.file_label_ai_genres:
-    items["required"].append("genres")
-    items["properties"]["genres"] = {
-        "type": "array",
-        "items": {
-            "type": "string",
-            "additionalProperties": False,
-        }
-    }
-
-if tagger_settings.file_label_ai_objects:
-    items["required"].append("objects")
-    items["properties"]["objects"] = {
-        "type": "array",
-        "items": {
-            "type": "string",
-            "additionalProperties": False,
-        }
-    }
-
-response_format = {"type": "json_schema", "json_schema":
-    {
-        "name": "TaggingSchema",
-        "strict": True,
-        "schema": {
-            "type": "object",
-            "additionalProperties": False,
-            "required": ["tags"],
-            "properties": {
-                "tags": {
-                    "type": "array",
-                    "items": items
-                }
-            },
-            "name": "TaggingSchema"
-        }
-    }}
+# seconds between two status polls of a submitted batch
+batch_poll_interval = 30
+proceed_dialog: ap.Dialog
+# files of this run skipped because they already carry tags, shown in the estimate
+already_tagged_count = 0
 
 
 def calculate_file_hash(file_path, hash_algorithm="sha256", length: int = 8):
     hash_func = hashlib.new(hash_algorithm)
 
-    with open(file_path, "rb") as f:
+    with span("hashing"), open(file_path, "rb") as f:
         while chunk := f.read(8192):
             hash_func.update(chunk)
 
     return hash_func.hexdigest()[:length]
 
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+preview_cache: Optional[PreviewCache] = None
 
 
-def create_temp_directory():
-    # Create a temporary directory
-    temp_dir_root = os.path.join(tempfile.gettempdir(), "anchorpoint", "ai_tagger", "previews")
-    if not os.path.exists(temp_dir_root):
-        os.makedirs(temp_dir_root)
+def get_preview_cache() -> PreviewCache:
+    global preview_cache
+    if preview_cache is None:
+        preview_cache = open_preview_cache(tagger_settings.preview_cache_max_size_mb)
+    return preview_cache
 
-    return temp_dir_root
 
+def open_preview_directory() -> str:
+    # opened on the calling thread, the previews are generated on worker threads
+    return get_preview_cache().directory
 
-def get_preview_image(workspace_id, input_path, output_folder):
-    file_hash = calculate_file_hash(input_path)
 
+def get_file_hash(file_path) -> str:
+    # files that did not change since the last run are not read again
+    return get_preview_cache().get_file_hash(file_path, lambda path: calculate_file_hash(path, length=64))
+
+
+def get_preview_image(workspace_id, input_path, output_folder, file_hash: str = ""):
+    file_hash = file_hash or get_file_hash(input_path)
+    with span("thumbnailing"):
+        return copy_or_generate_preview(workspace_id, input_path, output_folder, file_hash)
+
+
+def copy_or_generate_preview(workspace_id, input_path, output_folder, file_hash: str) -> str:
     # get the proper filename, rename it because the generated PNG file has a _pt appendix
     file_name = os.path.basename(input_path).split(".")[0]
 
-    image_path = os.path.join(output_folder, f"{file_name}_{file_hash}_pt.png")
+    cache = get_preview_cache()
+    cached_preview = cache.get(file_hash, file_name)
+    if cached_preview:
+        log(f"Load cached preview for {input_path}")
+        return cached_preview
+
+    image_path = cache.preview_path(file_hash, file_name)
 
     existing_preview = aps.get_thumbnail(input_path, False)
     if existing_preview:
         # copy the existing preview to the output folder because we can not modify the existing preview
-        if not os.path.exists(image_path):
-            os.makedirs(output_folder, exist_ok=True)
-
         shutil.copy(existing_preview, image_path)
-
         log(f"Existing preview found: {existing_preview}\nCopying to {image_path}")
-        return image_path
-
-    log(f"Existing preview not found for {input_path}, generating new one")
-
-    if not os.path.exists(image_path):
-        aps.generate_thumbnails(
-            [input_path],
-            output_folder,
-            with_detail=False,
-            with_preview=True,
-            workspace_id=workspace_id,
-        )
-        generated_path = os.path.join(output_folder, f"{file_name}_pt.png")
-        if not os.path.exists(generated_path):
-            # preview was not generated
-            return ""
-        log(f"Generated preview for {input_path}")
-
-        os.rename(generated_path, image_path)
     else:
-        log(f"Load cached preview for {input_path}")
+        log(f"Existing preview not found for {input_path}, generating new one")
+
+        # files with the same name in different folders get the same generated name, each is generated on its own
+        with tempfile.TemporaryDirectory(dir=output_folder) as generate_folder:
+            aps.generate_thumbnails(
+                [input_path],
+                generate_folder,
+                with_detail=False,
+                with_preview=True,
+                workspace_id=workspace_id,
+            )
+            generated_path = os.path.join(generate_folder, f"{file_name}_pt.png")
+            if not os.path.exists(generated_path):
+                # preview was not generated
+                return ""
+            os.replace(generated_path, image_path)
+        log(f"Generated preview for {input_path}")
 
+    cache.put(file_hash, file_name, image_path)
     return image_path
 
 
-OPENAI_API_KEY = init_openai_key()
+def build_images_payload(in_prompt, image_paths: list[str], model=openai_model) -> tuple[dict[str, Any], int]:
+    """
+    :return tuple[dict[str, Any], int]: Chat completion payload tagging the images and its estimated token count
+    """
+    if len(image_paths) == 0 or len(image_paths) > max_images_per_request:
+        raise ValueError(f"The number of images should be between 1 and {max_images_per_request}")
 
+    from image.resize import preprocess_image
 
-def get_openai_response_images(in_prompt, image_paths: list[str], model="gpt-4o-mini") -> list[Any]:
-    if len(image_paths) == 0 or len(image_paths) > images_per_request:
-        raise ValueError(f"The number of images should be between 1 and {images_per_request}")
-
-    uploads_base64 = [encode_image(image_path) for image_path in image_paths]
+    uploads = [
+        preprocess_image(image_path, max_dimension, tagger_settings.image_format, tagger_settings.image_quality)
+        for image_path in image_paths]
     original_file_names = [os.path.basename(image_path) for image_path in image_paths]
+    return build_uploads_payload(in_prompt, original_file_names, uploads, get_response_format(), model)
+
 
-    content = [{
-        "type": "text",
-        "text": "Please tag these images: " + ", ".join(original_file_names)
-    }]
-    for upload in uploads_base64:
-        content.append({
-            "type": "image_url",
-            "image_url": {"url": f"data:image/jpeg;base64,{upload}"}
-        })
-
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
-
-    payload = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": in_prompt},
-            {"role": "user", "content": content}
-        ],
-        "response_format": response_format
-    }
+def estimate_request_cost(in_prompt, image_count: int) -> float:
+    """
+    Upper estimate, every preview is assumed to use the full `max_dimension` square
+    """
+    return estimate_cost(
+        len(in_prompt) // 4, image_count * max_dimension * max_dimension, image_count * output_token_count)
 
+
+def get_openai_response_images(in_prompt, image_paths: list[str], model=openai_model) -> Optional[list[Any]]:
+    """
+    :return Optional[list[Any]]: Tags of every image, None if the request failed or was not sent
+    """
+    from ai.client import get_client
+    from ai.tagging import request_image_tags
+
+    payload, estimated_tokens = build_images_payload(in_prompt, image_paths, model)
     log(f"Body: {payload}")
+    return request_image_tags(
+        get_client(), run_budget, payload, estimated_tokens, estimate_request_cost(in_prompt, len(image_paths)),
+        model, len(image_paths), batch_sizer)
+
+
+manifest: Optional[JobManifest] = None
+response_cache: Optional[ResponseCache] = None
+batch_sizer: Optional[AdaptiveBatchSizer] = None
+run_budget: Optional[RunBudget] = None
+# cost shown in the dialog, compared with the actual cost at the end of the run
+estimated_price = 0.0
+# the Batch API finishes within 24 hours, the reservation outlives the wait for it
+batch_reservation_timeout = 2 * 24 * 60 * 60
+
+
+def create_run_budget(price_factor: float = 1.0) -> RunBudget:
+    global run_budget
+    run_budget = RunBudget(
+        get_usage_ledger(), "tag_files", estimated_price, tagger_settings.budget_limit,
+        tagger_settings.budget_period_days, price_factor)
+    return run_budget
+
+
+def create_batch_sizer() -> AdaptiveBatchSizer:
+    global batch_sizer
+    batch_sizer = AdaptiveBatchSizer(
+        images_per_request, max_images_per_request, request_output_token_budget, output_token_count,
+        target_request_latency)
+    return batch_sizer
 
-    try:
-        response = requests.post(OPENAI_API_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        result = response.json()
-
-        result_content = result["choices"][0]["message"]["content"].strip()
-        parsed = json.loads(result_content)
-        return parsed.get("tags", [])
-    except requests.exceptions.RequestException as e:
-        log_err(f"Request error: {e}")
-        return []
-    except json.JSONDecodeError:
-        log_err("Failed to parse the response")
-        return []
-
-
-previews_sliced = []
-original_files: dict[str, str] = {}
-
-
-def check_or_update_attribute(attribute: aps.Attribute, tag: str, database: aps.Api):
-    anchorpoint_tags = attribute.tags
-    colors = attribute_colors
-
-    # Create a set of anchorpoint tag names for faster lookup
-    anchorpoint_tag_names = {a_tag.name for a_tag in anchorpoint_tags}
-    if tag not in anchorpoint_tag_names:
-        new_tag = aps.AttributeTag(tag, random.choice(colors))
-        anchorpoint_tags.append(new_tag)
-        database.attributes.set_attribute_tags(attribute, anchorpoint_tags)
-        return new_tag
-
-    for a_tag in anchorpoint_tags:
-        if a_tag.name == tag:
-            return a_tag
-
-    raise ValueError(f"Tag {tag} not found in the attribute tags: {anchorpoint_tag_names}")
-
-
-def change_slices_to_skip(database):
-    new_previews = []
-    prev_count = 0
-
-    global previews_sliced
-    for p in previews_sliced:
-        for preview in p:
-            original_file = original_files[preview]
-            prev_count += 1
-            ai_types_attr: Union[aps.apsync.Attribute, str] = database.attributes.get_attribute_value(
-                original_file,
-                "AI-Types")
-            if ai_types_attr and len(ai_types_attr) > 0:
-                continue
 
-            new_previews.append(preview)
+def get_request_fingerprint() -> str:
+    return fingerprint(get_prompt(), get_response_format(), max_dimension)
 
-    new_previews_sliced = [
-        new_previews[i:i + images_per_request] for i in
-        range(0, len(new_previews), images_per_request)]
-    log(f"Reduced previews from {prev_count} to {len(new_previews)}")
-    previews_sliced = new_previews_sliced
+
+def get_cache_key(file_hash: str) -> str:
+    return ResponseCache.make_key(file_hash, get_request_fingerprint(), openai_model)
+
+
+def load_cached_tags():
+    """
+    Look up previous results for the discovered files, files with a result skip preview generation
+    """
+    global response_cache
+    if not tagger_settings.cache_enabled:
+        return
+
+    if response_cache is None:
+        response_cache = open_response_cache(tagger_settings.cache_max_age_days, tagger_settings.cache_max_size_mb)
+
+    checked_count = 0
+    cached_count = 0
+    for entry in manifest.iter_files(Stage.discovered):
+        checked_count += 1
+        file_hash = entry.file_hash or get_file_hash(entry.path)
+        tags = response_cache.get(get_cache_key(file_hash))
+        if tags is None:
+            manifest.update(entry.path, Stage.discovered, file_hash=file_hash)
+        else:
+            cached_count += 1
+            manifest.update(entry.path, Stage.cached, file_hash=file_hash, tags=tags)
+
+    log(f"Found cached tags for {cached_count} of {checked_count} files")
+
+
+def get_enabled_attribute_names() -> list[str]:
+    return list(get_file_categories(tagger_settings).values())
+
+
+def has_attribute_value(database, original_file: str, attribute_name: str) -> bool:
+    value: Union[aps.apsync.Attribute, str] = database.attributes.get_attribute_value(
+        original_file,
+        attribute_name)
+    return bool(value and len(value) > 0)
+
+
+def is_already_tagged(
+        database, original_file: str, attribute_names: list[str], require_all: bool,
+        decisive_counts: dict[str, int]) -> bool:
+    """
+    Reads the attributes in the given order and stops at the first one that decides the result,
+    a missing value if all are required, a present one otherwise. Counts which attribute decided.
+    """
+    for attribute_name in attribute_names:
+        if has_attribute_value(database, original_file, attribute_name) != require_all:
+            decisive_counts[attribute_name] += 1
+            return not require_all
+    return require_all
+
+
+def skip_already_tagged(database):
+    """
+    Mark files that already carry tags as skipped before any preview is generated or cache entry is hashed.
+    apsync has no bulk read of attribute values, so they are read per file on this thread, it is not known
+    to be safe for concurrent access. To keep the reads down, the attribute that decided most files so far
+    is read first, e.g. the often empty genres when all attributes are required.
+    The manifest is updated once per batch of files.
+    """
+    global already_tagged_count
+    already_tagged_count = 0
+    if not tagger_settings.file_skip_existing:
+        return
+
+    mode = tagger_settings.file_skip_existing_mode
+    attribute_names = get_enabled_attribute_names()
+    if mode == "types" and "AI-Types" in attribute_names:
+        attribute_names = ["AI-Types"]
+    require_all = mode == "all"
+
+    progress = ap.Progress("Checking existing tags", "Processing", infinite=False, show_loading_screen=True)
+    total_count = manifest.count(Stage.discovered, Stage.preview_ready, Stage.cached)
+    checked_count = 0
+    skipped_count = 0
+    decisive_counts = {attribute_name: 0 for attribute_name in attribute_names}
+    for batch in manifest.iter_batches(100, Stage.discovered, Stage.preview_ready, Stage.cached):
+        tagged_paths = [
+            entry.path for entry in batch
+            if is_already_tagged(database, entry.path, attribute_names, require_all, decisive_counts)]
+        # stable, the configured order breaks ties
+        attribute_names = sorted(attribute_names, key=lambda name: -decisive_counts[name])
+        manifest.update_many(tagged_paths, Stage.skipped)
+        skipped_count += len(tagged_paths)
+        checked_count += len(batch)
+        progress.report_progress(checked_count / total_count)
+    progress.finish()
+    already_tagged_count = skipped_count
+
+    log(f"Skipped {skipped_count} of {checked_count} files that are already tagged")
+
+
+def apply_tags(original_file: str, tags: dict[str, Any]):
+    # ap.UI().navigate_to_folder(os.path.dirname(original_file))
+    ap.UI().navigate_to_file(original_file)
+
+    tag_sink.set_category_tags(original_file, tags, get_file_categories(tagger_settings))
+
+
+def apply_cached_tags():
+    cached_count = manifest.count(Stage.cached)
+    if cached_count == 0:
+        return
+
+    log(f"Applying cached tags to {cached_count} files")
+    for batch in manifest.iter_batches(100, Stage.cached):
+        for entry in batch:
+            apply_tags(entry.path, entry.tags)
+        tag_sink.flush()
+        manifest.update_many([entry.path for entry in batch], Stage.tagged)
+
+
+def request_batch_tags(batch: list[ManifestEntry]) -> list[Optional[Any]]:
+    manifest.update_many([entry.path for entry in batch], Stage.requested)
+    # a short response is split up and requested again, so one bad image doesn't cost the whole batch
+    return request_with_bisection(
+        batch, lambda entries: get_openai_response_images(get_prompt(), [entry.preview for entry in entries]),
+        batch_sizer)
+
+
+def apply_batch_response(batch: list[ManifestEntry], response: list[Optional[Any]], failed_files: list[str]):
+    log(response)
+    if len(response) < len(batch):
+        # keep going with the other batches, only this one is lost
+        log_err(f"Not all images were tagged [Received {len(response)}, requested {len(batch)}]")
+        failed_files.extend(entry.path for entry in batch)
+        manifest.update_many([entry.path for entry in batch], Stage.preview_ready)
+        return
+
+    progress = ap.Progress("Updating tags", "Processing", infinite=False, show_loading_screen=True)
+    tagged = []
+    untagged = []
+    for j, entry in enumerate(batch):
+        progress.report_progress(j / len(batch))
+        if response[j] is None:
+            untagged.append(entry.path)
+            continue
+        if response_cache is not None and entry.file_hash:
+            response_cache.put(get_cache_key(entry.file_hash), response[j])
+        apply_tags(entry.path, response[j])
+        tagged.append((entry.path, response[j]))
+    tag_sink.flush()
+    manifest.update_tags(tagged)
+    if untagged:
+        log_err(f"No tags received for {len(untagged)} of {len(batch)} images")
+        failed_files.extend(untagged)
+        manifest.update_many(untagged, Stage.preview_ready)
+    progress.finish()
+
+
+def fail_batch(batch: list[ManifestEntry], error: Exception, failed_files: list[str]):
+    """
+    Release the files of a batch whose request raised, a later run requests them again
+    """
+    log_err(f"Failed to tag {len(batch)} files: {error!r}")
+    failed_files.extend(entry.path for entry in batch)
+    manifest.update_many([entry.path for entry in batch], Stage.preview_ready)
+
+
+def hash_previews(batch: list[ManifestEntry]) -> list[Optional[int]]:
+    from image.phash import difference_hash
+
+    hashes = []
+    for entry in batch:
+        try:
+            with span("preview_hashing"):
+                hashes.append(difference_hash(entry.preview))
+        except (OSError, ValueError) as e:
+            log_err(f"Failed to hash preview of {entry.path}: {e}")
+            hashes.append(None)
+    return hashes
+
+
+def group_duplicate_previews():
+    """
+    Hash all previews and keep only one representative of every group of near-duplicates for upload,
+    the others get the tags of their representative once it is tagged
+    """
+    if not tagger_settings.file_dedup_enabled or manifest.count(Stage.preview_ready) < 2:
+        return
+
+    progress = ap.Progress("Finding near-duplicates", "Processing", infinite=False, show_loading_screen=True)
+    paths = []
+    hashes = []
+    total_count = manifest.count(Stage.preview_ready)
+
+    def add_hashes(batch: list[ManifestEntry], batch_hashes: list[Optional[int]]):
+        for entry, preview_hash in zip(batch, batch_hashes):
+            # previews that can't be hashed are uploaded on their own
+            if preview_hash is not None:
+                paths.append(entry.path)
+                hashes.append(preview_hash)
+        progress.report_progress(len(paths) / total_count)
+
+    dispatch_batches(
+        manifest.iter_batches(100, Stage.preview_ready),
+        hash_previews,
+        add_hashes,
+        tagger_settings.preview_parallelism)
+
+    import numpy as np
+    from image.phash import group_near_duplicates
+
+    representatives = group_near_duplicates(np.array(hashes, dtype=np.uint64), tagger_settings.file_dedup_threshold)
+    duplicates = [(paths[i], paths[j]) for i, j in enumerate(representatives.tolist()) if i != j]
+    manifest.mark_duplicates(duplicates)
+    progress.finish()
+    log(f"Found {len(duplicates)} near-duplicates of {len(paths) - len(duplicates)} previews")
+
+
+def apply_duplicate_tags(failed_files: list[str]):
+    """
+    Copy the tags of every representative to its near-duplicates,
+    near-duplicates of a representative that wasn't tagged are released to be requested themselves
+    """
+    tagged = []
+    released = []
+    for entry, representative_stage, representative_tags in manifest.iter_duplicates():
+        if representative_stage == Stage.tagged and representative_tags is not None:
+            apply_tags(entry.path, representative_tags)
+            tagged.append((entry.path, representative_tags))
+        else:
+            released.append(entry.path)
+        if len(tagged) >= 100:
+            tag_sink.flush()
+            manifest.update_tags(tagged)
+            tagged.clear()
+
+    tag_sink.flush()
+    manifest.update_tags(tagged)
+    if released:
+        log_err(f"{len(released)} near-duplicates were not tagged, their representative has no tags")
+        failed_files.extend(released)
+        manifest.update_many(released, Stage.preview_ready)
+
+
+def write_metrics():
+    try:
+        path = write_run_metrics(tagger_settings.metrics_prometheus_file)
+        log(format_summary())
+        log(f"Run metrics written to {path}")
+    except OSError as e:
+        log_err(f"Failed to write run metrics: {e}")
+
+
+def finish_tagging(completed: bool, failed_files: list[str]):
+    write_metrics()
+    if preview_cache is not None:
+        # previews of this run count towards the size cap from now on
+        preview_cache.evict()
+    if run_budget is not None:
+        log(run_budget.report())
+    if run_budget is not None and run_budget.exhausted:
+        # the manifest is kept, running the action again continues once there is budget left
+        log_err(f"Budget reached ({manifest.summary()})")
+        ap.UI().navigate_to_folder(initial_folder)
+        ap.UI().show_error(
+            "Budget reached",
+            f"Not all files were tagged, the budget of ${tagger_settings.budget_limit:g} for "
+            f"{tagger_settings.budget_period_days} days would be exceeded")
+        return
+    if not completed:
+        # the manifest is kept, running the action on the same selection continues from here
+        log(f"Tagging canceled ({manifest.summary()})")
+        ap.UI().navigate_to_folder(initial_folder)
+        return
+
+    finish_time = datetime.now()
+    log(f"Finished tagging in {finish_time - start_time}")
+    ap.UI().navigate_to_folder(initial_folder)
+    if failed_files:
+        log_err("Files that were not tagged:\n" + "\n".join(failed_files))
+        ap.UI().show_error(
+            "Not all files were tagged",
+            f"{len(failed_files)} files could not be tagged, run the action on them again")
+    elif manifest.is_complete():
+        manifest.discard()
 
 
 def proceed_callback(database):
     proceed_dialog.close()
-    skip_existing_tags = proceed_dialog.get_value("skip_existing_tags")
-    if skip_existing_tags:
-        change_slices_to_skip(database)
+
+    if tagger_settings.file_batch_mode:
+        def run_batch():
+            create_run_budget(batch_price_factor)
+            if submit_batch_job():
+                collect_batch_job()
+
+        ctx.run_async(run_batch)
+        return
 
     def run():
         progress = ap.Progress(
             "Requesting AI tags", "Processing", infinite=False, show_loading_screen=True, cancelable=True)
         global start_time
         start_time = datetime.now()
-        log(f"Started tagging {len(previews_sliced)} previews")
+        file_count = manifest.count(Stage.preview_ready)
+        log(f"Started tagging {file_count} files")
         progress.report_progress(0)
-        for i, p in enumerate(previews_sliced):
-            if progress.canceled:
-                progress.finish()
-                ap.UI().navigate_to_folder(initial_folder)
-                return
-            response = get_openai_response_images(prompt, p)
-            progress.report_progress((i + 1) / len(previews_sliced))
-            log(response)
-            if len(response) < len(p):
-                ap.UI().navigate_to_folder(initial_folder)
-                ap.UI().show_error(
-                    "Error", f"Not all images were tagged [Received {len(response)}, requested {len(p)}]")
-                raise ValueError(f"Not all images were tagged [Received {len(response)}, requested {len(p)}]")
-
-            progress2 = ap.Progress("Updating tags", "Processing", infinite=False, show_loading_screen=True)
-            for j, preview in enumerate(p):
-                progress2.report_progress(j / len(p))
-                tags = response[j]
-
-                # ap.UI().navigate_to_folder(os.path.dirname(original_files[p[j]]))
-                ap.UI().navigate_to_file(original_files[p[j]])
-
-                if tagger_settings.file_label_ai_types:
-                    types = tags["types"]
-                    types_tags = aps.AttributeTagList()
-                    for k, tag in enumerate(types):
-                        types[k] = replace_tag(tag, all_variants["AI-Types"])
-                        new_tag = check_or_update_attribute(attributes[0], types[k], database)
-                        types_tags.append(new_tag)
-
-                    database.attributes.set_attribute_value(original_files[p[j]], "AI-Types", types_tags)
-
-                if tagger_settings.file_label_ai_genres:
-                    genres = tags["genres"]
-                    genres_tags = aps.AttributeTagList()
-
-                    for k, tag in enumerate(genres):
-                        genres[k] = replace_tag(tag, all_variants["AI-Genres"])
-                        new_tag = check_or_update_attribute(attributes[1], genres[k], database)
-                        genres_tags.append(new_tag)
-
-                    database.attributes.set_attribute_value(original_files[p[j]], "AI-Genres", genres_tags)
-
-                if tagger_settings.file_label_ai_objects:
-                    objects = tags["objects"]
-                    objects_tags = aps.AttributeTagList()
-                    for k, tag in enumerate(objects):
-                        objects[k] = replace_tag(tag, all_variants["AI-Objects"])
-                        new_tag = check_or_update_attribute(attributes[2], objects[k], database)
-                        objects_tags.append(new_tag)
-
-                    database.attributes.set_attribute_value(original_files[p[j]], "AI-Objects", objects_tags)
-            progress2.finish()
+        answered_count = 0
+        failed_files = []
+        create_run_budget()
+
+        apply_cached_tags()
+
+        def apply_response(batch: list[ManifestEntry], response: list[Optional[Any]]):
+            nonlocal answered_count
+            answered_count += len(batch)
+            progress.report_progress(answered_count / file_count)
+            apply_batch_response(batch, response, failed_files)
+
+        def on_error(batch: list[ManifestEntry], error: Exception):
+            nonlocal answered_count
+            answered_count += len(batch)
+            progress.report_progress(answered_count / file_count)
+            fail_batch(batch, error, failed_files)
+
+        completed = dispatch_batches(
+            iter_adaptive_batches(manifest.iter_files(Stage.preview_ready), create_batch_sizer()),
+            request_batch_tags,
+            apply_response,
+            tagger_settings.file_max_concurrent_requests,
+            lambda: progress.canceled or run_budget.exhausted,
+            on_error=on_error)
+        if completed:
+            apply_duplicate_tags(failed_files)
 
         progress.finish()
-        finish_time = datetime.now()
-        log(f"Finished tagging in {finish_time - start_time}")
-        ap.UI().navigate_to_folder(initial_folder)
+        finish_tagging(completed, failed_files)
 
     ctx.run_async(run)
 
 
-previews = []
-file_input_paths = []
-last_index = -1
-generating_previews_count = 0
-generating_previews_progress: Optional[ap.Progress] = None
-cancel_generating_previews = False  # hack
-ctx: Optional[ap.Context] = None
-start_time = datetime.now()
+def build_batch_request(batch: list[ManifestEntry]) -> "BatchRequest":
+    from ai.batch import BatchRequest
 
+    payload, _ = build_images_payload(get_prompt(), [entry.preview for entry in batch])
+    # sequence numbers are unique within the job, so the first one identifies the request
+    return BatchRequest(f"files-{batch[0].seq}", payload)
 
-def proceed_generating_previews(workspace_id, database, output_folder):
-    if cancel_generating_previews:
-        return
-    if generating_previews_progress.canceled:
-        return
-    if generating_previews_count > len(file_input_paths):
-        return
 
-    if generating_previews_count == len(file_input_paths):
-        finish_generating_previews(previews, database)
-        return
+def reserve_batch_budget(estimated_cost: float) -> bool:
+    """
+    Reserve the cost of the whole batch before it is submitted, it can't be stopped halfway once it runs
+    """
+    try:
+        reservation_id = run_budget.reserve(estimated_cost, batch_reservation_timeout)
+    except BudgetExceeded as e:
+        log_err(str(e))
+        ap.UI().show_error(
+            "Budget reached",
+            f"The batch would exceed the budget of ${tagger_settings.budget_limit:g} for "
+            f"{tagger_settings.budget_period_days} days")
+        return False
+    manifest.set_meta("budget_reservation", reservation_id)
+    return True
+
+
+def release_batch_budget():
+    run_budget.release(manifest.get_meta("budget_reservation"))
+    manifest.set_meta("budget_reservation", None)
+
+
+def submit_batch_job() -> bool:
+    """
+    Write all pending previews into batch files and submit them, the batch ids are kept in the manifest
+    :return bool: False if canceled before anything was submitted
+    """
+    import requests
+    from ai.batch import encode_batch_request, split_batch_files, submit_batch
+    from ai.client import get_client
+
+    progress = ap.Progress("Preparing batch", "Processing", infinite=False, show_loading_screen=True, cancelable=True)
+    request_count = math.ceil(manifest.count(Stage.preview_ready) / images_per_request)
+    prepared_count = 0
+    estimated_cost = 0.0
+    # requests are spooled to disk, a batch of large jobs doesn't fit into memory
+    spool_path = os.path.join(get_data_directory("jobs"), f"{os.path.basename(manifest.path)}.jsonl")
+
+    with open(spool_path, "wb") as spool:
+        def on_request(batch: list[ManifestEntry], request: "BatchRequest"):
+            nonlocal prepared_count, estimated_cost
+            estimated_cost += estimate_request_cost(get_prompt(), len(batch))
+            spool.write(encode_batch_request(request))
+            manifest.assign_request([entry.path for entry in batch], request.custom_id)
+            prepared_count += 1
+            progress.report_progress(prepared_count / request_count)
+
+        def on_error(batch: list[ManifestEntry], error: Exception):
+            nonlocal prepared_count
+            # the files stay preview ready and are reported as not tagged once the batches are collected
+            log_err(f"Failed to prepare {len(batch)} files for the batch: {error!r}")
+            prepared_count += 1
+            progress.report_progress(prepared_count / request_count)
+
+        completed = dispatch_batches(
+            manifest.iter_batches(images_per_request, Stage.preview_ready),
+            build_batch_request,
+            on_request,
+            tagger_settings.preview_parallelism,
+            lambda: progress.canceled,
+            on_error=on_error)
+
+    try:
+        if not completed or not reserve_batch_budget(estimated_cost):
+            manifest.release_requested()
+            return False
+
+        progress.set_text("Uploading batch")
+        batch_ids = []
+        with open(spool_path, "rb") as spool:
+            for batch_file in split_batch_files(spool):
+                try:
+                    batch_ids.append(submit_batch(get_client(), batch_file, {"job": os.path.basename(manifest.path)}))
+                except requests.exceptions.RequestException as e:
+                    log_err(f"Failed to submit batch: {e}")
+                    ap.UI().show_error("Batch not submitted", str(e))
+                    if not batch_ids:
+                        manifest.release_requested()
+                        release_batch_budget()
+                        return False
+                    # requests of the missing part are released once the submitted batches are collected
+                    break
+                # stored after every submission, a later run must not lose a batch that is already paid for
+                manifest.set_meta("batch_ids", batch_ids)
+        return True
+    finally:
+        os.remove(spool_path)
+        progress.finish()
+
+
+def collect_batch_job():
+    """
+    Wait for the submitted batches and apply their results, waiting can be canceled and resumed by a later run
+    """
+    from ai.batch import download_batch_results, get_request_counts, wait_for_batch
+    from ai.client import get_client, record_usage
+    from ai.tagging import parse_image_tags
+
+    global start_time
+    start_time = datetime.now()
+    failed_files = []
+    if run_budget is None:
+        # collected by a later run than the one that submitted the batch
+        create_run_budget(batch_price_factor)
+    progress = ap.Progress(
+        "Waiting for OpenAI batch", "Processing", infinite=False, show_loading_screen=True, cancelable=True)
+    apply_cached_tags()
+
+    def on_status(batch: dict[str, Any]):
+        finished, total = get_request_counts(batch)
+        progress.set_text(f"Batch {batch['status']}: {finished} of {total} requests")
+        if total:
+            progress.report_progress(finished / total)
+
+    batch_ids = manifest.get_meta("batch_ids", [])
+    for batch_id in list(batch_ids):
+        batch = wait_for_batch(get_client(), batch_id, batch_poll_interval, lambda: progress.canceled, on_status)
+        if batch is None:
+            progress.finish()
+            log(f"Stopped waiting for batch {batch_id}, it keeps running on OpenAI")
+            write_metrics()
+            ap.UI().show_info(
+                "Batch is still running",
+                "Run the action on the same selection again to apply the results once the batch is finished")
+            ap.UI().navigate_to_folder(initial_folder)
+            return
+
+        if batch["status"] != "completed":
+            log_err(f"Batch {batch_id} {batch['status']}: {batch.get('errors')}")
+
+        for custom_id, result in download_batch_results(get_client(), batch).items():
+            # results of a batch that was partly applied before are skipped
+            entries = [entry for entry in manifest.get_request(custom_id) if entry.stage == Stage.requested]
+            if not entries:
+                continue
+            response = parse_image_tags(result) if "error" not in result else None
+            if "error" in result:
+                log_err(f"Batch request {custom_id} failed: {result['error']}")
+            else:
+                usage = result.get("usage") or {}
+                record_usage(usage)
+                run_budget.record(usage, result.get("model") or openai_model)
+            apply_batch_response(entries, response or [], failed_files)
+
+        batch_ids.remove(batch_id)
+        manifest.set_meta("batch_ids", batch_ids or None)
+
+    # requests the batches had no result for, e.g. after they expired, and files left out of the batches
+    failed_files.extend(entry.path for entry in manifest.iter_files(Stage.requested, Stage.preview_ready))
+    manifest.release_requested()
+    # the actual cost is recorded by now, the reservation only held it while the batch was running
+    release_batch_budget()
+    apply_duplicate_tags(failed_files)
+    progress.finish()
+    finish_tagging(True, failed_files)
 
-    if last_index >= len(file_input_paths) - 1:
+
+def prepare_preview(workspace_id, output_folder, entry: ManifestEntry) -> str:
+    # the preview of an earlier run may have been evicted since, it is generated again then
+    if entry.stage == Stage.preview_ready and entry.preview and os.path.exists(entry.preview):
+        return entry.preview
+    return get_preview_image(workspace_id, entry.path, output_folder, entry.file_hash or "")
+
+
+def run_streaming(workspace_id, database):
+    """
+    Generate and send previews as a pipeline: a batch is requested as soon as it is ready
+    while the following previews are still being generated
+    """
+    progress = ap.Progress(
+        "Tagging files", "Processing", infinite=False, show_loading_screen=True, cancelable=True)
+    global start_time
+    start_time = datetime.now()
+    progress.report_progress(0)
+
+    apply_cached_tags()
+
+    output_folder = open_preview_directory()
+    create_batch_sizer()
+    create_run_budget()
+    total_count = manifest.count(Stage.discovered, Stage.preview_ready)
+    log(f"Started streaming {total_count} files")
+    # bounded, so preview generation does not run away from the requests
+    ready_batches = queue.Queue(maxsize=tagger_settings.file_max_concurrent_requests * 2)
+    pending_batch: list[ManifestEntry] = []
+    # each counter is only written by one thread
+    skipped_count = 0
+    answered_count = 0
+    failed_files = []
+
+    def is_stopped() -> bool:
+        return progress.canceled or run_budget.exhausted
+
+    def put_batch(batch: Optional[list[ManifestEntry]]):
+        while True:
+            try:
+                ready_batches.put(batch, timeout=0.25)
+                return
+            except queue.Full:
+                if is_stopped():
+                    return
+
+    def on_preview(entry: ManifestEntry, image_path: str):
+        nonlocal skipped_count
+        if not image_path:
+            manifest.update(entry.path, Stage.skipped)
+            skipped_count += 1
+            return
+
+        manifest.update(entry.path, Stage.preview_ready, preview=image_path)
+        pending_batch.append(entry._replace(stage=Stage.preview_ready, preview=image_path))
+        if len(pending_batch) >= batch_sizer.next_size():
+            put_batch(pending_batch.copy())
+            pending_batch.clear()
+
+    def on_preview_error(entry: ManifestEntry, error: Exception):
+        nonlocal skipped_count
+        log_err(f"Failed to generate preview for {entry.path}: {error}")
+        failed_files.append(entry.path)
+        skipped_count += 1
+
+    def produce():
+        try:
+            dispatch_batches(
+                manifest.iter_files(Stage.discovered, Stage.preview_ready),
+                lambda entry: prepare_preview(workspace_id, output_folder, entry),
+                on_preview,
+                tagger_settings.preview_parallelism,
+                is_stopped,
+                on_error=on_preview_error)
+            if pending_batch:
+                put_batch(pending_batch.copy())
+        except Exception as e:
+            log_err(f"Preview generation failed: {e}")
+        finally:
+            put_batch(None)
+
+    def iter_ready_batches() -> Iterator[list[ManifestEntry]]:
+        while True:
+            try:
+                batch = ready_batches.get(timeout=0.25)
+            except queue.Empty:
+                if is_stopped():
+                    return
+                continue
+            if batch is None:
+                return
+            yield batch
+
+    def apply_response(batch: list[ManifestEntry], response: list[Any]):
+        nonlocal answered_count
+        apply_batch_response(batch, response, failed_files)
+        answered_count += len(batch)
+        progress.report_progress((answered_count + skipped_count) / total_count)
+
+    def on_error(batch: list[ManifestEntry], error: Exception):
+        nonlocal answered_count
+        fail_batch(batch, error, failed_files)
+        answered_count += len(batch)
+        progress.report_progress((answered_count + skipped_count) / total_count)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    completed = dispatch_batches(
+        iter_ready_batches(),
+        request_batch_tags,
+        apply_response,
+        tagger_settings.file_max_concurrent_requests,
+        is_stopped,
+        on_error=on_error)
+    producer.join()
+
+    progress.finish()
+    finish_tagging(completed, failed_files)
+
+
+def streaming_proceed_callback(workspace_id, database):
+    proceed_dialog.close()
+    ctx.run_async(run_streaming, workspace_id, database)
+
+
+def show_streaming_estimate(workspace_id, database):
+    """
+    Previews are only generated after confirmation in streaming mode, so the estimate assumes
+    every preview uses the full `max_dimension` square
+    """
+    from ai.tokens import count_tokens
+
+    skip_already_tagged(database)
+    load_cached_tags()
+
+    file_count = manifest.count(Stage.discovered, Stage.preview_ready)
+    if file_count == 0 and manifest.count(Stage.cached) == 0:
+        manifest.discard()
+        ap.UI().navigate_to_folder(initial_folder)
+        ap.UI().show_error("No supported files selected", "Please select files to tag")
+        log_err("No supported files selected")
         return
 
-    input_path = file_input_paths[last_index + 1]
-    generate_preview_async(workspace_id, input_path, output_folder, database)
-    # ctx.run_async(generate_preview_async, workspace_id, input_path, output_folder, database)
+    total_tokens = 0
+    for batch in manifest.iter_batches(images_per_request, Stage.discovered, Stage.preview_ready):
+        total_tokens += count_tokens(get_prompt() + ", ".join(os.path.basename(entry.path) for entry in batch))
+
+    pixel_count = file_count * max_dimension * max_dimension
+    combined_output_tokens = file_count * output_token_count
+    total_price = (
+            total_tokens * input_token_price + pixel_count * input_pixel_price
+            + combined_output_tokens * output_token_price)
+
+    global estimated_price
+    estimated_price = total_price
+    data = CreateTagFilesDialogData(
+        file_count, total_tokens, combined_output_tokens, pixel_count, total_price, manifest.count(Stage.cached),
+        already_tagged_count=already_tagged_count)
+    global proceed_dialog
+    proceed_dialog = create_tag_files_dialog(data, lambda d: streaming_proceed_callback(workspace_id, database))
+    proceed_dialog.show()
+
+
+ctx: Optional[ap.Context] = None
+start_time = datetime.now()
 
 
-def generate_previews(workspace_id, input_paths, database):
-    if len(input_paths) == 0:
+def generate_previews(workspace_id, database):
+    if manifest.count() == 0:
         ap.UI().navigate_to_folder(initial_folder)
         ap.UI().show_error("No supported files selected", "Please select files to tag")
         log_err("No supported files selected")
@@ -387,127 +879,141 @@ def generate_previews(workspace_id, input_paths, database):
 
     global start_time
     start_time = datetime.now()
-    log(f"Started generating previews for {len(input_paths)} files")
 
-    # start progress
-    global generating_previews_progress
-    generating_previews_progress = ap.Progress(
+    progress = ap.Progress(
         "Generating previews", "Processing", infinite=False,
         show_loading_screen=True,
         cancelable=True)
 
-    output_folder = create_temp_directory()
+    output_folder = open_preview_directory()
+    # opening the preview cache evicts previews, also ones of an interrupted run on this selection
+    missing_count = manifest.release_missing_previews()
+    if missing_count:
+        log(f"Generating {missing_count} evicted previews again")
 
-    global previews
-    previews = []
-    global file_input_paths
-    file_input_paths = input_paths
+    skip_already_tagged(database)
+    load_cached_tags()
+
+    total_count = manifest.count(Stage.discovered)
+    generated_count = 0
+    failed_files = []
+    log(f"Started generating previews for {total_count} files")
     log("Output folder: {}".format(output_folder.replace("\\", "\\\\")))
-    proceed_generating_previews(workspace_id, database, output_folder)
-    # start generating first 10 previews
-    for i in range(min(images_per_request, len(input_paths))):
-        input_path = input_paths[i]
-        ctx.run_async(generate_preview_async, workspace_id, input_path, output_folder, database)
 
+    def on_preview(entry: ManifestEntry, image_path: str):
+        nonlocal generated_count
+        if image_path:
+            manifest.update(entry.path, Stage.preview_ready, preview=image_path)
+        else:
+            manifest.update(entry.path, Stage.skipped)
+        generated_count += 1
+        progress.report_progress(generated_count / total_count)
+
+    def on_error(entry: ManifestEntry, error: Exception):
+        nonlocal generated_count
+        # the file stays discovered, so the next run on this selection retries it
+        log_err(f"Failed to generate preview for {entry.path}: {error}")
+        failed_files.append(entry.path)
+        generated_count += 1
+        progress.report_progress(generated_count / total_count)
+
+    completed = dispatch_batches(
+        manifest.iter_files(Stage.discovered),
+        lambda entry: get_preview_image(workspace_id, entry.path, output_folder, entry.file_hash or ""),
+        on_preview,
+        tagger_settings.preview_parallelism,
+        lambda: progress.canceled,
+        on_error=on_error)
+    progress.finish()
 
-def generate_preview_async(workspace_id, input_path, output_folder, database):
-    global last_index
-    if last_index >= len(file_input_paths) - 1:
-        return
-    last_index += 1
-    global cancel_generating_previews
-    if cancel_generating_previews:
-        return
-    image_path = get_preview_image(workspace_id, input_path, output_folder)
-    if not image_path == "":
-        previews.append(image_path)
-        original_files[image_path] = input_path
-
-    global generating_previews_count
-    generating_previews_count += 1
-    log(f"Progress cancelled: {generating_previews_progress.canceled}")
-    if generating_previews_progress.canceled:
-        cancel_generating_previews = True
-        generating_previews_progress.finish()
+    if not completed:
+        log(f"Preview generation canceled ({manifest.summary()})")
         ap.UI().navigate_to_folder(initial_folder)
         return
 
-    generating_previews_progress.report_progress(generating_previews_count / len(file_input_paths))
-    proceed_generating_previews(workspace_id, database, output_folder)
-
-
-def finish_generating_previews(input_paths, database):
-    if generating_previews_progress.canceled:
-        return
-    generating_previews_progress.finish()
-    log(f"Finished generating previews for {len(input_paths)} files")
     current_time = datetime.now()
-    log(f"Generated {len(input_paths)} previews in {current_time - start_time}")
-    if len(input_paths) == 0:
+    log(f"Generated {generated_count} previews in {current_time - start_time}")
+    if failed_files:
+        log_err(f"Previews could not be generated for {len(failed_files)} files:\n" + "\n".join(failed_files))
+
+    if manifest.count(Stage.preview_ready, Stage.cached) == 0:
+        if not failed_files:
+            manifest.discard()
         ap.UI().navigate_to_folder(initial_folder)
         ap.UI().show_error("No supported files selected", "Please select files to tag")
         log_err("No supported files selected")
         return
-    process_images(input_paths, database)
 
+    group_duplicate_previews()
+    process_images(database)
+
+
+max_dimension = preview_max_dimension
 
-max_dimension = 128
 
+def estimate_batch(batch: list[ManifestEntry]) -> tuple[int, int]:
+    """
+    Estimate pixel and token count of a batch from the preview headers, without decoding opaque previews
+    """
+    from ai.tokens import count_tokens
+    from image.resize import estimate_dimensions
 
-def process_images(input_paths, database):
-    # calculate pixel count
     pixel_count = 0
-    asset_names = []
-    progress = ap.Progress("Calculating pixel count", "Processing", infinite=False, show_loading_screen=True)
-    for i, preview_path in enumerate(previews):
-        [width, height] = resize_image(preview_path, max_dimension)
+    for entry in batch:
+        try:
+            [width, height] = estimate_dimensions(entry.preview, max_dimension)
+        except (OSError, ValueError) as e:
+            # an unreadable preview fails its request later, it's estimated at the full size until then
+            log_err(f"Failed to read the preview of {entry.path}: {e}")
+            width = height = max_dimension
         pixel_count += width * height
-        progress.report_progress(i / len(previews))
-        asset_names.append(os.path.basename(original_files[preview_path]))
+    token_count = count_tokens(get_prompt() + ", ".join(os.path.basename(entry.path) for entry in batch))
+    return pixel_count, token_count
+
+
+def process_images(database):
+    # calculate pixel and token count
+    pixel_count = 0
+    total_tokens = 0
+    preview_count = manifest.count(Stage.preview_ready)
+    processed_count = 0
+    progress = ap.Progress("Calculating pixel count", "Processing", infinite=False, show_loading_screen=True)
 
-    global previews_sliced
-    # slice previews by images_per_request
-    previews_sliced = [previews[i:i + images_per_request] for i in range(0, len(previews), images_per_request)]
+    def add_estimate(batch: list[ManifestEntry], estimate: tuple[int, int]):
+        nonlocal pixel_count, total_tokens, processed_count
+        pixel_count += estimate[0]
+        total_tokens += estimate[1]
+        processed_count += len(batch)
+        progress.report_progress(processed_count / preview_count)
+
+    dispatch_batches(
+        manifest.iter_batches(images_per_request, Stage.preview_ready),
+        estimate_batch,
+        add_estimate,
+        os.cpu_count() or 4)
 
-    # calculate token count
     pixel_price = pixel_count * input_pixel_price
     log(f"Pixel count: {pixel_count}")
     log(f"Pixel price: {pixel_price}")
     progress.finish()
-    token_count = count_tokens(prompt + ", ".join(asset_names))
-    total_tokens = token_count * len(previews_sliced)
-    combined_output_tokens = len(previews) * output_token_count
+    combined_output_tokens = preview_count * output_token_count
 
     total_price = total_tokens * input_token_price + pixel_price + combined_output_tokens * output_token_price
-
-    data = CreateTagFilesDialogData(input_paths, total_tokens, combined_output_tokens, pixel_count, total_price)
+    if tagger_settings.file_batch_mode:
+        total_price *= batch_price_factor
+    global estimated_price
+    estimated_price = total_price
+
+    data = CreateTagFilesDialogData(
+        preview_count, total_tokens, combined_output_tokens, pixel_count, total_price,
+        manifest.count(Stage.cached), tagger_settings.file_batch_mode, manifest.count(Stage.duplicate),
+        already_tagged_count)
     global proceed_dialog
     proceed_dialog = create_tag_files_dialog(data, lambda d: proceed_callback(database))
     proceed_dialog.show()
 
 
-attributes = []
-
-
-def filter_ignored_extensions(files: list[str], ignored_ext: list[list[str]]) -> list[str]:
-    filtered_files = []
-    for file in files:
-        file_ext = file.split(".")[-1]
-        for ignored_extension in ignored_ext:
-            if file_ext in ignored_extension:
-                log(f"Ignoring file because of extension: {file}")
-                break
-        else:
-            filtered_files.append(file)
-
-    return filtered_files
-
-
-ignored_extensions = [
-    unity_extensions, unreal_extensions, godot_extensions,
-    temp_extensions, audio_extensions,
-    text_extensions
-]
+tag_sink: Optional[TagSink] = None
 
 
 def get_all_files_recursive(folder_path) -> list[str]:
@@ -526,7 +1032,13 @@ def main():
     if not tagger_settings.any_file_tags_selected():
         ap.UI().show_error("No tags selected", "Please select at least one tag type in the settings")
         return
+    try:
+        # the client is only created with the first request, a missing key is reported right away
+        init_openai_key()
+    except ValueError:
+        return
 
+    run_metrics.reset("tag_files")
     global ctx
     ctx = ap.get_context()
     database = ap.get_api()
@@ -535,32 +1047,44 @@ def main():
     genres_attribute = ensure_attribute(database, "AI-Genres") if tagger_settings.file_label_ai_genres else None
     objects_attribute = ensure_attribute(database, "AI-Objects") if tagger_settings.file_label_ai_objects else None
 
-    global attributes
-    attributes = [types_attribute, genres_attribute, objects_attribute]
+    global tag_sink
+    tag_sink = AttributeTagSink(
+        database, [types_attribute, genres_attribute, objects_attribute], get_alias_index(tagger_settings.alias_file))
 
-    selected_files = ctx.selected_files
+    with span("discovery"):
+        selected_files = ctx.selected_files
 
-    selected_folders = ctx.selected_folders
+        selected_folders = ctx.selected_folders
 
-    log(selected_folders)
+        log(selected_folders)
 
-    if len(selected_folders) > 0:
-        # TODO remove this after fixing the folder selection
-        ap.UI().show_error(
-            "Folders are experimental", "Please navigate inside the folder and change the view to List",
-            60000)
-        for folder in selected_folders:
-            inner_files = get_all_files_recursive(folder)
-            log(inner_files)
-            selected_files.extend(inner_files)
+        if len(selected_folders) > 0:
+            # TODO remove this after fixing the folder selection
+            ap.UI().show_error(
+                "Folders are experimental", "Please navigate inside the folder and change the view to List",
+                60000)
+            for folder in selected_folders:
+                inner_files = get_all_files_recursive(folder)
+                log(inner_files)
+                selected_files.extend(inner_files)
 
-    filtered_files = filter_ignored_extensions(selected_files, ignored_extensions)
+        filtered_files = filter_ignored_extensions(selected_files, ignored_extensions)
 
-    global initial_folder
-    initial_folder = os.path.dirname(ctx.path)
-    log(f"Initial folder: {initial_folder}")
+        global initial_folder
+        initial_folder = os.path.dirname(ctx.path)
+        log(f"Initial folder: {initial_folder}")
 
-    ctx.run_async(generate_previews, ctx.workspace_id, filtered_files, database)
+        global manifest
+        manifest, _ = open_job_manifest(get_job_id(filtered_files, get_request_fingerprint()))
+        manifest.add_files(filtered_files)
+
+    if manifest.get_meta("batch_ids"):
+        # a previous run submitted a batch for this selection, its results are applied instead of a new request
+        ctx.run_async(collect_batch_job)
+    elif tagger_settings.file_streaming_mode and not tagger_settings.file_batch_mode:
+        ctx.run_async(show_streaming_estimate, ctx.workspace_id, database)
+    else:
+        ctx.run_async(generate_previews, ctx.workspace_id, database)
     return
 
 
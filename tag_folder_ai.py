@@ -1,258 +1,215 @@
 # This example demonstrates how to create a simple dialog in Anchorpoint
-import json
+
+import functools
 from typing import Any
 
 import anchorpoint as ap
 import apsync as aps
 import os
-import random
-
-import requests
 
-from ai.api import init_openai_key, OPENAI_API_URL
+from ai.api import init_openai_key
+from ai.cache import fingerprint
+from ai.dispatch import dispatch_batches
+from ai.ledger import BudgetExceeded, RunBudget, get_usage_ledger
+from ai.prompts import build_folder_payload, build_folder_prompt, build_folder_request_prompt, \
+    build_folder_response_format, get_folder_categories, output_token_count
 from ap_tools.dialogs import CreateTagFoldersDialogData, create_tag_folders_dialog
 from common.logging import log, log_err
-from labels.attributes import ensure_attribute, replace_tag, attribute_colors
-from labels.variants import engines_variants, types_variants, genres_variants
+from common.metrics import format_summary, run_metrics, span, write_run_metrics
+from folders.summary import build_folder_summary
+from folders.signatures import SignatureStore, get_signature_store
+from folders.tree import build_tree_index
+from labels.aliases import get_alias_index
+from labels.attributes import AttributeTagSink, ensure_attribute
+from labels.sinks import TagSink
 
-from ai.constants import input_token_price, output_token_price
-from ai.tokens import count_tokens
+from ai.constants import input_token_price, output_token_price, openai_model
 
 from common.settings import tagger_settings
 
-prompt = "Write tags for the folder:"
+# requests and the tokenizer are imported by the functions using them, the action shows its first progress before
+# they are loaded
 
-if tagger_settings.folder_use_ai_engines:
-    prompt += "required game engines (e.g. UE if it has *.uasset or Unity if it has *.unitypackage) or 'All' if assets have common types, "
 
-if tagger_settings.folder_use_ai_types:
-    prompt += "content types (Texture, Sprite, Model, VFX, SFX, etc.), "
+@functools.lru_cache(maxsize=None)
+def get_prompt() -> str:
+    return build_folder_prompt(tagger_settings)
 
-if tagger_settings.folder_use_ai_genres:
-    prompt += "detailed genres, "
 
-prompt += "fill all tags"
+@functools.lru_cache(maxsize=None)
+def get_response_format() -> dict[str, Any]:
+    return build_folder_response_format(tagger_settings)
 
-output_token_count = 200
 
 proceed_dialog: ap.Dialog
 
-all_variants = {
-    "AI-Engines": engines_variants,
-    "AI-Types": types_variants,
-    "AI-Genres": genres_variants,
-}
-
-items = {
-    "type": "object",
-    "additionalProperties": False,
-    "required": [],
-    "properties": {}
-}
-
-if tagger_settings.folder_use_ai_engines:
-    items["required"].append("engines")
-    items["properties"]["engines"] = {
-        "type": "array",
-        "items": {
-            "type": "string",
-            "additionalProperties": False,
-        }
-    }
-
-if tagger_settings.folder_use_ai_types:
-    items["required"].append("types")
-    items["properties"]["types"] = {
-        "type": "array",
-        "items": {
-            "type": "string",
-            "additionalProperties": False,
-        }
-    }
-
-if tagger_settings.folder_use_ai_genres:
-    items["required"].append("genres")
-    items["properties"]["genres"] = {
-        "type": "array",
-        "items": {
-            "type": "string",
-            "additionalProperties": False,
-        }
-    }
-
-response_format = {"type": "json_schema", "json_schema":
-    {
-        "name": "TaggingSchema",
-        "strict": True,
-        "schema": {
-            "type": "object",
-            "additionalProperties": False,
-            "required": ["items"],
-            "properties": {
-                "items": items
-            },
-            "name": "TaggingSchema"
-        }
-    }}
-
-
-def get_folder_structure(input_path) -> dict[Any, list[Any]]:
-    folder_structure = {}
-    for root, dirs, files in os.walk(input_path):
-        folder_structure[root] = files
-
-    return folder_structure
-
 
 def tag_folders(workspace_id: str, input_paths: list[str], database: aps.Api, attributes: list[aps.Attribute]):
-    folders = []
+    from ai.tokens import count_tokens_batch
+
+    prompts = []
     progress = ap.Progress("Counting tokens", "Processing", infinite=False, show_loading_screen=True)
 
-    total_steps = 3
+    total_steps = 2
+    # every directory is scanned once, even if the selected folders are nested
+    with span("discovery"):
+        tree_index = build_tree_index(input_paths)
+    signature_store = get_signature_store()
+    request_fingerprint = get_request_fingerprint()
+    signatures: dict[str, str] = {}
+    unchanged_count = 0
     for i, input_path in enumerate(input_paths):
         if os.path.isdir(input_path):
-            folder_structure = get_folder_structure(input_path)
-            progress.report_progress(i / len(input_paths) + (1 / total_steps / len(input_paths)))
-            folder_structure_str = str(folder_structure)
+            signature = tree_index.get(input_path).signature
+            if tagger_settings.folder_skip_unchanged and signature_store.is_unchanged(
+                    SignatureStore.make_key(workspace_id, input_path), signature, request_fingerprint):
+                log(f"Skipping {input_path}, nothing changed since it was tagged")
+                unchanged_count += 1
+                continue
+            signatures[input_path] = signature
+
+            with span("summary"):
+                folder_structure_str = build_folder_summary(
+                    tree_index.get(input_path), tagger_settings.folder_token_budget,
+                    tagger_settings.folder_summary_depth)
+            progress.report_progress(i / len(input_paths) / total_steps)
             folder_name = os.path.basename(input_path)
-            # replace input_path with "root"
-            folder_structure_str = folder_structure_str.replace(input_path, "root")
-            progress.report_progress(i / len(input_paths) + (2 / total_steps / len(input_paths)))
-            log(folder_structure_str)
 
-            full_prompt = f"{prompt}\nFolder name: {folder_name}\nFolder structure:\n{folder_structure_str}"
+            full_prompt = build_folder_request_prompt(get_prompt(), folder_name, folder_structure_str)
             log(full_prompt)
-            token_count = count_tokens(full_prompt)
-            progress.report_progress(i / len(input_paths) + (3 / total_steps / len(input_paths)))
-            input_price = token_count * input_token_price
-            folders.append((input_path, full_prompt, token_count, input_price))
+            prompts.append((input_path, full_prompt))
+
+    progress.report_progress(1 / total_steps)
+    with span("token_count"):
+        token_counts = count_tokens_batch(full_prompt for _, full_prompt in prompts)
+    folders = [
+        (input_path, full_prompt, token_count, token_count * input_token_price)
+        for (input_path, full_prompt), token_count in zip(prompts, token_counts)]
 
     progress.finish()
+    if not folders and unchanged_count:
+        ap.UI().show_success(
+            "Nothing to tag", f"None of the {unchanged_count} folders changed since they were tagged")
+        return
+
     global proceed_dialog
-    data = CreateTagFoldersDialogData(folders, output_token_count, output_token_price)
+    data = CreateTagFoldersDialogData(folders, output_token_count, output_token_price, unchanged_count)
     proceed_dialog = create_tag_folders_dialog(
         data,
-        lambda d: proceed_callback(folders, workspace_id, database, attributes))
+        lambda d: proceed_callback(folders, signatures, workspace_id, database, attributes))
     proceed_dialog.show()
 
 
+def get_request_fingerprint() -> str:
+    # a folder is tagged again when anything that shapes its prompt changes
+    return fingerprint(
+        get_prompt(), get_response_format(), openai_model, tagger_settings.folder_token_budget,
+        tagger_settings.folder_summary_depth)
+
+
 def proceed_callback(
-        folders: list[tuple[str, str, int, float]], workspace_id: str, database: aps.Api,
-        attributes: list[aps.Attribute]):
+        folders: list[tuple[str, str, int, float]], signatures: dict[str, str], workspace_id: str,
+        database: aps.Api, attributes: list[aps.Attribute]):
     proceed_dialog.close()
 
     def run():
-        progress = ap.Progress("Requesting AI tags", "Processing", infinite=False, show_loading_screen=True)
+        progress = ap.Progress(
+            "Requesting AI tags", "Processing", infinite=False, show_loading_screen=True, cancelable=True)
         progress.report_progress(0)
-        for i, folder in enumerate(folders):
-            tag_folder(folder[1], folder[0], workspace_id, database, attributes)
-            progress.report_progress((i + 1) / len(folders))
-        progress.finish()
+        tag_sink = AttributeTagSink(database, attributes, get_alias_index(tagger_settings.alias_file))
+        output_price = output_token_count * output_token_price
+        run_budget = RunBudget(
+            get_usage_ledger(), "tag_folders", sum(folder[3] + output_price for folder in folders),
+            tagger_settings.budget_limit, tagger_settings.budget_period_days)
+        completed_count = 0
+        tagged_folders = []
+
+        def on_response(folder: tuple[str, str, int, float], response: dict):
+            nonlocal completed_count
+            completed_count += 1
+            progress.report_progress(completed_count / len(folders))
+            if apply_folder_tags(folder[0], response, tag_sink):
+                tagged_folders.append(folder[0])
+
+        def on_error(folder: tuple[str, str, int, float], error: Exception):
+            if not isinstance(error, BudgetExceeded):
+                raise error
+            log_err(f"Skipped {folder[0]}: {error}")
+
+        # requests run concurrently, tags are applied on this thread and written together
+        try:
+            completed = dispatch_batches(
+                folders,
+                lambda folder: get_openai_response(folder[1], run_budget, folder[3] + output_price),
+                on_response,
+                tagger_settings.folder_max_concurrent_requests,
+                lambda: progress.canceled or run_budget.exhausted,
+                on_error=on_error)
+        finally:
+            # the tags of the answered folders are kept even if the run fails
+            tag_sink.flush()
+
+            # signatures are stored only once the tags are written
+            signature_store = get_signature_store()
+            request_fingerprint = get_request_fingerprint()
+            for input_path in tagged_folders:
+                signature_store.put(
+                    SignatureStore.make_key(workspace_id, input_path), signatures[input_path], request_fingerprint)
+            progress.finish()
+        log(run_budget.report())
+        if run_budget.exhausted:
+            ap.UI().show_error(
+                "Budget reached",
+                f"{len(folders) - len(tagged_folders)} folders were not tagged, the budget of "
+                f"${tagger_settings.budget_limit:g} for {tagger_settings.budget_period_days} days would be exceeded")
+        elif not completed:
+            log(f"Tagging canceled after {completed_count} of {len(folders)} folders")
+        try:
+            path = write_run_metrics(tagger_settings.metrics_prometheus_file)
+            log(format_summary())
+            log(f"Run metrics written to {path}")
+        except OSError as e:
+            log_err(f"Failed to write run metrics: {e}")
 
     ctx = ap.get_context()
     ctx.run_async(run)
 
 
-OPENAI_API_KEY = init_openai_key()
-
-
-def get_openai_response(in_prompt, model="gpt-4o-mini") -> dict:
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
-
-    payload = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": "You are a folder tagging AI."},
-            {"role": "user", "content": in_prompt}
-        ],
-        "response_format": response_format
-    }
+def get_openai_response(in_prompt, run_budget: RunBudget, estimated_cost: float, model=openai_model) -> dict:
+    """
+    :raise BudgetExceeded: If the request would exceed the budget, it is not sent then
+    """
+    from ai.client import get_client
+    from ai.tagging import request_folder_tags
 
+    payload, estimated_tokens = build_folder_payload(in_prompt, get_response_format(), model)
     log(f"Body: {payload}")
+    return request_folder_tags(get_client(), run_budget, payload, estimated_tokens, estimated_cost, model)
 
-    try:
-        response = requests.post(OPENAI_API_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        result = response.json()
-        result_content = result["choices"][0]["message"]["content"].strip()
-        parsed = json.loads(result_content)
-        return parsed["items"]
-    except requests.exceptions.RequestException as e:
-        return {"error": str(e)}
-    except KeyError:
-        return {"error": "No response from OpenAI"}
-
-
-def tag_folder(
-        full_prompt: str, input_path: str, workspace_id: str, database: aps.Api,
-        attributes: list[aps.Attribute]):
-    response = get_openai_response(full_prompt)
+
+def apply_folder_tags(input_path: str, response: dict, tag_sink: TagSink) -> bool:
     log(response)
     if response.get("error"):
         err = f"Error while tagging folder: {response['error']}"
         ap.UI().show_error("Error", err)
         log_err(err)
-        return
+        return False
 
-    tags = [
-        response["engines"] if tagger_settings.folder_use_ai_engines else None,
-        response["types"] if tagger_settings.folder_use_ai_types else None,
-        response["genres"] if tagger_settings.folder_use_ai_genres else None
-    ]
-
-    if len(tags) != len(attributes):
-        err = f"The number of categories ({len(tags)}) does not match the number of attributes ({len(attributes)})"
-        ap.UI().show_error("Error", err)
-        log_err(err)
-        return
-
-    for i, tag in enumerate(tags):
-        if not tag:
-            continue
-
-        attribute = attributes[i]
-        anchorpoint_tags = attribute.tags
-
-        colors = attribute_colors
-
-        # Create a set of anchorpoint tag names for faster lookup
-        anchorpoint_tag_names = {tag.name for tag in anchorpoint_tags}
-
-        # Add new tags from image_tags that are not already in anchorpoint_tag_names
-        folder_tags = tag
-        replaced_tags = []
-
-        for folder_tag in folder_tags:
-            tag = replace_tag(folder_tag.strip(), all_variants[attribute.name])
-            if not tag in replaced_tags:
-                replaced_tags.append(tag)
-
-        for folder_tag in replaced_tags:
-            folder_tag = folder_tag
-            if folder_tag not in anchorpoint_tag_names:
-                new_tag = aps.AttributeTag(folder_tag, random.choice(colors))
-                anchorpoint_tags.append(new_tag)
-
-        # Update the attribute tags in the database
-        database.attributes.set_attribute_tags(attribute, anchorpoint_tags)
-
-        ao_tags = aps.AttributeTagList()
-        for anchorpoint_tag in anchorpoint_tags:
-            if anchorpoint_tag.name in replaced_tags:
-                ao_tags.append(anchorpoint_tag)
-
-        # Set the attribute value for the input path
-        database.attributes.set_attribute_value(input_path, attribute, ao_tags)
+    tag_sink.set_category_tags(input_path, response, get_folder_categories(tagger_settings), skip_empty=True)
+    return True
 
 
 def main():
     if not tagger_settings.any_folder_tags_selected():
         ap.UI().show_error("No tags selected", "Please select at least one tag category in the settings")
         return
+    try:
+        # the client is only created with the first request, a missing key is reported right away
+        init_openai_key()
+    except ValueError:
+        return
 
+    run_metrics.reset("tag_folders")
     ctx = ap.get_context()
     database = ap.get_api()
 
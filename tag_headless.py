@@ -0,0 +1,337 @@
+"""
+Tag files and folders without the Anchorpoint UI, e.g. on a build server.
+
+Tags are written as JSON lines to --output, or to the attributes of the workspace with --write-attributes,
+which requires running this script with the Python of Anchorpoint's command line tool.
+Settings not given on the command line are taken from the action settings when apsync is available.
+
+Usage:
+  python tag_headless.py files PATH... --output tags.jsonl [--processes 8] [--concurrency 4]
+  python tag_headless.py folders PATH... --output tags.jsonl
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Any, Iterator, Optional
+
+from PIL import Image
+
+from ai.batching import AdaptiveBatchSizer, images_per_request, iter_adaptive_batches, max_images_per_request, \
+    request_output_token_budget, request_with_bisection, target_request_latency
+from ai.client import OpenAIClient
+from ai.constants import OPENAI_API_BASE_URL, openai_model, preview_max_dimension
+from ai.dispatch import dispatch_batches
+from ai.ledger import RunBudget, estimate_cost, get_usage_ledger
+from ai.prompts import build_file_prompt, build_file_response_format, build_folder_payload, build_folder_prompt, \
+    build_folder_request_prompt, build_folder_response_format, build_uploads_payload, get_file_categories, \
+    get_folder_categories, output_token_count
+from ai.tagging import request_folder_tags, request_image_tags
+from common.logging import log, log_err
+from common.metrics import format_summary, run_metrics, span, write_run_metrics
+from common.settings import tagger_settings
+from folders.summary import build_folder_summary
+from folders.tree import build_tree_index
+from image.pool import PreprocessResult, iter_preprocessed
+from labels.aliases import get_alias_index
+from labels.extensions import filter_ignored_extensions, ignored_extensions
+from labels.sinks import JsonLinesTagSink, TagSink
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["files", "folders"], help="Tag image files or whole folders")
+    parser.add_argument("paths", nargs="+", help="Files and folders to tag, folders are searched recursively in files mode")
+
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--output", help="JSON lines file the tags are written to, - for stdout")
+    output.add_argument(
+        "--write-attributes", action="store_true", help="Write the tags to the attributes of the workspace")
+
+    parser.add_argument("--api-key", help="OpenAI API key, defaults to OPENAI_API_KEY or the action settings")
+    parser.add_argument(
+        "--base-url", default=os.environ.get("OPENAI_BASE_URL") or OPENAI_API_BASE_URL,
+        help="Base URL of the OpenAI API, defaults to OPENAI_BASE_URL")
+    parser.add_argument("--model", default=openai_model)
+    parser.add_argument("--concurrency", type=int, help="Maximum number of requests in flight")
+    parser.add_argument(
+        "--processes", type=int, default=0, help="Processes preprocessing images, 0 uses all cores (default)")
+    parser.add_argument("--timeout", type=int, help="Seconds to wait for a response")
+    parser.add_argument("--alias-file", help="JSON file with tag aliases")
+    parser.add_argument("--verbose", action="store_true", help="Print debug output")
+    parser.add_argument("--metrics-file", help="Prometheus text file the metrics of the run are written to")
+    parser.add_argument(
+        "--budget", type=float, help="Maximum cost in USD of all runs within the budget period, 0 for no limit")
+    parser.add_argument("--budget-period-days", type=int, help="Length of the budget period")
+
+    files = parser.add_argument_group("files")
+    files.add_argument("--types", action=argparse.BooleanOptionalAction, help="Tag content types")
+    files.add_argument("--genres", action=argparse.BooleanOptionalAction, help="Tag genres")
+    files.add_argument("--objects", action=argparse.BooleanOptionalAction, help="Tag objects and keywords")
+    files.add_argument("--objects-min", type=int)
+    files.add_argument("--objects-max", type=int)
+    files.add_argument("--image-format", choices=["JPEG", "WEBP", "PNG"])
+    files.add_argument("--image-quality", type=int)
+
+    folders = parser.add_argument_group("folders")
+    folders.add_argument("--engines", action=argparse.BooleanOptionalAction, help="Tag required game engines")
+    folders.add_argument("--token-budget", type=int, help="Maximum tokens of a folder summary")
+    folders.add_argument("--summary-depth", type=int, help="Deepest folder level in a summary")
+    return parser.parse_args(argv)
+
+
+def apply_settings(args: argparse.Namespace):
+    """
+    Override the stored settings with the ones given on the command line, prompts and schemas are built from them
+    """
+    overrides = {
+        "file_label_ai_types": args.types,
+        "file_label_ai_genres": args.genres,
+        "file_label_ai_objects": args.objects,
+        "file_label_ai_objects_min": args.objects_min,
+        "file_label_ai_objects_max": args.objects_max,
+        "image_format": args.image_format,
+        "image_quality": args.image_quality,
+        "folder_use_ai_engines": args.engines,
+        "folder_use_ai_types": args.types,
+        "folder_use_ai_genres": args.genres,
+        "folder_token_budget": args.token_budget,
+        "folder_summary_depth": args.summary_depth,
+        "file_max_concurrent_requests": args.concurrency,
+        "folder_max_concurrent_requests": args.concurrency,
+        "request_timeout": args.timeout,
+        "alias_file": args.alias_file,
+        "metrics_prometheus_file": args.metrics_file,
+        "budget_limit": args.budget,
+        "budget_period_days": args.budget_period_days,
+    }
+    for name, value in overrides.items():
+        if value is not None:
+            setattr(tagger_settings, name, value)
+    if args.verbose:
+        tagger_settings.debug_log = True
+
+
+def create_client(args: argparse.Namespace) -> OpenAIClient:
+    api_key = args.api_key or os.environ.get("OPENAI_API_KEY") or tagger_settings.openai_api_key
+    if not api_key:
+        raise ValueError("No API key set, pass --api-key or set OPENAI_API_KEY")
+
+    return OpenAIClient(
+        api_key,
+        tagger_settings.request_timeout,
+        tagger_settings.request_gzip,
+        max(10, tagger_settings.file_max_concurrent_requests, tagger_settings.folder_max_concurrent_requests),
+        tagger_settings.request_max_retries,
+        args.base_url)
+
+
+def create_tag_sink(args: argparse.Namespace, attribute_names: list[str]) -> TagSink:
+    alias_index = get_alias_index(tagger_settings.alias_file)
+    if not args.write_attributes:
+        return JsonLinesTagSink(args.output, alias_index)
+
+    # only available inside Anchorpoint's command line tool
+    import anchorpoint as ap
+    from labels.attributes import AttributeTagSink, ensure_attribute
+
+    database = ap.get_api()
+    attributes = [ensure_attribute(database, attribute_name) for attribute_name in attribute_names]
+    return AttributeTagSink(database, attributes, alias_index)
+
+
+def report_progress(label: str, done: int, total: int, start_time: float):
+    elapsed = time.perf_counter() - start_time
+    print(f"{label}: {done} of {total} ({done / max(elapsed, 1e-9):.1f}/s)", file=sys.stderr)
+
+
+def collect_image_files(paths: list[str]) -> list[str]:
+    """
+    Images among the paths and inside the folders, other files have no preview without Anchorpoint
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, file_names in os.walk(path):
+                files.extend(os.path.join(root, file_name) for file_name in file_names)
+        else:
+            files.append(path)
+
+    image_extensions = Image.registered_extensions()
+    image_files = []
+    for file in filter_ignored_extensions(files, ignored_extensions):
+        if os.path.splitext(file)[1].lower() in image_extensions:
+            image_files.append(file)
+        else:
+            log(f"Skipping {file}, it is not an image")
+    return image_files
+
+
+def tag_files(args: argparse.Namespace, client: OpenAIClient, tag_sink: TagSink, run_budget: RunBudget) -> list[str]:
+    """
+    Preprocess images on a process pool and request tags while later images are still being preprocessed
+    :return list[str]: Files that were not tagged
+    """
+    prompt = build_file_prompt(tagger_settings)
+    response_format = build_file_response_format(tagger_settings)
+    categories = get_file_categories(tagger_settings)
+    with span("discovery"):
+        image_files = collect_image_files(args.paths)
+    sizer = AdaptiveBatchSizer(
+        images_per_request, max_images_per_request, request_output_token_budget, output_token_count,
+        target_request_latency)
+    failed_files = []
+    tagged_files: set[str] = set()
+    tagged_count = 0
+    start_time = time.perf_counter()
+    log(f"Started tagging {len(image_files)} files")
+
+    def iter_images() -> Iterator[PreprocessResult]:
+        for result in iter_preprocessed(
+                image_files, preview_max_dimension, tagger_settings.image_format, tagger_settings.image_quality,
+                args.processes):
+            run_metrics.observe("preprocess", result.seconds)
+            if result.image is None:
+                log_err(f"Failed to preprocess {result.path}: {result.error}")
+                failed_files.append(result.path)
+                continue
+            yield result
+
+    def request_tags(batch: list[PreprocessResult]) -> Optional[list[Any]]:
+        payload, estimated_tokens = build_uploads_payload(
+            prompt, [os.path.basename(result.path) for result in batch], [result.image for result in batch],
+            response_format, args.model)
+        estimated_cost = estimate_cost(
+            len(prompt) // 4, sum(result.image.width * result.image.height for result in batch),
+            len(batch) * output_token_count)
+        return request_image_tags(
+            client, run_budget, payload, estimated_tokens, estimated_cost, args.model, len(batch), sizer)
+
+    def on_response(batch: list[PreprocessResult], response: list[Optional[Any]]):
+        nonlocal tagged_count
+        for result, tags in zip(batch, response):
+            if tags is None:
+                failed_files.append(result.path)
+                continue
+            tag_sink.set_category_tags(result.path, tags, categories)
+            tagged_files.add(result.path)
+            tagged_count += 1
+        tag_sink.flush()
+        report_progress("Tagged files", tagged_count, len(image_files), start_time)
+
+    def on_error(batch: list[PreprocessResult], error: Exception):
+        log_err(f"Failed to tag {len(batch)} files: {error}")
+        failed_files.extend(result.path for result in batch)
+
+    completed = dispatch_batches(
+        iter_adaptive_batches(iter_images(), sizer),
+        lambda batch: request_with_bisection(batch, request_tags, sizer),
+        on_response,
+        tagger_settings.file_max_concurrent_requests,
+        lambda: run_budget.exhausted,
+        on_error=on_error)
+    if not completed:
+        # files that were never requested once the budget was reached
+        answered = tagged_files | set(failed_files)
+        failed_files.extend(file for file in image_files if file not in answered)
+    return failed_files
+
+
+def tag_folders(
+        args: argparse.Namespace, client: OpenAIClient, tag_sink: TagSink, run_budget: RunBudget) -> list[str]:
+    """
+    :return list[str]: Folders that were not tagged
+    """
+    prompt = build_folder_prompt(tagger_settings)
+    response_format = build_folder_response_format(tagger_settings)
+    categories = get_folder_categories(tagger_settings)
+    folders = [path for path in args.paths if os.path.isdir(path)]
+    with span("discovery"):
+        tree_index = build_tree_index(folders)
+    failed_folders = [path for path in args.paths if not os.path.isdir(path)]
+    tagged_folders: set[str] = set()
+    tagged_count = 0
+    start_time = time.perf_counter()
+
+    def request_tags(folder: str) -> dict[str, Any]:
+        with span("summary"):
+            folder_summary = build_folder_summary(
+                tree_index.get(folder), tagger_settings.folder_token_budget, tagger_settings.folder_summary_depth)
+        in_prompt = build_folder_request_prompt(prompt, os.path.basename(folder), folder_summary)
+        payload, estimated_tokens = build_folder_payload(in_prompt, response_format, args.model)
+        estimated_cost = estimate_cost(len(in_prompt) // 4, output_tokens=output_token_count)
+        return request_folder_tags(client, run_budget, payload, estimated_tokens, estimated_cost, args.model)
+
+    def on_response(folder: str, response: dict[str, Any]):
+        nonlocal tagged_count
+        if response.get("error"):
+            log_err(f"Failed to tag {folder}: {response['error']}")
+            failed_folders.append(folder)
+            return
+        tagged_folders.add(folder)
+        tag_sink.set_category_tags(folder, response, categories, skip_empty=True)
+        tag_sink.flush()
+        tagged_count += 1
+        report_progress("Tagged folders", tagged_count, len(folders), start_time)
+
+    def on_error(folder: str, error: Exception):
+        log_err(f"Failed to tag {folder}: {error}")
+        failed_folders.append(folder)
+
+    completed = dispatch_batches(
+        folders, request_tags, on_response, tagger_settings.folder_max_concurrent_requests,
+        lambda: run_budget.exhausted, on_error=on_error)
+    if not completed:
+        # folders that were never requested once the budget was reached
+        answered = tagged_folders | set(failed_folders)
+        failed_folders.extend(folder for folder in folders if folder not in answered)
+    return failed_folders
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+    apply_settings(args)
+    if args.mode == "files":
+        categories = get_file_categories(tagger_settings)
+    else:
+        categories = get_folder_categories(tagger_settings)
+    if not categories:
+        log_err("No tags selected, enable at least one category")
+        return 2
+
+    try:
+        client = create_client(args)
+    except ValueError as e:
+        log_err(str(e))
+        return 2
+
+    run_metrics.reset(f"headless_{args.mode}")
+    tag_sink = create_tag_sink(args, list(categories.values()))
+    run_budget = RunBudget(
+        get_usage_ledger(), f"headless_{args.mode}", 0.0, tagger_settings.budget_limit,
+        tagger_settings.budget_period_days)
+    try:
+        if args.mode == "files":
+            failed = tag_files(args, client, tag_sink, run_budget)
+        else:
+            failed = tag_folders(args, client, tag_sink, run_budget)
+    finally:
+        tag_sink.close()
+        client.close()
+        print(format_summary(), file=sys.stderr)
+        print(run_budget.report(), file=sys.stderr)
+        try:
+            write_run_metrics(tagger_settings.metrics_prometheus_file)
+        except OSError as e:
+            log_err(f"Failed to write run metrics: {e}")
+
+    if run_budget.exhausted:
+        log_err(f"Budget of ${tagger_settings.budget_limit:g} for {tagger_settings.budget_period_days} days reached")
+    if failed:
+        log_err(f"{len(failed)} {args.mode} were not tagged:\n" + "\n".join(failed))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())